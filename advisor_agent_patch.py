@@ -7,9 +7,11 @@ Integrado com: IPC (PostgreSQL), Scheduler periódico, API principal (8503).
 import os
 import sys
 import asyncio
+import hashlib
 import json
 import time
 import logging
+import re
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List, Any
 from fastapi import FastAPI, HTTPException, Request
@@ -17,7 +19,8 @@ from fastapi.responses import Response
 from pydantic import BaseModel
 import httpx
 import psutil
-import subprocess
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
 
 # Adicionar path para imports do projeto principal
@@ -40,6 +43,12 @@ except ImportError:
     IPC_AVAILABLE = False
     logger.warning("IPC module não disponível")
 
+try:
+    import psycopg2
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
 try:
     from rag import ServerKnowledgeRAG
     RAG_AVAILABLE = True
@@ -113,6 +122,71 @@ advisor_llm_tokens_total = Counter(
     ["type"]  # type in {"prompt", "response", "total"}
 )
 
+# Chamadas ao LLM que pegaram carona numa chamada idêntica em andamento
+advisor_llm_coalesced_total = Counter(
+    "advisor_llm_coalesced_total",
+    "Chamadas ao LLM atendidas por uma chamada idêntica já em andamento"
+)
+
+# --- Métricas do pool IPC ---
+advisor_ipc_queue_age_seconds = Histogram(
+    "advisor_ipc_queue_age_seconds",
+    "Idade do request IPC (criação → despacho) em segundos",
+    ["type"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+advisor_ipc_lag_seconds = Gauge(
+    "advisor_ipc_lag_seconds",
+    "Idade do request IPC pendente mais antigo na última busca"
+)
+
+advisor_ipc_processing_seconds = Histogram(
+    "advisor_ipc_processing_seconds",
+    "Tempo de processamento de um request IPC em segundos",
+    ["type"],
+    buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+advisor_ipc_inflight = Gauge(
+    "advisor_ipc_inflight",
+    "Requests IPC em processamento",
+    ["type"]
+)
+
+advisor_ipc_wakeups_total = Counter(
+    "advisor_ipc_wakeups_total",
+    "Despertares do worker IPC",
+    ["source"]  # notify | poll | done
+)
+
+# --- Métricas de alertas (agrupamento por fingerprint alert_name/instance) ---
+advisor_alerts_received_total = Counter(
+    "advisor_alerts_received_total",
+    "Alertas recebidos do bus",
+    ["severity"]
+)
+
+advisor_alerts_merged_total = Counter(
+    "advisor_alerts_merged_total",
+    "Alertas que entraram numa análise do mesmo grupo já em andamento"
+)
+
+advisor_alerts_suppressed_total = Counter(
+    "advisor_alerts_suppressed_total",
+    "Alertas respondidos com a análise recente do grupo (sem nova análise)"
+)
+
+advisor_alert_analyses_total = Counter(
+    "advisor_alert_analyses_total",
+    "Análises executadas para grupos de alertas"
+)
+
+advisor_alert_groups_active = Gauge(
+    "advisor_alert_groups_active",
+    "Grupos de alertas dentro da janela de agrupamento"
+)
+
 # --- Métricas Scheduler ---
 advisor_scheduler_runs_total = Counter(
     "advisor_scheduler_runs_total",
@@ -173,6 +247,331 @@ advisor_rag_reindex_total = Counter(
     "Total RAG re-index operations"
 )
 
+# --- Probe metrics (coletores de sistema: ss, docker, systemctl, psutil) ---
+advisor_probe_duration_seconds = Histogram(
+    "advisor_probe_duration_seconds",
+    "Duração dos probes de sistema em segundos",
+    ["probe"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0)
+)
+
+advisor_probe_errors_total = Counter(
+    "advisor_probe_errors_total",
+    "Probes de sistema que falharam ou estouraram o timeout",
+    ["probe", "reason"]
+)
+
+
+class ProbeRunner:
+    """Executa coletores de sistema sem bloquear o event loop.
+
+    - comandos externos via `asyncio.create_subprocess_exec` (processo morto no timeout);
+    - chamadas bloqueantes (psutil) num pool de threads limitado;
+    - CPU amostrada numa janela compartilhada: chamadas concorrentes aguardam a
+      mesma amostra em vez de abrir uma janela cada.
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 10.0, cpu_window: float = 1.0):
+        self.timeout = timeout
+        self.cpu_window = cpu_window
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="advisor-probe")
+        self._cpu_sample: Optional[asyncio.Future] = None
+
+    async def run_command(self, probe: str, args: List[str], timeout: Optional[float] = None) -> Optional[str]:
+        """Roda o comando e devolve o stdout; None em erro ou timeout."""
+        start_time = time.time()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            advisor_probe_errors_total.labels(probe=probe, reason="error").inc()
+            logger.debug(f"Probe {probe} falhou: {e}")
+            return None
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout or self.timeout)
+            return stdout.decode(errors="replace")
+        except asyncio.TimeoutError:
+            advisor_probe_errors_total.labels(probe=probe, reason="timeout").inc()
+            logger.warning(f"Probe {probe} excedeu {timeout or self.timeout}s")
+            return None
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            advisor_probe_duration_seconds.labels(probe=probe).observe(time.time() - start_time)
+
+    async def run_blocking(self, probe: str, fn, *args, timeout: Optional[float] = None):
+        """Roda `fn(*args)` no pool de probes; None em erro ou timeout."""
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, fn, *args), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            advisor_probe_errors_total.labels(probe=probe, reason="timeout").inc()
+            logger.warning(f"Probe {probe} excedeu {timeout or self.timeout}s")
+            return None
+        except Exception as e:
+            advisor_probe_errors_total.labels(probe=probe, reason="error").inc()
+            logger.debug(f"Probe {probe} falhou: {e}")
+            return None
+        finally:
+            advisor_probe_duration_seconds.labels(probe=probe).observe(time.time() - start_time)
+
+    async def cpu_percent(self) -> float:
+        """CPU (%) medida em `cpu_window` segundos, compartilhada entre chamadas concorrentes."""
+        if self._cpu_sample is None or self._cpu_sample.done():
+            self._cpu_sample = asyncio.ensure_future(self._sample_cpu())
+        return await asyncio.shield(self._cpu_sample)
+
+    async def _sample_cpu(self) -> float:
+        # cpu_times() em vez de cpu_percent(interval=None): não depende do estado
+        # global do psutil, que outras chamadas (ex.: /health) resetam
+        start_time = time.time()
+        before = psutil.cpu_times()
+        await asyncio.sleep(self.cpu_window)
+        after = psutil.cpu_times()
+        advisor_probe_duration_seconds.labels(probe="cpu").observe(time.time() - start_time)
+        total = sum(after) - sum(before)
+        idle = (after.idle + getattr(after, "iowait", 0)) - (before.idle + getattr(before, "iowait", 0))
+        if total <= 0:
+            return 0.0
+        return round(max(0.0, min(100.0, 100.0 * (total - idle) / total)), 1)
+
+    async def host_usage(self):
+        """(virtual_memory, disk_usage('/')) sem bloquear; None se o probe falhar."""
+        return await self.run_blocking("host", lambda: (psutil.virtual_memory(), psutil.disk_usage('/')))
+
+
+class MetricsSampler:
+    """Amostrador de métricas do host em ring buffer de tamanho fixo.
+
+    Uma task em background chama `sample()` a cada `interval` segundos; cada série
+    (CPU, memória, disco, load, RSS/CPU do processo) é um `array('d')` com `slots`
+    posições. /health lê o último snapshot em O(1) e as análises usam agregados
+    de janela curta (média, p95, tendência).
+    """
+
+    SERIES = ("cpu_percent", "memory_percent", "disk_percent", "load1", "process_rss_mb", "process_cpu_percent")
+
+    def __init__(self, slots: int = 720, interval: float = 5.0):
+        self.slots = max(2, slots)
+        self.interval = interval
+        self._ts = array('d', [0.0] * self.slots)
+        self._series = {name: array('d', [0.0] * self.slots) for name in self.SERIES}
+        self._next = 0
+        self._count = 0
+        self._latest: Dict[str, Any] = {}
+        self._process = psutil.Process()
+        self._process.cpu_percent(None)
+        self._last_cpu = psutil.cpu_times()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def sample(self) -> Dict[str, Any]:
+        """Coleta uma amostra (sem janelas bloqueantes: CPU por delta de cpu_times)."""
+        now = time.time()
+        cpu = psutil.cpu_times()
+        total = sum(cpu) - sum(self._last_cpu)
+        idle = (cpu.idle + getattr(cpu, "iowait", 0)) - (self._last_cpu.idle + getattr(self._last_cpu, "iowait", 0))
+        self._last_cpu = cpu
+        cpu_percent = round(max(0.0, min(100.0, 100.0 * (total - idle) / total)), 1) if total > 0 else 0.0
+        mem = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        load1, load5, load15 = os.getloadavg()
+        values = {
+            "cpu_percent": cpu_percent,
+            "memory_percent": mem.percent,
+            "disk_percent": disk.percent,
+            "load1": load1,
+            "process_rss_mb": self._process.memory_info().rss / (1024**2),
+            "process_cpu_percent": self._process.cpu_percent(None),
+        }
+
+        i = self._next
+        self._ts[i] = now
+        for name, value in values.items():
+            self._series[name][i] = value
+        self._next = (i + 1) % self.slots
+        self._count = min(self._count + 1, self.slots)
+
+        self._latest = {
+            "cpu_percent": cpu_percent,
+            "memory_percent": mem.percent,
+            "memory_available_gb": round(mem.available / (1024**3), 2),
+            "disk_percent": disk.percent,
+            "disk_free_gb": round(disk.free / (1024**3), 2),
+            "loadavg": {"1m": round(load1, 2), "5m": round(load5, 2), "15m": round(load15, 2)},
+            "process": {
+                "rss_mb": round(values["process_rss_mb"], 1),
+                "cpu_percent": values["process_cpu_percent"],
+            },
+            "sampled_at": now,
+        }
+        return self._latest
+
+    def latest(self) -> Dict[str, Any]:
+        """Último snapshot ({} se ainda não houve amostra)."""
+        return self._latest
+
+    def age(self) -> float:
+        """Segundos desde a última amostra (inf se nenhuma)."""
+        return time.time() - self._latest["sampled_at"] if self._latest else float("inf")
+
+    def window(self, seconds: float) -> Dict[str, Dict[str, float]]:
+        """Média, p95 e tendência (unidades/min) de cada série nos últimos `seconds`."""
+        cutoff = time.time() - seconds
+        idx = []
+        for k in range(1, self._count + 1):
+            i = (self._next - k) % self.slots
+            if self._ts[i] < cutoff:
+                break
+            idx.append(i)
+        if not idx:
+            return {}
+        idx.reverse()
+        ts = [self._ts[i] for i in idx]
+        result: Dict[str, Dict[str, float]] = {}
+        for name, series in self._series.items():
+            values = [series[i] for i in idx]
+            ordered = sorted(values)
+            result[name] = {
+                "avg": round(sum(values) / len(values), 2),
+                "p95": round(ordered[int(0.95 * (len(ordered) - 1))], 2),
+                "trend_per_min": round(self._slope(ts, values) * 60, 3),
+            }
+        result["samples"] = {"count": len(idx), "seconds": round(ts[-1] - ts[0], 1)}
+        return result
+
+    @staticmethod
+    def _slope(ts: List[float], values: List[float]) -> float:
+        """Inclinação por mínimos quadrados (unidades/segundo)."""
+        n = len(ts)
+        if n < 2:
+            return 0.0
+        mean_t = sum(ts) / n
+        mean_v = sum(values) / n
+        den = sum((t - mean_t) ** 2 for t in ts)
+        if den == 0:
+            return 0.0
+        return sum((t - mean_t) * (v - mean_v) for t, v in zip(ts, values)) / den
+
+    async def run(self, probes: "ProbeRunner"):
+        """Loop de amostragem; a coleta roda no pool de probes."""
+        while True:
+            await probes.run_blocking("sampler", self.sample)
+            await asyncio.sleep(self.interval)
+
+
+class IpcNotifyListener:
+    """LISTEN no Postgres: acorda o worker IPC assim que um NOTIFY chega.
+
+    Usa uma conexão psycopg2 dedicada em autocommit, monitorada pelo event loop
+    (`add_reader`), sem threads nem polling. Se a conexão cair, `active` vira
+    False e o worker volta ao polling até a próxima tentativa de `start()`.
+    O polling só é espaçado depois que um NOTIFY chega de fato (`notified`):
+    sem publicador emitindo `pg_notify`, o LISTEN não substitui o poll.
+    """
+
+    def __init__(self, dsn: Optional[str], channel: str, wakeup: asyncio.Event, retry_interval: float = 60.0):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", channel):
+            raise ValueError(f"Canal NOTIFY inválido: {channel!r}")
+        self.dsn = dsn
+        self.channel = channel
+        self.wakeup = wakeup
+        self.retry_interval = retry_interval
+        self._conn = None
+        self._retry_at = 0.0
+        self.notified = False
+
+    @property
+    def active(self) -> bool:
+        return self._conn is not None
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connect_timeout=5)
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        return conn
+
+    async def start(self) -> bool:
+        """Abre a conexão LISTEN (no máximo uma tentativa a cada `retry_interval`)."""
+        if self.active:
+            return True
+        if not PSYCOPG2_AVAILABLE or not self.dsn or time.monotonic() < self._retry_at:
+            return False
+        self._retry_at = time.monotonic() + self.retry_interval
+        try:
+            conn = await asyncio.to_thread(self._connect)
+            asyncio.get_running_loop().add_reader(conn.fileno(), self._on_readable)
+        except Exception as e:
+            logger.warning(f"IPC LISTEN indisponível ({e}); usando polling")
+            return False
+        self._conn = conn
+        logger.info(f"🔔 IPC LISTEN ativo no canal '{self.channel}'")
+        return True
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except Exception as e:
+            logger.warning(f"Conexão LISTEN do IPC caiu ({e}); voltando ao polling")
+            self.stop()
+            self.wakeup.set()
+            return
+        if self._conn.notifies:
+            self._conn.notifies.clear()
+            self.notified = True
+            advisor_ipc_wakeups_total.labels(source="notify").inc()
+            self.wakeup.set()
+
+    def poll_interval(self, poll: float, fallback: float) -> float:
+        """Intervalo do poll de fallback: espaçado só com NOTIFY comprovadamente chegando."""
+        return fallback if self.active and self.notified else poll
+
+    def stop(self):
+        self.notified = False
+        if self._conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+
+class AlertGroup:
+    """Alertas com o mesmo fingerprint (alert_name, instance) dentro da janela.
+
+    A primeira ocorrência dispara a análise (`analysis`); as demais aguardam ou
+    reaproveitam o mesmo resultado enquanto ele tiver menos de `alert_window` s
+    desde que ficou pronto (`completed_at`).
+    """
+
+    def __init__(self, fingerprint: tuple, analysis: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.analysis = analysis
+        self.completed_at: Optional[float] = None
+        self.count = 0
+        self.reported = False
+        analysis.add_done_callback(self._completed)
+
+    def _completed(self, analysis: asyncio.Future):
+        self.completed_at = time.time()
+
+    def failed(self) -> bool:
+        return self.analysis.done() and (self.analysis.cancelled() or self.analysis.exception() is not None)
+
+    def expired(self, now: float, window: float) -> bool:
+        """Resultado pronto há mais de `window` s: o próximo alerta reanalisa."""
+        return self.completed_at is not None and now - self.completed_at > window
+
 
 class GenerateRequest(BaseModel):
     prompt: str
@@ -251,6 +650,48 @@ class HomelabAdvisor:
                     logger.debug("Secrets Agent lookup failed or unreachable; continuing without it")
 
         self.api_base_url = os.environ.get("API_BASE_URL", "http://127.0.0.1:8503")
+
+        # Clientes HTTP compartilhados (pool + keep-alive) por upstream: Ollama e API 8503
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._http_limits = httpx.Limits(
+            max_connections=int(os.environ.get("ADVISOR_HTTP_MAX_CONNECTIONS", "10")),
+            max_keepalive_connections=int(os.environ.get("ADVISOR_HTTP_MAX_KEEPALIVE", "5")),
+        )
+        # Pool de processamento IPC: concorrência total e limite por tipo de request
+        self.ipc_pool_size = int(os.environ.get("ADVISOR_IPC_WORKERS", "4"))
+        self.ipc_fetch_limit = int(os.environ.get("ADVISOR_IPC_FETCH_LIMIT", "10"))
+        self.ipc_backlog_max = int(os.environ.get("ADVISOR_IPC_BACKLOG_MAX", "100"))
+        self.ipc_type_caps = {"performance": 1, "security": 1, "architecture": 1, "llm": 2}
+        for item in os.environ.get("ADVISOR_IPC_TYPE_CAPS", "").split(","):
+            if "=" in item:
+                name, cap = item.split("=", 1)
+                self.ipc_type_caps[name.strip()] = int(cap)
+        self.ipc_notify_channel = os.environ.get("ADVISOR_IPC_NOTIFY_CHANNEL", "agent_ipc")
+        self.ipc_poll_interval = float(os.environ.get("ADVISOR_IPC_POLL_SEC", "5"))
+        self.ipc_fallback_poll_interval = float(os.environ.get("ADVISOR_IPC_FALLBACK_POLL_SEC", "30"))
+        self._ipc_inflight: Dict[Any, str] = {}  # id do request → tipo
+        self._ipc_queue: List[tuple] = []  # (request, tipo) já buscados, aguardando vaga
+        self._ipc_tasks: set = set()
+        self._ipc_wakeup: Optional[asyncio.Event] = None
+
+        # Agrupamento de alertas: fingerprint → grupo (janela deslizante)
+        self.alert_window = float(os.environ.get("ADVISOR_ALERT_WINDOW_SEC", "120"))
+        self._alert_groups: Dict[tuple, AlertGroup] = {}
+        # Chamadas ao LLM em andamento por prompt (coalescing)
+        self._llm_inflight: Dict[str, asyncio.Future] = {}
+
+        # Probes de sistema (não bloqueiam o event loop)
+        self.probes = ProbeRunner(
+            max_workers=int(os.environ.get("ADVISOR_PROBE_WORKERS", "4")),
+            timeout=float(os.environ.get("ADVISOR_PROBE_TIMEOUT", "10")),
+            cpu_window=float(os.environ.get("ADVISOR_CPU_SAMPLE_SEC", "1")),
+        )
+        # Métricas do host amostradas em background (ring buffer)
+        self.sampler = MetricsSampler(
+            slots=int(os.environ.get("ADVISOR_SAMPLER_SLOTS", "720")),
+            interval=float(os.environ.get("ADVISOR_SAMPLER_INTERVAL_SEC", "5")),
+        )
+        self.trend_window = int(os.environ.get("ADVISOR_TREND_WINDOW_SEC", "900"))
         self.bus_poll_interval = int(os.environ.get("BUS_POLL_INTERVAL_SEC", "5"))
         
         # Intervalos do scheduler (minutos)
@@ -405,8 +846,37 @@ class HomelabAdvisor:
             logger.error(f"RAG reindex error: {e}")
             return 0
 
+    def http_client(self, upstream: str) -> httpx.AsyncClient:
+        """Cliente compartilhado do upstream ('ollama' ou 'api'), criado sob demanda."""
+        client = self._http_clients.get(upstream)
+        if client is None or client.is_closed:
+            timeout = 180.0 if upstream == "ollama" else 15.0
+            client = httpx.AsyncClient(timeout=timeout, limits=self._http_limits)
+            self._http_clients[upstream] = client
+        return client
+
+    async def close_http_clients(self):
+        for client in self._http_clients.values():
+            await client.aclose()
+        self._http_clients.clear()
+
     async def call_llm(self, prompt: str, max_tokens: int = 4096) -> str:
-        """Chama LLM para análise/recomendações"""
+        """Chama LLM para análise/recomendações
+
+        Prompts idênticos concorrentes (ex.: rajada de alertas) compartilham uma
+        única chamada ao Ollama; o cancelamento de um chamador não afeta os demais.
+        """
+        key = hashlib.sha256(f"{self.ollama_model}\0{max_tokens}\0{prompt}".encode()).hexdigest()
+        pending = self._llm_inflight.get(key)
+        if pending is not None:
+            advisor_llm_coalesced_total.inc()
+            return await asyncio.shield(pending)
+        task = asyncio.ensure_future(self._call_llm(prompt, max_tokens))
+        self._llm_inflight[key] = task
+        task.add_done_callback(lambda _: self._llm_inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _call_llm(self, prompt: str, max_tokens: int) -> str:
         start_time = time.time()
         try:
             url = f"{self.ollama_host}/api/generate"
@@ -416,32 +886,32 @@ class HomelabAdvisor:
                 "stream": False,
                 "options": {"num_predict": max_tokens}
             }
-            async with httpx.AsyncClient(timeout=180.0) as client:
-                # Audit log: provider information (do NOT log secrets)
-                logger.info(
-                    f"LLM request provider=ollama host={self.ollama_host} model={self.ollama_model} prompt_len={len(prompt)}"
-                )
-                r = await client.post(url, json=payload)
-                r.raise_for_status()
-                data = r.json()
-
-                # Estimate token usage (simple heuristic: ~4 chars per token)
-                def _approx_tokens(s: str) -> int:
-                    if not s:
-                        return 0
-                    return max(1, int(len(s) / 4))
-
-                response_text = data.get("response", "") or ""
-                prompt_tokens = _approx_tokens(prompt)
-                response_tokens = _approx_tokens(response_text)
-                total_tokens = prompt_tokens + response_tokens
-
-                advisor_llm_tokens_total.labels(type="prompt").inc(prompt_tokens)
-                advisor_llm_tokens_total.labels(type="response").inc(response_tokens)
-                advisor_llm_tokens_total.labels(type="total").inc(total_tokens)
-
-                advisor_llm_calls_total.labels(status="success").inc()
-                return response_text
+            client = self.http_client("ollama")
+            # Audit log: provider information (do NOT log secrets)
+            logger.info(
+                f"LLM request provider=ollama host={self.ollama_host} model={self.ollama_model} prompt_len={len(prompt)}"
+            )
+            r = await client.post(url, json=payload)
+            r.raise_for_status()
+            data = r.json()
+
+            # Estimate token usage (simple heuristic: ~4 chars per token)
+            def _approx_tokens(s: str) -> int:
+                if not s:
+                    return 0
+                return max(1, int(len(s) / 4))
+
+            response_text = data.get("response", "") or ""
+            prompt_tokens = _approx_tokens(prompt)
+            response_tokens = _approx_tokens(response_text)
+            total_tokens = prompt_tokens + response_tokens
+
+            advisor_llm_tokens_total.labels(type="prompt").inc(prompt_tokens)
+            advisor_llm_tokens_total.labels(type="response").inc(response_tokens)
+            advisor_llm_tokens_total.labels(type="total").inc(total_tokens)
+
+            advisor_llm_calls_total.labels(status="success").inc()
+            return response_text
         except Exception as exc:
             advisor_llm_calls_total.labels(status="error").inc()
             err_type = type(exc).__name__
@@ -455,18 +925,38 @@ class HomelabAdvisor:
         """Analisa performance do sistema"""
         start_time = time.time()
         try:
-            # Coletar métricas
-            cpu_percent = psutil.cpu_percent(interval=1)
-            mem = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
-            
-            metrics = {
-                "cpu_percent": cpu_percent,
-                "memory_percent": mem.percent,
-                "memory_available_gb": mem.available / (1024**3),
-                "disk_percent": disk.percent,
-                "disk_free_gb": disk.free / (1024**3)
-            }
+            # Métricas atuais: snapshot do sampler se recente; senão, probe direto
+            # (amostra de CPU e memória/disco em paralelo, fora do loop)
+            if self.sampler.age() <= 2 * self.sampler.interval:
+                snapshot = self.sampler.latest()
+                metrics = {k: snapshot[k] for k in ("cpu_percent", "memory_percent", "memory_available_gb",
+                                                    "disk_percent", "disk_free_gb")}
+            else:
+                cpu_percent, usage = await asyncio.gather(self.probes.cpu_percent(), self.probes.host_usage())
+                if usage is None:
+                    raise RuntimeError("probe de memória/disco indisponível")
+                mem, disk = usage
+                metrics = {
+                    "cpu_percent": cpu_percent,
+                    "memory_percent": mem.percent,
+                    "memory_available_gb": mem.available / (1024**3),
+                    "disk_percent": disk.percent,
+                    "disk_free_gb": disk.free / (1024**3)
+                }
+            cpu_percent = metrics["cpu_percent"]
+
+            # Tendências da janela recente (ring buffer)
+            trends = self.sampler.window(self.trend_window)
+            trend_section = ""
+            if trends:
+                lines = [
+                    f"- {label}: média {trends[key]['avg']}, p95 {trends[key]['p95']}, "
+                    f"tendência {trends[key]['trend_per_min']:+}/min"
+                    for key, label in (("cpu_percent", "CPU %"), ("memory_percent", "Memória %"),
+                                       ("disk_percent", "Disco %"), ("load1", "Load 1m"))
+                ]
+                trend_section = (f"\nTendências (últimos {trends['samples']['seconds'] / 60:.0f}min, "
+                                 f"{trends['samples']['count']} amostras):\n" + "\n".join(lines) + "\n")
             
             # Construir prompt para LLM com contexto RAG
             rag_context = self._get_rag_context(f"performance cpu memory disk {cpu_percent}%")
@@ -478,15 +968,16 @@ class HomelabAdvisor:
 
 Métricas atuais:
 - CPU: {cpu_percent}%
-- Memória: {mem.percent}% ({mem.available / (1024**3):.1f}GB livres)
-- Disco: {disk.percent}% ({disk.free / (1024**3):.1f}GB livres)
-{rag_section}
+- Memória: {metrics['memory_percent']}% ({metrics['memory_available_gb']:.1f}GB livres)
+- Disco: {metrics['disk_percent']}% ({metrics['disk_free_gb']:.1f}GB livres)
+{trend_section}{rag_section}
 Forneça recomendações específicas de otimização de performance."""
             
             recommendations = await self.call_llm(prompt, max_tokens=400)
             
             return {
                 "metrics": metrics,
+                "trends": trends,
                 "recommendations": recommendations,
                 "timestamp": datetime.now().isoformat()
             }
@@ -500,15 +991,8 @@ Forneça recomendações específicas de otimização de performance."""
         start_time = time.time()
         try:
             # Verificar portas abertas
-            try:
-                result = subprocess.run(
-                    ['ss', '-tuln'],
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
-                open_ports = result.stdout
-            except Exception:
+            open_ports = await self.probes.run_command("ss", ['ss', '-tuln'])
+            if open_ports is None:
                 open_ports = "Não foi possível listar portas"
             
             rag_context = self._get_rag_context(f"security ports firewall safeguards {open_ports[:100]}")
@@ -539,28 +1023,16 @@ Analise e forneça:
     
     async def review_architecture(self, context: Dict = None) -> Dict[str, Any]:
         """Revisa arquitetura do sistema"""
-        # Listar containers Docker
-        try:
-            result = subprocess.run(
-                ['docker', 'ps', '--format', '{{.Names}}:{{.Status}}'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            containers = result.stdout
-        except Exception:
+        # Listar containers Docker e serviços systemd (em paralelo)
+        containers, services = await asyncio.gather(
+            self.probes.run_command("docker", ['docker', 'ps', '--format', '{{.Names}}:{{.Status}}']),
+            self.probes.run_command(
+                "systemctl", ['systemctl', 'list-units', '--type=service', '--state=running', '--no-pager']
+            ),
+        )
+        if containers is None:
             containers = "Não foi possível listar containers"
-        
-        # Listar serviços systemd
-        try:
-            result = subprocess.run(
-                ['systemctl', 'list-units', '--type=service', '--state=running', '--no-pager'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            services = result.stdout
-        except Exception:
+        if services is None:
             services = "Não foi possível listar serviços"
         
         rag_context = self._get_rag_context(f"architecture docker containers systemd services {containers[:100]}")
@@ -685,30 +1157,75 @@ Avalie a arquitetura e sugira melhorias para:
         except Exception as e:
             logger.error(f"Erro ao processar mensagem do bus: {e}")
 
+    def _join_alert_group(self, alert_name: str, severity: str, instance: str) -> "tuple[AlertGroup, bool]":
+        """Entra no grupo do fingerprint; cria (e dispara a análise) se não houver um válido."""
+        now = time.time()
+        # O resultado vale `alert_window` s a partir da conclusão da análise: numa
+        # tempestade contínua a recomendação é refeita, não reaproveitada para sempre
+        for fp, group in list(self._alert_groups.items()):
+            if group.expired(now, self.alert_window):
+                del self._alert_groups[fp]
+
+        fingerprint = (alert_name, instance)
+        group = self._alert_groups.get(fingerprint)
+        leader = group is None or group.failed()
+        if leader:
+            advisor_alert_analyses_total.inc()
+            group = AlertGroup(fingerprint, asyncio.ensure_future(self._analyze_alert(alert_name, severity, instance)))
+            self._alert_groups[fingerprint] = group
+        elif group.analysis.done():
+            advisor_alerts_suppressed_total.inc()
+        else:
+            advisor_alerts_merged_total.inc()
+        group.count += 1
+        advisor_alert_groups_active.set(len(self._alert_groups))
+        return group, leader
+
+    async def _analyze_alert(self, alert_name: str, severity: str, instance: str) -> Dict[str, Any]:
+        """Análise única de um grupo de alertas: performance + contexto RAG."""
+        # Buscar contexto RAG relevante para o alerta
+        rag_context = self._get_rag_context(f"alert {alert_name} {severity} {instance}", top_k=3)
+        result = await self.analyze_performance()
+        return {
+            "summary": self._summarize_result('performance', result),
+            "recommendations": result.get('recommendations', ''),
+            "rag_section": f"\nContexto RAG:\n{rag_context}" if rag_context else "",
+        }
+
     async def _handle_alert(self, message):
-        """Trata alertas vindos do bus: executa check rápido e responde ao originador."""
+        """Trata alertas vindos do bus: executa check rápido e responde ao originador.
+
+        Alertas com o mesmo (alert_name, instance) dentro de `alert_window` segundos
+        compartilham uma única análise; cada originador recebe sua resposta.
+        """
         try:
             md = getattr(message, 'metadata', {}) or {}
             severity = (md.get('severity') or md.get('level') or '').lower()
             alert_name = md.get('alert_name') or md.get('name') or 'grafana_alert'
             instance = md.get('instance') or 'unknown'
+            advisor_alerts_received_total.labels(severity=severity or "none").inc()
 
-            logger.info(f"⚠️ Handling alert {alert_name} severity={severity} instance={instance}")
+            if severity not in ('critical', 'warning'):
+                # outros tipos: registrar e ignorar (pode ser expandido)
+                logger.info(f"Alert received (no-op): {alert_name} severity={severity}")
+                return
 
-            # Buscar contexto RAG relevante para o alerta
-            rag_context = self._get_rag_context(f"alert {alert_name} {severity} {instance}", top_k=3)
-            rag_section = f"\nContexto RAG:\n{rag_context}" if rag_context else ""
+            group, leader = self._join_alert_group(alert_name, severity, instance)
+            if leader:
+                logger.info(f"⚠️ Handling alert {alert_name} severity={severity} instance={instance}")
+            else:
+                logger.info(f"⚠️ Alert {alert_name} on {instance} agrupado (#{group.count} na janela)")
+            analysis = await asyncio.shield(group.analysis)
+            summary = analysis["summary"]
+            rag_section = analysis["rag_section"]
+            grouping = {'alert_group_size': group.count, 'alert_group_leader': leader}
 
             # ação para alertas críticos: análise rápida de performance + resposta
             if severity == 'critical':
-                result = await self.analyze_performance()
-                summary = self._summarize_result('performance', result)
-                recommendations = result.get('recommendations', '')
-
                 response_text = (
                     f"Alert handled: {alert_name} ({severity}) on {instance}\n"
                     f"Summary: {summary}\n"
-                    f"Recommendations: {recommendations[:1200]}"
+                    f"Recommendations: {analysis['recommendations'][:1200]}"
                     f"{rag_section}"
                 )
 
@@ -719,14 +1236,16 @@ Avalie a arquitetura e sugira melhorias para:
                             source='homelab-advisor',
                             target=getattr(message, 'source', 'monitoring'),
                             content=response_text,
-                            metadata={'original_message_id': getattr(message, 'id', None), 'alert_handled': True}
+                            metadata={'original_message_id': getattr(message, 'id', None), 'alert_handled': True,
+                                      **grouping}
                         )
                         logger.info(f"📨 IPC response for alert published: {rid}")
                     except Exception as e:
                         logger.error(f"Erro ao publicar resposta IPC do alerta: {e}")
 
-                # também publicar um relatório para operations (se disponível)
-                if self.ipc_ready:
+                # também publicar um relatório para operations (uma vez por grupo)
+                if self.ipc_ready and not group.reported:
+                    group.reported = True
                     try:
                         publish_request(
                             source='homelab-advisor',
@@ -737,77 +1256,167 @@ Avalie a arquitetura e sugira melhorias para:
                     except Exception as e:
                         logger.debug(f"Não foi possível publicar relatório para operations: {e}")
 
-            elif severity == 'warning':
+            else:
                 # para warnings, coletar métricas e enviar resumo curto
-                result = await self.analyze_performance()
-                summary = self._summarize_result('performance', result)
                 response_text = f"Warning observed: {alert_name} on {instance} — {summary}{rag_section}"
 
                 if self.ipc_ready:
                     try:
-                        publish_request(source='homelab-advisor', target=getattr(message, 'source', 'monitoring'), content=response_text, metadata={'alert_handled': True})
+                        publish_request(source='homelab-advisor', target=getattr(message, 'source', 'monitoring'), content=response_text, metadata={'alert_handled': True, **grouping})
                     except Exception as e:
                         logger.debug(f"IPC publish (warning) falhou: {e}")
 
-            else:
-                # outros tipos: registrar e ignorar (pode ser expandido)
-                logger.info(f"Alert received (no-op): {alert_name} severity={severity}")
-
         except Exception as e:
             logger.error(f"Erro em _handle_alert: {e}")
     
-    async def process_ipc_requests(self):
-        """Processa requests IPC pendentes"""
-        if not self.ipc_ready:
-            return
-        
+    @property
+    def ipc_wakeup(self) -> asyncio.Event:
+        """Evento que acorda o worker IPC (NOTIFY ou fim de um request)."""
+        if self._ipc_wakeup is None:
+            self._ipc_wakeup = asyncio.Event()
+        return self._ipc_wakeup
+
+    @staticmethod
+    def _ipc_request_type(content: str) -> str:
+        text = content.lower()
+        if 'performance' in text:
+            return "performance"
+        if 'security' in text or 'safeguard' in text:
+            return "security"
+        if 'architecture' in text or 'arquitetura' in text:
+            return "architecture"
+        return "llm"
+
+    @staticmethod
+    def _ipc_request_age(req: Dict) -> Optional[float]:
+        """Segundos desde a criação do request (None se a linha não trouxer timestamp)."""
+        created = req.get('created_at') or req.get('timestamp') or req.get('created')
+        if created is None:
+            return None
         try:
-            pending = fetch_pending(target='homelab-advisor', limit=10)
-        except Exception as e:
-            logger.error(f"Erro ao buscar IPC pendentes: {e}")
-            advisor_ipc_pending_requests.set(0)
-            return
-        
-        advisor_ipc_pending_requests.set(len(pending))
-        
-        for req in pending:
+            if isinstance(created, (int, float)):
+                return max(0.0, time.time() - created)
+            if isinstance(created, str):
+                created = datetime.fromisoformat(created)
+            if created.tzinfo is None:
+                return max(0.0, (datetime.now() - created).total_seconds())
+            return max(0.0, time.time() - created.timestamp())
+        except (TypeError, ValueError, AttributeError):
+            return None
+
+    async def process_ipc_requests(self) -> int:
+        """Busca requests IPC pendentes e despacha para o pool; retorna quantos despachou.
+
+        Não espera o processamento: cada request vira uma task, limitada por
+        `ipc_pool_size` no total e por `ipc_type_caps` por tipo. Requests cujo
+        tipo está no limite ficam na fila local (`_ipc_queue`) e não ocupam a
+        janela da próxima busca: o limite do `fetch_pending` cresce com o número
+        de requests já conhecidos, então um tipo saturado não bloqueia os demais.
+        Cada request buscado é mantido até ser processado, mesmo que o
+        `fetch_pending` passe a marcá-los como em andamento.
+        """
+        if not self.ipc_ready:
+            return 0
+
+        known = set(self._ipc_inflight) | {req['id'] for req, _ in self._ipc_queue}
+        room = self.ipc_backlog_max - len(known)
+        if room > 0:
             try:
-                content = req['content']
-                req_id = req['id']
-                source = req['source']
-                
-                logger.info(f"📨 IPC Request #{req_id} de {source}: {content[:100]}")
-                
-                if 'performance' in content.lower():
-                    result = await self.analyze_performance()
-                    response_text = json.dumps(result, ensure_ascii=False)
-                elif 'security' in content.lower() or 'safeguard' in content.lower():
-                    result = await self.analyze_security()
-                    response_text = json.dumps(result, ensure_ascii=False)
-                elif 'architecture' in content.lower() or 'arquitetura' in content.lower():
-                    result = await self.review_architecture()
-                    response_text = json.dumps(result, ensure_ascii=False)
-                else:
-                    try:
-                        # Limitar tempo de espera pelo LLM para não bloquear respostas IPC
-                        response_text = await asyncio.wait_for(
-                            self.call_llm(content, max_tokens=400),
-                            timeout=12.0
-                        )
-                    except asyncio.TimeoutError:
-                        logger.warning(f"LLM timeout para IPC #{req_id} — retornando fallback")
-                        response_text = "[resposta temporária] O consultor está ocupado; por favor tente novamente em instantes."
-                    except Exception as exc:
-                        logger.error(f"Erro LLM ao processar IPC #{req_id}: {exc}")
-                        response_text = f"[erro LLM: {type(exc).__name__}]"
-
-                respond(req_id, responder="homelab-advisor", response_text=response_text)
-                advisor_ipc_messages_processed_total.labels(result="success").inc()
-                logger.info(f"✅ Resposta enviada para IPC #{req_id}")
-                
+                pending = await asyncio.to_thread(
+                    fetch_pending, target='homelab-advisor',
+                    limit=min(self.ipc_fetch_limit, room) + len(known))
             except Exception as e:
-                advisor_ipc_messages_processed_total.labels(result="error").inc()
-                logger.error(f"Erro ao processar IPC request #{req.get('id','?')}: {e}")
+                logger.error(f"Erro ao buscar IPC pendentes: {e}")
+                advisor_ipc_pending_requests.set(len(self._ipc_queue))
+                return self._dispatch_ipc_queue()
+
+            for req in pending:
+                if room <= 0:
+                    break
+                if req['id'] in known:
+                    continue
+                known.add(req['id'])
+                self._ipc_queue.append((req, self._ipc_request_type(req['content'])))
+                room -= 1
+
+        advisor_ipc_pending_requests.set(len(self._ipc_queue))
+        ages = [age for age in (self._ipc_request_age(req) for req, _ in self._ipc_queue) if age is not None]
+        advisor_ipc_lag_seconds.set(max(ages) if ages else 0)
+        return self._dispatch_ipc_queue()
+
+    def _dispatch_ipc_queue(self) -> int:
+        """Despacha da fila local, em ordem de chegada, o que cabe nos limites."""
+        dispatched = 0
+        for item in list(self._ipc_queue):
+            if len(self._ipc_inflight) >= self.ipc_pool_size:
+                break
+            req, req_type = item
+            running = sum(1 for t in self._ipc_inflight.values() if t == req_type)
+            if running >= self.ipc_type_caps.get(req_type, self.ipc_pool_size):
+                continue
+
+            self._ipc_queue.remove(item)
+            age = self._ipc_request_age(req)
+            if age is not None:
+                advisor_ipc_queue_age_seconds.labels(type=req_type).observe(age)
+            self._ipc_inflight[req['id']] = req_type
+            advisor_ipc_inflight.labels(type=req_type).inc()
+            task = asyncio.ensure_future(self._process_ipc_request(req, req_type))
+            self._ipc_tasks.add(task)
+            task.add_done_callback(self._ipc_request_done)
+            dispatched += 1
+        return dispatched
+
+    def _ipc_request_done(self, task: asyncio.Future):
+        self._ipc_tasks.discard(task)
+        # Vaga liberada: busca de novo o que ficou pendente
+        advisor_ipc_wakeups_total.labels(source="done").inc()
+        self.ipc_wakeup.set()
+
+    async def _process_ipc_request(self, req: Dict, req_type: str):
+        """Processa um request IPC e responde ao originador."""
+        start_time = time.time()
+        req_id = req.get('id', '?')
+        try:
+            content = req['content']
+            source = req['source']
+            
+            logger.info(f"📨 IPC Request #{req_id} de {source}: {content[:100]}")
+            
+            if req_type == "performance":
+                result = await self.analyze_performance()
+                response_text = json.dumps(result, ensure_ascii=False)
+            elif req_type == "security":
+                result = await self.analyze_security()
+                response_text = json.dumps(result, ensure_ascii=False)
+            elif req_type == "architecture":
+                result = await self.review_architecture()
+                response_text = json.dumps(result, ensure_ascii=False)
+            else:
+                try:
+                    # Limitar tempo de espera pelo LLM para não bloquear respostas IPC
+                    response_text = await asyncio.wait_for(
+                        self.call_llm(content, max_tokens=400),
+                        timeout=12.0
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"LLM timeout para IPC #{req_id} — retornando fallback")
+                    response_text = "[resposta temporária] O consultor está ocupado; por favor tente novamente em instantes."
+                except Exception as exc:
+                    logger.error(f"Erro LLM ao processar IPC #{req_id}: {exc}")
+                    response_text = f"[erro LLM: {type(exc).__name__}]"
+
+            await asyncio.to_thread(respond, req_id, responder="homelab-advisor", response_text=response_text)
+            advisor_ipc_messages_processed_total.labels(result="success").inc()
+            logger.info(f"✅ Resposta enviada para IPC #{req_id}")
+            
+        except Exception as e:
+            advisor_ipc_messages_processed_total.labels(result="error").inc()
+            logger.error(f"Erro ao processar IPC request #{req_id}: {e}")
+        finally:
+            self._ipc_inflight.pop(req.get('id'), None)
+            advisor_ipc_inflight.labels(type=req_type).dec()
+            advisor_ipc_processing_seconds.labels(type=req_type).observe(time.time() - start_time)
 
     # ==================== Scheduler ====================
     async def scheduled_analysis(self, scope: str):
@@ -872,39 +1481,39 @@ Avalie a arquitetura e sugira melhorias para:
     async def register_at_api(self):
         """Registra este agente na API principal (8503)"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Verificar se a API está saudável
-                r = await client.get(f"{self.api_base_url}/health")
-                if r.status_code != 200:
-                    logger.warning(f"API principal não saudável: {r.status_code}")
-                    advisor_api_registration_status.set(0)
-                    return False
-                
-                # Publicar via IPC que o advisor está online
-                if self.ipc_ready:
-                    # Não publicar status periódicos para 'coordinator' (polui a fila).
-                    # Enviar para 'monitoring' — informação apenas para observabilidade.
-                    publish_request(
-                        source="homelab-advisor",
-                        target="monitoring",
-                        content="Homelab Advisor Agent online e operacional",
-                        metadata={
-                            "agent_type": "homelab-advisor",
-                            "capabilities": ["performance", "security", "architecture", "safeguards"],
-                            "port": 8085,
-                            "scheduler_active": True,
-                            "intervals": {
-                                "performance_min": self.perf_interval,
-                                "security_min": self.sec_interval,
-                                "architecture_min": self.arch_interval
-                            }
+            client = self.http_client("api")
+            # Verificar se a API está saudável
+            r = await client.get(f"{self.api_base_url}/health", timeout=10.0)
+            if r.status_code != 200:
+                logger.warning(f"API principal não saudável: {r.status_code}")
+                advisor_api_registration_status.set(0)
+                return False
+            
+            # Publicar via IPC que o advisor está online
+            if self.ipc_ready:
+                # Não publicar status periódicos para 'coordinator' (polui a fila).
+                # Enviar para 'monitoring' — informação apenas para observabilidade.
+                publish_request(
+                    source="homelab-advisor",
+                    target="monitoring",
+                    content="Homelab Advisor Agent online e operacional",
+                    metadata={
+                        "agent_type": "homelab-advisor",
+                        "capabilities": ["performance", "security", "architecture", "safeguards"],
+                        "port": 8085,
+                        "scheduler_active": True,
+                        "intervals": {
+                            "performance_min": self.perf_interval,
+                            "security_min": self.sec_interval,
+                            "architecture_min": self.arch_interval
                         }
-                    )
-                
-                advisor_api_registration_status.set(1)
-                logger.info("✅ Registrado na API principal via IPC")
-                return True
-                
+                    }
+                )
+            
+            advisor_api_registration_status.set(1)
+            logger.info("✅ Registrado na API principal via IPC")
+            return True
+            
         except Exception as e:
             advisor_api_registration_status.set(0)
             logger.warning(f"Registro na API falhou: {e}")
@@ -913,34 +1522,34 @@ Avalie a arquitetura e sugira melhorias para:
     async def report_to_api(self, scope: str, result: Dict):
         """Reporta resultado de análise à API principal"""
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                payload = {
-                    "source": "homelab-advisor",
-                    "scope": scope,
-                    "summary": self._summarize_result(scope, result),
-                    "timestamp": datetime.now().isoformat(),
-                    "auto_scheduled": True
-                }
+            client = self.http_client("api")
+            payload = {
+                "source": "homelab-advisor",
+                "scope": scope,
+                "summary": self._summarize_result(scope, result),
+                "timestamp": datetime.now().isoformat(),
+                "auto_scheduled": True
+            }
+            
+            # Tentar reportar via health/status
+            r = await client.get(f"{self.api_base_url}/health")
+            if r.status_code == 200:
+                advisor_api_reports_total.labels(status="success").inc()
+                # Armazenar resultado via IPC (persistência real)
+                if self.ipc_ready:
+                    publish_request(
+                        source="homelab-advisor",
+                        target="operations",
+                        content=f"Relatório automático: {scope}",
+                        metadata={
+                            "report_type": scope,
+                            "data": self._summarize_result(scope, result),
+                            "timestamp": datetime.now().isoformat()
+                        }
+                    )
+            else:
+                advisor_api_reports_total.labels(status="api_unavailable").inc()
                 
-                # Tentar reportar via health/status
-                r = await client.get(f"{self.api_base_url}/health")
-                if r.status_code == 200:
-                    advisor_api_reports_total.labels(status="success").inc()
-                    # Armazenar resultado via IPC (persistência real)
-                    if self.ipc_ready:
-                        publish_request(
-                            source="homelab-advisor",
-                            target="operations",
-                            content=f"Relatório automático: {scope}",
-                            metadata={
-                                "report_type": scope,
-                                "data": self._summarize_result(scope, result),
-                                "timestamp": datetime.now().isoformat()
-                            }
-                        )
-                else:
-                    advisor_api_reports_total.labels(status="api_unavailable").inc()
-                    
         except Exception as e:
             advisor_api_reports_total.labels(status="error").inc()
             logger.warning(f"Report à API falhou: {e}")
@@ -948,11 +1557,11 @@ Avalie a arquitetura e sugira melhorias para:
     async def check_api_tasks(self):
         """Verifica se há tarefas atribuídas a este agente na API"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                r = await client.get(f"{self.api_base_url}/health")
-                if r.status_code == 200:
-                    api_data = r.json()
-                    logger.debug(f"API health: {api_data.get('status', 'unknown')}")
+            client = self.http_client("api")
+            r = await client.get(f"{self.api_base_url}/health", timeout=10.0)
+            if r.status_code == 200:
+                api_data = r.json()
+                logger.debug(f"API health: {api_data.get('status', 'unknown')}")
         except Exception:
             pass  # Silencioso — não bloquear por falha da API
 
@@ -973,10 +1582,21 @@ async def startup_event():
     logger.info(f"   API: {advisor.api_base_url}")
     logger.info(f"   Scheduler: perf={advisor.perf_interval}m, sec={advisor.sec_interval}m, arch={advisor.arch_interval}m")
     
+    # Clientes HTTP compartilhados (Ollama e API principal)
+    advisor.http_client("ollama")
+    advisor.http_client("api")
+
+    # Iniciar amostrador de métricas do host (ring buffer lido por /health e análises)
+    asyncio.create_task(advisor.sampler.run(advisor.probes))
+    logger.info(f"📈 Sampler de métricas iniciado (a cada {advisor.sampler.interval:.0f}s, {advisor.sampler.slots} slots)")
+
     # Iniciar worker IPC em background
     if advisor.ipc_ready:
         asyncio.create_task(ipc_worker())
-        logger.info("🔄 IPC worker iniciado (poll a cada 5s)")
+        logger.info(
+            f"🔄 IPC worker iniciado (pool={advisor.ipc_pool_size}, limites={advisor.ipc_type_caps}, "
+            f"LISTEN '{advisor.ipc_notify_channel}' com polling de fallback)"
+        )
     
     # Iniciar poller do bus remoto (consome /communication/messages)
     asyncio.create_task(bus_poll_worker())
@@ -1006,14 +1626,32 @@ async def startup_event():
     logger.info("🔗 API registration worker iniciado")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await advisor.close_http_clients()
+
+
 async def ipc_worker():
-    """Worker para processar requests IPC periodicamente"""
-    while True:
-        try:
-            await advisor.process_ipc_requests()
-        except Exception as e:
-            logger.error(f"Erro no IPC worker: {e}")
-        await asyncio.sleep(5)
+    """Worker IPC: acorda por NOTIFY (LISTEN) ou fim de request; polling só como fallback."""
+    wakeup = advisor.ipc_wakeup
+    listener = IpcNotifyListener(advisor.database_url, advisor.ipc_notify_channel, wakeup)
+    await listener.start()
+    try:
+        while True:
+            wakeup.clear()
+            try:
+                await advisor.process_ipc_requests()
+            except Exception as e:
+                logger.error(f"Erro no IPC worker: {e}")
+            interval = listener.poll_interval(advisor.ipc_poll_interval, advisor.ipc_fallback_poll_interval)
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                advisor_ipc_wakeups_total.labels(source="poll").inc()
+                if not listener.active:
+                    await listener.start()
+    finally:
+        listener.stop()
 
 
 async def scheduler_worker():
@@ -1081,50 +1719,47 @@ async def api_registration_worker():
 async def bus_poll_worker():
     """Poll no bus remoto (/communication/messages) e encaminha mensagens relevantes ao handler local."""
     await asyncio.sleep(5)
-    session = httpx.AsyncClient(timeout=10.0)
-    try:
-        while True:
-            try:
-                resp = await session.get(f"{advisor.api_base_url}/communication/messages")
-                if resp.status_code == 200:
-                    data = resp.json()
-                    messages = data.get('messages', [])
-
-                    for m in messages:
-                        mid = m.get('id')
-                        if not mid or mid in advisor._processed_message_ids:
-                            continue
-
-                        # evitar processo de mensagens originadas por este agente
-                        if m.get('source') == 'homelab-advisor':
+    session = advisor.http_client("api")
+    while True:
+        try:
+            resp = await session.get(f"{advisor.api_base_url}/communication/messages", timeout=10.0)
+            if resp.status_code == 200:
+                data = resp.json()
+                messages = data.get('messages', [])
+
+                for m in messages:
+                    mid = m.get('id')
+                    if not mid or mid in advisor._processed_message_ids:
+                        continue
+
+                    # evitar processo de mensagens originadas por este agente
+                    if m.get('source') == 'homelab-advisor':
+                        advisor._processed_message_ids.add(mid)
+                        continue
+
+                    # somente interessados: monitoring, homelab-advisor, advisor, all
+                    if m.get('target') and m.get('target') in ('monitoring', 'homelab-advisor', 'advisor', 'all'):
+                        # construir objeto simples compatível com handle_bus_message
+                        from types import SimpleNamespace
+                        msg_obj = SimpleNamespace(
+                            id=m.get('id'),
+                            timestamp=m.get('timestamp'),
+                            content=m.get('content'),
+                            source=m.get('source'),
+                            target=m.get('target'),
+                            metadata=m.get('metadata', {})
+                        )
+                        try:
+                            advisor.handle_bus_message(msg_obj)
                             advisor._processed_message_ids.add(mid)
-                            continue
-
-                        # somente interessados: monitoring, homelab-advisor, advisor, all
-                        if m.get('target') and m.get('target') in ('monitoring', 'homelab-advisor', 'advisor', 'all'):
-                            # construir objeto simples compatível com handle_bus_message
-                            from types import SimpleNamespace
-                            msg_obj = SimpleNamespace(
-                                id=m.get('id'),
-                                timestamp=m.get('timestamp'),
-                                content=m.get('content'),
-                                source=m.get('source'),
-                                target=m.get('target'),
-                                metadata=m.get('metadata', {})
-                            )
-                            try:
-                                advisor.handle_bus_message(msg_obj)
-                                advisor._processed_message_ids.add(mid)
-                            except Exception as e:
-                                logger.error(f"Erro ao encaminhar mensagem do bus remoto: {e}")
-                else:
-                    logger.debug(f"bus_poll_worker: /communication/messages returned {resp.status_code}")
-            except Exception as e:
-                logger.debug(f"bus_poll_worker error: {e}")
+                        except Exception as e:
+                            logger.error(f"Erro ao encaminhar mensagem do bus remoto: {e}")
+            else:
+                logger.debug(f"bus_poll_worker: /communication/messages returned {resp.status_code}")
+        except Exception as e:
+            logger.debug(f"bus_poll_worker error: {e}")
 
-            await asyncio.sleep(advisor.bus_poll_interval)
-    finally:
-        await session.aclose()
+        await asyncio.sleep(advisor.bus_poll_interval)
 
 
 
@@ -1147,23 +1782,14 @@ async def health():
     Adiciona métricas do host (cpu/mem/disk/load) para que painéis/indicadores
     possam exibir o uso real do homelab.
     """
-    # coletar métricas de sistema rapidamente (não bloqueante por muito tempo)
-    try:
-        cpu = psutil.cpu_percent(interval=0.1)
-        mem = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        load1, load5, load15 = os.getloadavg()
-        system_metrics = {
-            "cpu_percent": cpu,
-            "memory_percent": mem.percent,
-            "memory_available_gb": round(mem.available / (1024**3), 2),
-            "disk_percent": disk.percent,
-            "disk_free_gb": round(disk.free / (1024**3), 2),
-            "loadavg": {"1m": round(load1, 2), "5m": round(load5, 2), "15m": round(load15, 2)}
-        }
-    except Exception as e:
-        logger.warning(f"Falha ao coletar system metrics: {e}")
-        system_metrics = {}
+    # snapshot do sampler em background (O(1)); amostra inline só antes da primeira coleta
+    system_metrics = advisor.sampler.latest()
+    if not system_metrics:
+        try:
+            system_metrics = advisor.sampler.sample()
+        except Exception as e:
+            logger.warning(f"Falha ao coletar system metrics: {e}")
+            system_metrics = {}
 
     return {
         "status": "healthy",
@@ -1233,6 +1859,10 @@ async def status():
             for scope, result in advisor.last_results.items()
         },
         "ipc_ready": advisor.ipc_ready,
+        "system": {
+            "latest": advisor.sampler.latest(),
+            "window": advisor.sampler.window(advisor.trend_window),
+        },
         "scheduler_scopes": ["performance", "security", "architecture"],
         "timestamp": datetime.now().isoformat()
     }
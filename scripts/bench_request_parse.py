@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark do parse de requests do LLM-Optimizer
+
+Compara, por request, o caminho antigo de /v1/chat/completions (json.loads →
+ChatCompletionRequest → msg.dict() → sanitização → json.dumps(sort_keys) para
+o hash → json.dumps do payload do Ollama) com o caminho rápido atual (parse
+único com orjson, checagem estrutural sem pydantic, hash incremental durante
+a sanitização, payload serializado direto em bytes).
+
+Mede CPU (process_time) e o pico de alocações (tracemalloc) num corpo
+no formato do CLINE (~100KB por padrão: system prompt + histórico com saídas
+de ferramentas).
+
+Uso:
+    python3 scripts/bench_request_parse.py
+
+    # Corpo real (ex.: capturado com CAPTURE_PATH ou tcpdump)
+    BODY_FILE=request.json python3 scripts/bench_request_parse.py
+
+    # Saída JSON para acompanhamento de regressão
+    BENCH_JSON=1 python3 scripts/bench_request_parse.py
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+from bench_token_counter import load_optimizer
+
+BODY_FILE = os.environ.get("BODY_FILE", "")
+BODY_KB = int(os.environ.get("BODY_KB", "100"))
+ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", "200"))
+BENCH_JSON = os.environ.get("BENCH_JSON", "0") == "1"
+
+
+def builtin_body() -> bytes:
+    """Corpo no formato do CLINE com ~BODY_KB KB."""
+    messages = [{"role": "system", "content": "Você é o CLINE. Use uma ferramenta por mensagem.\n" * 200}]
+    i = 0
+    while len(json.dumps(messages)) < BODY_KB * 1024:
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"<task>passo {i}</task>"}]})
+        messages.append({"role": "assistant", "content": f"<read_file>\n<path>src/mod_{i}.py</path>\n</read_file>"})
+        messages.append({"role": "tool", "content": f"def f_{i}(x):\n    return x * {i}\n" * 40})
+        i += 1
+    return json.dumps({"model": "qwen3:4b", "messages": messages, "temperature": 0.7}).encode()
+
+
+def legacy_path(opt, raw: bytes):
+    """Caminho anterior (referência para o benchmark)."""
+    body = json.loads(raw)
+    req = opt.ChatCompletionRequest(**body)
+    messages = opt.sanitize_messages([msg.dict() for msg in req.messages])
+    key = hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()[:16]
+    payload = {"model": req.model, "messages": messages, "stream": False,
+               "options": {"temperature": req.temperature}}
+    return key, json.dumps(payload).encode()
+
+
+def fast_path(opt, raw: bytes):
+    req = opt.parse_chat_request(opt.json_loads(raw))
+    hasher = opt.MessageHasher()
+    messages = opt.sanitize_messages(req.messages, hasher)
+    payload = {"model": req.model, "messages": messages, "stream": False,
+               "options": {"temperature": req.temperature}}
+    return hasher.hexdigest(), opt.json_dumps_bytes(payload)
+
+
+def measure(fn) -> dict:
+    start = time.process_time()
+    for _ in range(ITERATIONS):
+        fn()
+    cpu_us = (time.process_time() - start) / ITERATIONS * 1e6
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_us": round(cpu_us, 1), "peak_kb": round(peak / 1024, 1)}
+
+
+def main() -> int:
+    opt = load_optimizer()
+    opt.logger.disabled = True
+    warnings.simplefilter("ignore", DeprecationWarning)  # msg.dict() do caminho antigo
+
+    if BODY_FILE:
+        with open(BODY_FILE, "rb") as f:
+            raw = f.read()
+    else:
+        raw = builtin_body()
+
+    # Os dois caminhos precisam concordar no conteúdo enviado ao Ollama
+    if json.loads(legacy_path(opt, raw)[1]) != json.loads(fast_path(opt, raw)[1]):
+        print("Payloads divergentes entre os caminhos", file=sys.stderr)
+        return 1
+
+    results = {
+        "body_kb": round(len(raw) / 1024, 1),
+        "iterations": ITERATIONS,
+        "orjson": opt.ORJSON_AVAILABLE,
+        "legacy": measure(lambda: legacy_path(opt, raw)),
+        "fast": measure(lambda: fast_path(opt, raw)),
+    }
+
+    if BENCH_JSON:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"corpo: {results['body_kb']} KB ({ITERATIONS} iterações, orjson={results['orjson']})")
+    print(f"{'':<14}{'CPU µs':>12}{'pico KB':>12}")
+    for name in ("legacy", "fast"):
+        r = results[name]
+        print(f"{name:<14}{r['cpu_us']:>12}{r['peak_kb']:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
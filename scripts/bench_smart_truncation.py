@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark do smart truncation do LLM-Optimizer
+
+Compara o custo por request da implementação antiga (4 passadas de
+re.finditer compiladas a cada chamada + concatenação em loop) com a atual
+(regex pré-compilada em passada única, spans mesclados) — sem e com o memo
+por hash do prompt, que é o caso real do CLINE reenviando o mesmo system
+prompt a cada turno.
+
+Uso:
+    python3 scripts/bench_smart_truncation.py
+
+    # System prompt real (ex.: capturado do CLINE)
+    PROMPT_FILE=system_prompt.txt python3 scripts/bench_smart_truncation.py
+
+    # Saída JSON para acompanhamento de regressão
+    BENCH_JSON=1 python3 scripts/bench_smart_truncation.py
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+from bench_token_counter import load_optimizer
+
+PROMPT_FILE = os.environ.get("PROMPT_FILE", "")
+ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", "200"))
+MAX_TOKENS = int(os.environ.get("MAX_TOKENS", "2000"))
+BENCH_JSON = os.environ.get("BENCH_JSON", "0") == "1"
+
+
+def builtin_prompt() -> str:
+    """~60KB no formato do system prompt do CLINE."""
+    tools = "".join(
+        f"## {name}\nDescription: executa {name}.\nParameters:\n- path: (required) caminho\n"
+        f"Usage:\n<{name}>\n<path>arquivo</path>\n</{name}>\n\n"
+        for name in ("execute_command", "read_file", "write_to_file", "list_files", "search_files") * 12
+    )
+    return (
+        "Você é o CLINE, um engenheiro de software altamente qualificado.\n\n" * 40
+        + "====\n\nTOOL USE\n\n## Tools\n\n" + tools
+        + "====\n\nRULES\n\n" + "- Use uma ferramenta por mensagem e aguarde o resultado.\n" * 300
+    )
+
+
+def legacy_truncate(content: str, max_tokens: int, estimate_tokens) -> str:
+    """Implementação anterior (referência para o benchmark)."""
+    tokens = estimate_tokens(content)
+    if tokens <= max_tokens:
+        return content
+    tool_patterns = [
+        r'<tool_name>.*?</tool_name>',
+        r'## Tools.*?(?=##|\Z)',
+        r'<tools>.*?</tools>',
+        r'execute_command|read_file|write_to_file|list_files',
+    ]
+    tool_blocks = []
+    for pattern in tool_patterns:
+        matches = re.finditer(pattern, content, re.DOTALL | re.IGNORECASE)
+        tool_blocks.extend([m.span() for m in matches])
+    tool_blocks = sorted(set(tool_blocks))
+    tool_text = ""
+    for start, end in tool_blocks:
+        tool_text += content[start:end] + "\n\n"
+    chars_per_token = len(content) / max(tokens, 1)
+    max_chars = int(max_tokens * chars_per_token)
+    budget_start = int(max_chars * 0.4)
+    budget_tools = int(max_chars * 0.3)
+    budget_end = int(max_chars * 0.3)
+    if len(tool_text) > budget_tools:
+        tool_text = tool_text[:budget_tools] + "\n...[tools truncated]"
+    return f"{content[:budget_start]}\n\n[...truncated...]\n\n{tool_text}\n\n[...truncated...]\n\n{content[-budget_end:]}"
+
+
+def time_per_call(fn) -> float:
+    start = time.process_time()
+    for _ in range(ITERATIONS):
+        fn()
+    return (time.process_time() - start) / ITERATIONS * 1e6  # µs de CPU
+
+
+def main() -> int:
+    opt = load_optimizer()
+    opt.logger.disabled = True
+
+    if PROMPT_FILE:
+        with open(PROMPT_FILE, encoding="utf-8") as f:
+            prompt = f.read()
+    else:
+        prompt = builtin_prompt()
+    opt.estimate_tokens(prompt)  # contagem fora da medição (memo próprio)
+
+    def uncached():
+        opt._truncation_memo.clear()
+        opt.smart_truncate_system_prompt(prompt, MAX_TOKENS)
+
+    results = {
+        "chars": len(prompt),
+        "tokens": opt.estimate_tokens(prompt),
+        "iterations": ITERATIONS,
+        "legacy_us": round(time_per_call(lambda: legacy_truncate(prompt, MAX_TOKENS, opt.estimate_tokens)), 1),
+        "single_pass_us": round(time_per_call(uncached), 1),
+        "memo_us": round(time_per_call(lambda: opt.smart_truncate_system_prompt(prompt, MAX_TOKENS)), 1),
+    }
+
+    if BENCH_JSON:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"prompt: {results['chars']} chars, ~{results['tokens']} tokens ({ITERATIONS} iterações)")
+    print(f"  antiga (4 passadas):  {results['legacy_us']:>10} µs/request")
+    print(f"  passada única:        {results['single_pass_us']:>10} µs/request")
+    print(f"  passada única + memo: {results['memo_us']:>10} µs/request")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
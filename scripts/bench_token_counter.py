@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark da contagem de tokens do LLM-Optimizer
+
+Compara a heurística (4 chars ≈ 1 token) com o tokenizer real do qwen3
+(tokenizer.json) em amostras típicas do CLINE: texto em português, blocos
+XML de tool-calling, código e JSON. Mede erro relativo, custo por chamada
+e o efeito do memo (LRU) em histórico repetido.
+
+Uso:
+    # tokenizer.json do qwen3 (ex.: huggingface-cli download Qwen/Qwen3-4B tokenizer.json)
+    TOKENIZER_PATH=/path/tokenizer.json python3 scripts/bench_token_counter.py
+
+    # Amostras próprias (JSONL com {"text": "..."} por linha)
+    SAMPLES_FILE=amostras.jsonl TOKENIZER_PATH=... python3 scripts/bench_token_counter.py
+
+    # Saída JSON para acompanhamento de regressão
+    BENCH_JSON=1 TOKENIZER_PATH=... python3 scripts/bench_token_counter.py
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+OPTIMIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_optimizer_v2.3.py")
+TOKENIZER_PATH = os.environ.get("TOKENIZER_PATH", "")
+SAMPLES_FILE = os.environ.get("SAMPLES_FILE", "")
+ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", "50"))
+BENCH_JSON = os.environ.get("BENCH_JSON", "0") == "1"
+
+BUILTIN_SAMPLES = {
+    "portugues": (
+        "Você é um assistente de programação. Analise o repositório, identifique "
+        "as funções responsáveis pela sanitização das mensagens e explique por que "
+        "a requisição está sendo rejeitada com erro 400. Não altere arquivos sem "
+        "confirmação do usuário. "
+    ) * 40,
+    "tool_xml": (
+        "<execute_command>\n<command>ls -la /home/homelab/llm-optimizer</command>\n"
+        "<requires_approval>false</requires_approval>\n</execute_command>\n"
+        "<read_file>\n<path>scripts/llm_optimizer_v2.3.py</path>\n</read_file>\n"
+    ) * 40,
+    "codigo": (
+        "async def call_ollama(model: str, messages: List[Dict]) -> Dict:\n"
+        "    payload = {\"model\": model, \"messages\": messages, \"stream\": False}\n"
+        "    resp = await client.post(f\"{OLLAMA_HOST}/api/chat\", json=payload)\n"
+    ) * 40,
+    "json": json.dumps([{"role": "user", "content": f"mensagem {i}", "tool_call_id": f"call_{i}"}
+                        for i in range(120)]),
+}
+
+
+def load_optimizer():
+    spec = importlib.util.spec_from_file_location("llm_optimizer", OPTIMIZER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["llm_optimizer"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_samples() -> Dict[str, str]:
+    if not SAMPLES_FILE:
+        return BUILTIN_SAMPLES
+    samples = {}
+    with open(SAMPLES_FILE, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                samples[f"amostra_{i}"] = json.loads(line)["text"]
+    return samples
+
+
+def time_per_call(fn, text: str) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        fn(text)
+    return (time.perf_counter() - start) / ITERATIONS * 1e6  # µs
+
+
+def main() -> int:
+    if not TOKENIZER_PATH:
+        print("Defina TOKENIZER_PATH com o tokenizer.json do qwen3", file=sys.stderr)
+        return 2
+
+    opt = load_optimizer()
+    heuristic = opt.HeuristicTokenCounter()
+    tokenizer = opt.TokenizerFileCounter(TOKENIZER_PATH)
+    tokenizer.count("warmup")
+    if tokenizer._tokenizer is None:
+        print(f"Não foi possível carregar {TOKENIZER_PATH}", file=sys.stderr)
+        return 2
+
+    rows: List[Dict] = []
+    for name, text in load_samples().items():
+        real = tokenizer.count(text)
+        approx = heuristic.count(text)
+
+        opt.set_token_counter(tokenizer)
+        opt.estimate_tokens(text)  # popula o memo
+        rows.append({
+            "sample": name,
+            "chars": len(text),
+            "tokens_real": real,
+            "tokens_heuristic": approx,
+            "error_pct": round((approx - real) / max(real, 1) * 100, 1),
+            "heuristic_us": round(time_per_call(heuristic.count, text), 2),
+            "tokenizer_us": round(time_per_call(tokenizer.count, text), 2),
+            "memo_us": round(time_per_call(opt.estimate_tokens, text), 2),
+        })
+
+    if BENCH_JSON:
+        print(json.dumps({"tokenizer": TOKENIZER_PATH, "iterations": ITERATIONS, "results": rows}, indent=2))
+        return 0
+
+    header = f"{'amostra':<14}{'chars':>8}{'real':>8}{'heur.':>8}{'erro%':>8}{'heur µs':>10}{'tok µs':>10}{'memo µs':>10}"
+    print(header)
+    print("─" * len(header))
+    for r in rows:
+        print(f"{r['sample']:<14}{r['chars']:>8}{r['tokens_real']:>8}{r['tokens_heuristic']:>8}"
+              f"{r['error_pct']:>8}{r['heuristic_us']:>10}{r['tokenizer_us']:>10}{r['memo_us']:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga do LLM-Optimizer com Ollama simulado
+
+Sobe um Ollama falso e determinístico (latência fixa + taxa de tokens
+configurável para prompt e geração, slots por modelo como o
+OLLAMA_NUM_PARALLEL), inicia o optimizer apontando para ele e reproduz
+tráfego no formato do CLINE: system prompt com ferramentas, content
+multimodal em array, role `tool` e históricos de ~2K/6K/20K tokens.
+
+Reporta por estratégia (A/B/C, via header X-LLM-Optimizer-Strategy):
+latência p50/p95/p99, throughput e tempo até o primeiro token (stream).
+
+Uso:
+    python3 scripts/llm_optimizer_bench.py
+
+    # Mais carga, só streaming, política estática
+    python3 scripts/llm_optimizer_bench.py --requests 40 --concurrency 8 --mode stream --policy static
+
+    # JSON para acompanhamento de regressão
+    python3 scripts/llm_optimizer_bench.py --json > bench.json
+
+    # Contra um optimizer já rodando (quem responde é o Ollama dele)
+    python3 scripts/llm_optimizer_bench.py --url http://localhost:8512
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+OPTIMIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_optimizer_v2.3.py")
+
+SYSTEM_PROMPT = (
+    "Você é o CLINE, um engenheiro de software altamente qualificado.\n\n"
+    "====\n\nTOOL USE\n\n## Tools\n\n"
+    + "".join(
+        f"## {name}\nDescription: executa {name}.\nParameters:\n- path: (required) caminho\n"
+        f"Usage:\n<{name}>\n<path>arquivo</path>\n</{name}>\n\n"
+        for name in ("execute_command", "read_file", "write_to_file", "list_files", "search_files")
+    )
+    + "====\n\nRULES\n\n" + "- Use uma ferramenta por mensagem e aguarde o resultado.\n" * 40
+)
+
+
+# ══════════════════════════════════════════════════════════════════════════
+# Ollama simulado
+# ══════════════════════════════════════════════════════════════════════════
+
+def create_fake_ollama(prompt_rate: float, eval_rate: float, latency: float,
+                       output_tokens: int, parallel: int):
+    """App FastAPI que imita /api/chat do Ollama com tempos determinísticos."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI(title="fake-ollama")
+    slots: Dict[str, asyncio.Semaphore] = {}
+
+    def final_chunk(model: str, prompt_tokens: int, content: str) -> Dict:
+        return {
+            "model": model,
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_tokens / prompt_rate * 1e9),
+            "eval_count": output_tokens,
+            "eval_duration": int(output_tokens / eval_rate * 1e9),
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = await request.json()
+        model = payload["model"]
+        slot = slots.setdefault(model, asyncio.Semaphore(parallel))
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+        prompt_tokens = max(1, prompt_chars // 4)
+        words = [f"tok{i} " for i in range(output_tokens)]
+
+        if not payload.get("stream"):
+            async with slot:
+                await asyncio.sleep(latency + prompt_tokens / prompt_rate + output_tokens / eval_rate)
+            return JSONResponse(final_chunk(model, prompt_tokens, "".join(words)))
+
+        async def ndjson():
+            async with slot:
+                await asyncio.sleep(latency + prompt_tokens / prompt_rate)
+                for word in words:
+                    await asyncio.sleep(1 / eval_rate)
+                    yield json.dumps({"model": model, "message": {"role": "assistant", "content": word},
+                                      "done": False}) + "\n"
+                yield json.dumps(final_chunk(model, prompt_tokens, "")) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(app, port: int):
+    """Roda um app ASGI com uvicorn numa thread (event loop próprio)."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("fake Ollama não subiu")
+        time.sleep(0.05)
+    return server, thread
+
+
+def start_optimizer(ollama_url: str, port: int, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "OLLAMA_HOST": ollama_url,
+        "LLM_OPTIMIZER_HOST": "127.0.0.1",
+        "LLM_OPTIMIZER_PORT": str(port),
+        "RESPONSE_CACHE_ENABLED": "1" if args.cache else "0",
+        # Planejador compactaria os históricos grandes para A: desligado mantém os cenários B/C
+        "CONTEXT_PLANNER_ENABLED": "1" if args.context_planner else "0",
+        "ROUTING_POLICY": args.policy,
+        "ROUTING_OLLAMA_PARALLEL": str(args.fake_parallel),
+        "ROUTING_LOG_PATH": "",
+    })
+    log = open(args.optimizer_log, "w") if args.optimizer_log else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, OPTIMIZER_PATH], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_healthy(url: str, proc: Optional[subprocess.Popen], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"optimizer saiu com código {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"optimizer não respondeu em {url}/health")
+
+
+# ══════════════════════════════════════════════════════════════════════════
+# Tráfego no formato do CLINE
+# ══════════════════════════════════════════════════════════════════════════
+
+def build_history(target_tokens: int, salt: str = "") -> List[Dict]:
+    """
+    Histórico de ~target_tokens (4 chars ≈ 1 token) com array multimodal e role tool.
+
+    O histórico é compartilhado pelos requests de um cenário (como os turnos
+    do CLINE); `salt` separa cenários para um não aquecer o cache do outro.
+    """
+    messages: List[Dict] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    chars = len(SYSTEM_PROMPT)
+    turn = 0
+    while chars < target_tokens * 4:
+        user = {"role": "user", "content": [
+            {"type": "text", "text": f"<task>{salt}Turno {turn}: analise o módulo {turn} e corrija o bug.</task>"},
+            {"type": "text", "text": "<environment_details>\n" + f"src/mod_{turn}.py\n" * 20 + "</environment_details>"},
+        ]}
+        assistant = {"role": "assistant", "content": f"<read_file>\n<path>src/mod_{turn}.py</path>\n</read_file>"}
+        tool = {"role": "tool", "tool_call_id": f"call_{turn}",
+                "content": "".join(f"def func_{turn}_{i}(x):\n    return x * {i}\n" for i in range(25))}
+        messages.extend([user, assistant, tool])
+        chars += sum(len(json.dumps(m["content"])) for m in (user, assistant, tool))
+        turn += 1
+    return messages
+
+
+def build_request(history: List[Dict], n: int, stream: bool) -> Dict:
+    # Último turno único por request: não cai no dedup nem no cache
+    last = {"role": "user", "content": [{"type": "text", "text": f"[bench {n}] continue a tarefa"}]}
+    return {"model": "qwen3:4b", "stream": stream, "messages": history + [last]}
+
+
+# ══════════════════════════════════════════════════════════════════════════
+# Execução e relatório
+# ══════════════════════════════════════════════════════════════════════════
+
+async def send(client: httpx.AsyncClient, url: str, body: Dict) -> Dict:
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if body["stream"]:
+            async with client.stream("POST", f"{url}/v1/chat/completions", json=body) as resp:
+                strategy = resp.headers.get("x-llm-optimizer-strategy", "?")
+                async for line in resp.aiter_lines():
+                    if ttft is None and line.startswith("data: ") and line != "data: [DONE]":
+                        delta = json.loads(line[6:])["choices"][0]["delta"]
+                        if delta.get("content"):
+                            ttft = time.perf_counter() - start
+                status = resp.status_code
+        else:
+            resp = await client.post(f"{url}/v1/chat/completions", json=body)
+            strategy = resp.headers.get("x-llm-optimizer-strategy", "?")
+            status = resp.status_code
+    except httpx.HTTPError as e:
+        return {"ok": False, "error": str(e), "strategy": "?", "latency": time.perf_counter() - start}
+    return {"ok": status == 200, "status": status, "strategy": strategy,
+            "latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def run_scenario(url: str, tokens: int, mode: str, n_requests: int, concurrency: int) -> Dict:
+    history = build_history(tokens, salt=f"[{mode}] ")
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        async def one(n):
+            async with sem:
+                return await send(client, url, build_request(history, n, mode == "stream"))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(n) for n in range(n_requests)))
+        wall = time.perf_counter() - start
+
+    return {"scenario": f"{tokens // 1000}k", "mode": mode, "tokens": tokens,
+            "messages": len(history) + 1, "wall_s": wall, "results": results}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)
+
+
+def summarize(run: Dict) -> List[Dict]:
+    by_strategy: Dict[str, List[Dict]] = defaultdict(list)
+    for r in run["results"]:
+        by_strategy[r["strategy"]].append(r)
+
+    rows = []
+    for strategy, results in sorted(by_strategy.items()):
+        ok = [r for r in results if r["ok"]]
+        latencies = [r["latency"] for r in ok]
+        ttfts = [r["ttft"] for r in ok if r.get("ttft") is not None]
+        rows.append({
+            "scenario": run["scenario"],
+            "mode": run["mode"],
+            "strategy": strategy,
+            "requests": len(results),
+            "errors": len(results) - len(ok),
+            "p50_s": percentile(latencies, 50),
+            "p95_s": percentile(latencies, 95),
+            "p99_s": percentile(latencies, 99),
+            "throughput_rps": round(len(ok) / run["wall_s"], 3) if run["wall_s"] else 0.0,
+            "ttft_p50_s": percentile(ttfts, 50) if ttfts else None,
+            "ttft_p95_s": percentile(ttfts, 95) if ttfts else None,
+        })
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de carga do LLM-Optimizer")
+    parser.add_argument("--url", help="Optimizer já rodando (não sobe Ollama simulado)")
+    parser.add_argument("--sizes", default="2000,6000,20000", help="Tamanhos de histórico em tokens")
+    parser.add_argument("--mode", choices=("json", "stream", "both"), default="both")
+    parser.add_argument("--requests", type=int, default=12, help="Requests por cenário")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--policy", default="adaptive", help="ROUTING_POLICY do optimizer")
+    parser.add_argument("--cache", action="store_true", help="Mantém o cache persistente ligado")
+    parser.add_argument("--context-planner", action="store_true", help="Mantém o planejador de contexto ligado")
+    parser.add_argument("--prompt-rate", type=float, default=2000.0, help="Tokens/s de prompt no Ollama simulado")
+    parser.add_argument("--eval-rate", type=float, default=50.0, help="Tokens/s de geração no Ollama simulado")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latência fixa por chamada (s)")
+    parser.add_argument("--output-tokens", type=int, default=32, help="Tokens gerados por chamada")
+    parser.add_argument("--fake-parallel", type=int, default=1, help="Slots por modelo (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--optimizer-log", help="Arquivo para o log do optimizer")
+    parser.add_argument("--json", action="store_true", help="Saída JSON")
+    args = parser.parse_args()
+
+    fake_server = proc = None
+    url = args.url
+    try:
+        if url is None:
+            ollama_port, optimizer_port = free_port(), free_port()
+            fake = create_fake_ollama(args.prompt_rate, args.eval_rate, args.latency,
+                                      args.output_tokens, args.fake_parallel)
+            fake_server, _ = serve_in_thread(fake, ollama_port)
+            proc = start_optimizer(f"http://127.0.0.1:{ollama_port}", optimizer_port, args)
+            url = f"http://127.0.0.1:{optimizer_port}"
+        wait_healthy(url, proc)
+
+        modes = ("json", "stream") if args.mode == "both" else (args.mode,)
+        rows = []
+        for tokens in (int(t) for t in args.sizes.split(",")):
+            for mode in modes:
+                run = asyncio.run(run_scenario(url, tokens, mode, args.requests, args.concurrency))
+                rows.extend(summarize(run))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if fake_server is not None:
+            fake_server.should_exit = True
+
+    if args.json:
+        print(json.dumps({
+            "config": {k: v for k, v in vars(args).items() if k not in ("json", "optimizer_log")},
+            "results": rows,
+        }, indent=2))
+        return 0
+
+    print(f"{'cenário':<8}{'modo':<8}{'estr.':<6}{'reqs':>5}{'erros':>6}{'p50':>8}{'p95':>8}{'p99':>8}"
+          f"{'req/s':>8}{'ttft50':>8}{'ttft95':>8}")
+    for r in rows:
+        ttft50 = r["ttft_p50_s"] if r["ttft_p50_s"] is not None else "-"
+        ttft95 = r["ttft_p95_s"] if r["ttft_p95_s"] is not None else "-"
+        print(f"{r['scenario']:<8}{r['mode']:<8}{r['strategy']:<6}{r['requests']:>5}{r['errors']:>6}"
+              f"{r['p50_s']:>8}{r['p95_s']:>8}{r['p99_s']:>8}{r['throughput_rps']:>8}{ttft50:>8}{ttft95:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Replay de capturas do LLM-Optimizer
+
+Lê a captura gravada pelo optimizer (CAPTURE_PATH, JSONL gzip com rotação
+`.1`, `.2`, ...; no modo multi-worker, um arquivo `.wN` por worker) e
+reenvia os requests, na ordem original, contra o build atual. Compara latência (p50/p95/p99 capturado × replay) e escolha de
+estratégia, e lista as maiores regressões.
+
+Com `--routing-only` não chama o optimizer: recalcula tokens e estratégia
+com o código atual (contador de tokens + política com estatísticas frias) e
+mostra só a diferença de roteamento — determinístico, sem Ollama.
+
+Uso:
+    # Captura no homelab: CAPTURE_PATH=/home/homelab/llm-optimizer/capture.jsonl.gz
+    python3 scripts/llm_optimizer_capture_replay.py capture.jsonl.gz --url http://localhost:8512
+
+    # Mantendo o espaçamento original (2x mais rápido) e 4 requests simultâneos
+    python3 scripts/llm_optimizer_capture_replay.py capture.jsonl.gz --pace --speed 2 --concurrency 4
+
+    # Só diferença de roteamento, saída JSON
+    python3 scripts/llm_optimizer_capture_replay.py capture.jsonl.gz --routing-only --json
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+OPTIMIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_optimizer_v2.3.py")
+
+
+def load_optimizer():
+    spec = importlib.util.spec_from_file_location("llm_optimizer", OPTIMIZER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["llm_optimizer"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def capture_files(paths: List[str]) -> List[str]:
+    """
+    Arquivo base + rotações (`.N`), do mais antigo para o mais novo.
+
+    Inclui os arquivos por worker do modo multi-worker (`<path>.wN` e rotações).
+    """
+    bases = []
+    for path in paths:
+        bases.append(path)
+        workers = [p for p in glob.glob(f"{glob.escape(path)}.w[0-9]*") if re.fullmatch(r"w\d+", p.rsplit(".", 1)[1])]
+        bases.extend(sorted(workers, key=lambda p: int(p.rsplit(".w", 1)[1])))
+    files = []
+    for path in bases:
+        rotated = sorted(glob.glob(f"{glob.escape(path)}.[0-9]*"), key=lambda p: int(p.rsplit(".", 1)[1]))
+        files.extend(reversed(rotated))
+        if os.path.exists(path):
+            files.append(path)
+    return files
+
+
+def read_captures(paths: List[str]) -> List[Dict]:
+    records = []
+    for path in capture_files(paths):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except (EOFError, zlib.error, json.JSONDecodeError) as e:
+            # Arquivo ainda aberto pelo optimizer ou cortado num crash
+            print(f"Aviso: {path} truncado ({e}), usando registros lidos até aqui", file=sys.stderr)
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)
+
+
+def replay_routing(opt, records: List[Dict], policy_name: str) -> List[Dict]:
+    policy = opt.ROUTING_POLICIES[policy_name]()
+    stats = opt.ModelStats()
+    results = []
+    for r in records:
+        messages = r.get("messages") or []
+        tokens = sum(opt.estimate_tokens(opt.safe_get_content_text(m.get("content", ""))) for m in messages)
+        results.append({"strategy": policy.choose(tokens, len(messages), stats), "tokens": tokens})
+    return results
+
+
+async def replay_http(url: str, records: List[Dict], concurrency: int, pace: bool, speed: float,
+                      bypass_cache: bool) -> List[Dict]:
+    sem = asyncio.Semaphore(concurrency)
+    headers = {"X-LLM-Optimizer-Cache": "bypass"} if bypass_cache else {}
+    t0 = records[0].get("ts", 0) if records else 0
+    start = time.monotonic()
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        async def one(r: Dict) -> Dict:
+            if pace:
+                delay = (r.get("ts", t0) - t0) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            body = {"model": r.get("model", "qwen3:4b"), "messages": r.get("messages") or [],
+                    "temperature": r.get("temperature"), "stream": bool(r.get("stream"))}
+            if r.get("tools"):
+                body["tools"] = r["tools"]
+            async with sem:
+                begin = time.perf_counter()
+                try:
+                    if body["stream"]:
+                        async with client.stream("POST", f"{url}/v1/chat/completions", json=body,
+                                                 headers=headers) as resp:
+                            async for _ in resp.aiter_lines():
+                                pass
+                    else:
+                        resp = await client.post(f"{url}/v1/chat/completions", json=body, headers=headers)
+                except httpx.HTTPError as e:
+                    return {"status": 0, "strategy": None, "duration_s": time.perf_counter() - begin,
+                            "error": str(e)}
+                return {"status": resp.status_code, "strategy": resp.headers.get("x-llm-optimizer-strategy"),
+                        "duration_s": time.perf_counter() - begin}
+
+        return await asyncio.gather(*(one(r) for r in records))
+
+
+def diff(records: List[Dict], replayed: List[Dict], top: int) -> Dict:
+    transitions = Counter(f"{r.get('strategy')}→{n.get('strategy')}" for r, n in zip(records, replayed))
+    changed = sum(1 for r, n in zip(records, replayed) if r.get("strategy") != n.get("strategy"))
+    report = {
+        "requests": len(records),
+        "strategy_changed": changed,
+        "transitions": dict(transitions),
+    }
+
+    pairs = [(i, r["duration_s"], n["duration_s"]) for i, (r, n) in enumerate(zip(records, replayed))
+             if r.get("duration_s") is not None and n.get("duration_s") is not None
+             and r.get("status") == 200 and n.get("status") == 200]
+    if pairs:
+        before = [p[1] for p in pairs]
+        after = [p[2] for p in pairs]
+        report["latency"] = {
+            "captured": {"p50_s": percentile(before, 50), "p95_s": percentile(before, 95),
+                         "p99_s": percentile(before, 99)},
+            "replay": {"p50_s": percentile(after, 50), "p95_s": percentile(after, 95),
+                       "p99_s": percentile(after, 99)},
+            "mean_delta_s": round(sum(a - b for _, b, a in pairs) / len(pairs), 3),
+        }
+        worst = sorted(pairs, key=lambda p: p[2] - p[1], reverse=True)[:top]
+        report["regressions"] = [
+            {"index": i, "tokens": records[i].get("tokens"), "strategy": records[i].get("strategy"),
+             "replay_strategy": replayed[i].get("strategy"), "captured_s": round(b, 3), "replay_s": round(a, 3)}
+            for i, b, a in worst if a > b
+        ]
+    errors = sum(1 for n in replayed if n.get("status") not in (None, 200))
+    if errors:
+        report["replay_errors"] = errors
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay de capturas do LLM-Optimizer")
+    parser.add_argument("captures", nargs="+", help="Arquivo(s) de captura (CAPTURE_PATH); rotações são incluídas")
+    parser.add_argument("--url", default=os.environ.get("OPTIMIZER_URL", "http://localhost:8512"))
+    parser.add_argument("--routing-only", action="store_true", help="Só recalcula o roteamento (sem HTTP)")
+    parser.add_argument("--policy", default="static", help="Política no modo --routing-only")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--pace", action="store_true", help="Respeita o espaçamento original entre requests")
+    parser.add_argument("--speed", type=float, default=1.0, help="Fator de aceleração com --pace")
+    parser.add_argument("--use-cache", action="store_true", help="Não envia bypass do cache de respostas")
+    parser.add_argument("--limit", type=int, default=0, help="Reenvia só os N primeiros")
+    parser.add_argument("--top", type=int, default=5, help="Maiores regressões listadas")
+    parser.add_argument("--json", action="store_true", help="Saída JSON")
+    args = parser.parse_args()
+
+    records = read_captures(args.captures)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("Nenhum registro de captura encontrado", file=sys.stderr)
+        sys.exit(2)
+
+    if args.routing_only:
+        opt = load_optimizer()
+        if args.policy not in opt.ROUTING_POLICIES:
+            print(f"Política desconhecida: {args.policy}", file=sys.stderr)
+            sys.exit(2)
+        replayed = replay_routing(opt, records, args.policy)
+    else:
+        replayed = asyncio.run(replay_http(args.url, records, args.concurrency, args.pace, args.speed,
+                                           not args.use_cache))
+
+    report = diff(records, replayed, args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    print(f"requests: {report['requests']}  estratégia mudou: {report['strategy_changed']}")
+    for transition, n in sorted(report["transitions"].items()):
+        print(f"  {transition:<8}{n:>6}")
+    if "latency" in report:
+        lat = report["latency"]
+        print(f"{'':<10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name in ("captured", "replay"):
+            print(f"{name:<10}{lat[name]['p50_s']:>10}{lat[name]['p95_s']:>10}{lat[name]['p99_s']:>10}")
+        print(f"delta médio: {lat['mean_delta_s']:+}s")
+    for r in report.get("regressions", []):
+        print(f"  #{r['index']} ~{r['tokens']} tokens {r['strategy']}→{r['replay_strategy']}: "
+              f"{r['captured_s']}s → {r['replay_s']}s")
+    if report.get("replay_errors"):
+        print(f"erros no replay: {report['replay_errors']}")
+
+
+if __name__ == "__main__":
+    main()
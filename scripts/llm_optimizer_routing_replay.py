@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Replay offline de políticas de roteamento do LLM-Optimizer
+
+Lê o log de roteamento gravado pelo optimizer (ROUTING_LOG_PATH) e simula,
+para cada política, o tráfego registrado contra o Ollama: as chamadas
+`ollama` do log definem o perfil de throughput de cada modelo e os eventos
+`request` são re-roteados em ordem de chegada, com fila FIFO por modelo.
+Reporta latência simulada (média/p50/p95/p99) e o mix de estratégias.
+
+Uso:
+    # No homelab: ROUTING_LOG_PATH=/home/homelab/llm-optimizer/routing.jsonl
+    python3 scripts/llm_optimizer_routing_replay.py routing.jsonl
+
+    # Apenas algumas políticas, saída JSON
+    python3 scripts/llm_optimizer_routing_replay.py routing.jsonl --policies static,adaptive --json
+"""
+
+import argparse
+import heapq
+import importlib.util
+import json
+import os
+import sys
+from collections import Counter
+from typing import Dict, List
+
+OPTIMIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_optimizer_v2.3.py")
+
+
+def load_optimizer():
+    spec = importlib.util.spec_from_file_location("llm_optimizer", OPTIMIZER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["llm_optimizer"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_log(path: str):
+    requests, calls = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("type") == "request":
+                requests.append(event)
+            elif event.get("type") == "ollama":
+                calls.append(event)
+    requests.sort(key=lambda e: e["ts"])
+    return requests, calls
+
+
+class SimulatedStats:
+    """Perfil fixo de throughput (do log) + fila simulada por modelo."""
+
+    def __init__(self, profile, parallel: int):
+        self.profile = profile
+        self.parallel = parallel
+        self.free_at: Dict[str, List[float]] = {}
+        self.now = 0.0
+
+    def _slots(self, model: str) -> List[float]:
+        return self.free_at.setdefault(model, [0.0] * self.parallel)
+
+    def samples(self, model: str) -> int:
+        return self.profile.samples(model)
+
+    def prompt_rate(self, model: str) -> float:
+        return self.profile.prompt_rate(model)
+
+    def eval_rate(self, model: str) -> float:
+        return self.profile.eval_rate(model)
+
+    def output_tokens(self, model: str) -> float:
+        return self.profile.output_tokens(model)
+
+    def expected_wait(self, model: str) -> float:
+        return max(0.0, min(self._slots(model)) - self.now)
+
+    def run(self, model: str, not_before: float, seconds: float) -> float:
+        """Ocupa o próximo slot livre do modelo e devolve o instante de término."""
+        slots = self._slots(model)
+        start = max(not_before, heapq.heappop(slots))
+        end = start + seconds
+        heapq.heappush(slots, end)
+        return end
+
+
+def simulate(opt, policy, requests: List[Dict], profile, parallel: int) -> Dict:
+    stats = SimulatedStats(profile, parallel)
+    latencies, mix = [], Counter()
+
+    def call(model, prompt_tokens, output_tokens):
+        return prompt_tokens / stats.prompt_rate(model) + output_tokens / stats.eval_rate(model)
+
+    for req in requests:
+        stats.now = req["ts"]
+        tokens, n_messages = req["tokens"], req.get("messages", 1)
+        strategy = policy.choose(tokens, n_messages, stats)
+        mix[strategy] += 1
+
+        if strategy == "A":
+            end = stats.run(opt.MODEL_FAST, stats.now, call(opt.MODEL_FAST, tokens, stats.output_tokens(opt.MODEL_FAST)))
+        elif strategy == "B":
+            end = stats.run(opt.MODEL_LIGHTER, stats.now,
+                            call(opt.MODEL_LIGHTER, tokens, stats.output_tokens(opt.MODEL_LIGHTER)))
+        else:
+            n_chunks = max(1, -(-n_messages // opt.MAP_CHUNK_AVG))
+            map_end = stats.run(opt.MODEL_LIGHTER, stats.now,
+                                call(opt.MODEL_LIGHTER, tokens, n_chunks * opt.SUMMARY_TOKENS))
+            end = stats.run(opt.MODEL_FAST, map_end,
+                            call(opt.MODEL_FAST, n_chunks * opt.SUMMARY_TOKENS, stats.output_tokens(opt.MODEL_FAST)))
+        latencies.append(end - stats.now)
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 2) if latencies else 0.0
+
+    return {
+        "policy": policy.name,
+        "requests": len(latencies),
+        "mean_s": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_s": pct(50),
+        "p95_s": pct(95),
+        "p99_s": pct(99),
+        "strategies": dict(mix),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay offline de políticas de roteamento")
+    parser.add_argument("log", help="Arquivo JSONL gravado via ROUTING_LOG_PATH")
+    parser.add_argument("--policies", default="static,adaptive", help="Políticas separadas por vírgula")
+    parser.add_argument("--parallel", type=int, default=int(os.environ.get("ROUTING_OLLAMA_PARALLEL", "1")),
+                        help="Requests simultâneos por modelo no Ollama (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--json", action="store_true", help="Saída JSON")
+    args = parser.parse_args()
+
+    opt = load_optimizer()
+    requests, calls = load_log(args.log)
+
+    profile = opt.ModelStats(window=max(len(calls), 1))
+    for c in calls:
+        profile.observe(c["model"], c["prompt_tokens"], c["eval_tokens"], c["prompt_seconds"], c["eval_seconds"])
+
+    missing = [m for m in (opt.MODEL_FAST, opt.MODEL_LIGHTER) if not profile.prompt_rate(m) or not profile.eval_rate(m)]
+    if missing:
+        print(f"Log sem chamadas suficientes para: {', '.join(missing)}", file=sys.stderr)
+        sys.exit(2)
+
+    results = []
+    for name in args.policies.split(","):
+        policy_cls = opt.ROUTING_POLICIES.get(name.strip())
+        if policy_cls is None:
+            print(f"Política desconhecida: {name}", file=sys.stderr)
+            sys.exit(2)
+        results.append(simulate(opt, policy_cls(), requests, profile, args.parallel))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'política':<12}{'reqs':>6}{'média':>10}{'p50':>10}{'p95':>10}{'p99':>10}  estratégias")
+    for r in results:
+        print(f"{r['policy']:<12}{r['requests']:>6}{r['mean_s']:>10}{r['p50_s']:>10}{r['p95_s']:>10}{r['p99_s']:>10}"
+              f"  {r['strategies']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,26 +8,62 @@ Correções v2.3:
 - Fallback para payloads malformados
 - Logging estruturado de erros de schema
 - Preservação de tool definitions em truncamento
+- Streaming SSE (`stream: true`) repassando chunks do Ollama em tempo real
+- Cliente HTTP compartilhado com pool/keep-alive para todas as chamadas ao Ollama
+- Cache persistente de respostas (SQLite, LRU + TTL) para requests determinísticos
+- Contagem de tokens plugável (tokenizer real do qwen3 via tokenizer.json, memoizada)
+- Map-Reduce incremental: chunks estáveis por conteúdo + cache de resumos
+- Roteamento adaptativo (latência/throughput por modelo + fila) com políticas plugáveis
+- Controle de admissão: concorrência por modelo, fila com prioridade e 429/Retry-After
+- Reuso de prefixo: keep_alive fixa o modelo e o proxy acompanha o prefixo em cache no Ollama
+- Smart truncation em passada única (regex pré-compilada, spans mesclados) com memo por hash
+- Pool de backends Ollama: menor fila, afinidade por modelo carregado, ejeção e probe
+- MAP com concorrência limitada, timeout/retry por chunk, redução em árvore e prazo com resultado parcial
+- Captura opcional de requests/respostas em JSONL gzip rotativo (thread dedicada) para replay
+- Latência por etapa (histogramas + spans OpenTelemetry opcionais) e /debug/slow
+- Caminho rápido: parse único (orjson), validação estrutural sem pydantic, hash incremental
+- Cache semântico opcional (embeddings do Ollama + ANN) para prompts só de leitura
+- Corrida especulativa 0.6b × 4b na faixa de fronteira A/B, com win-rate por faixa realimentando o roteamento
+- Validação incremental do XML de ferramentas do CLINE no stream, com reparo local ou continuação curta
+- Planejador de contexto: saídas de ferramenta antigas viram digests (início/fim) para caber em STRATEGY_A_MAX
+- Modo multi-worker: dedup in-flight e slots de admissão compartilhados em SQLite WAL + métricas multiprocess
 
 Porta: 8512
 Host: 0.0.0.0
 """
 
 import asyncio
+import gzip
 import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
+import operator
 import os
+import queue
+import random
 import re
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
 import time
-from collections import defaultdict
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import httpx
 from fastapi import FastAPI, Request, Response
-from fastapi.responses import JSONResponse
-from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
 from pydantic import BaseModel, Field
 
 # ══════════════════════════════════════════════════════════════════════════
@@ -38,6 +74,47 @@ OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
 PORT = int(os.environ.get("LLM_OPTIMIZER_PORT", "8512"))
 HOST = os.environ.get("LLM_OPTIMIZER_HOST", "0.0.0.0")
 TIMEOUT_EACH = int(os.environ.get("TIMEOUT_EACH", "1200"))  # 20min por request
+# Mantém o modelo (e o KV cache do prefixo) carregado entre turnos
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Pool de conexões HTTP com o Ollama (limites por host)
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.environ.get("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY", "120"))
+OLLAMA_HTTP2 = os.environ.get("OLLAMA_HTTP2", "1") == "1"
+
+# Backends Ollama: "url=modelo1,modelo2;url2" (sem modelos = serve todos)
+OLLAMA_BACKENDS = os.environ.get("OLLAMA_BACKENDS", "")
+OLLAMA_EJECT_FAILURES = int(os.environ.get("OLLAMA_EJECT_FAILURES", "3"))
+OLLAMA_PROBE_INTERVAL = float(os.environ.get("OLLAMA_PROBE_INTERVAL", "10"))
+OLLAMA_PROBE_TIMEOUT = float(os.environ.get("OLLAMA_PROBE_TIMEOUT", "3"))
+# Custo (em requests na fila) de mandar um modelo para um backend onde ele está frio
+OLLAMA_AFFINITY_PENALTY = float(os.environ.get("OLLAMA_AFFINITY_PENALTY", "1"))
+
+# Cache persistente de respostas (somente temperature <= RESPONSE_CACHE_MAX_TEMPERATURE)
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_PATH = os.environ.get(
+    "RESPONSE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_optimizer_cache.sqlite3"),
+)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "86400"))  # 24h
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.environ.get("RESPONSE_CACHE_MAX_TEMPERATURE", "0.0"))
+# Formato das chaves do cache persistente: incrementar quando hash_messages mudar
+# (v2: MessageHasher com tamanho prefixado), para não servir entradas de outro formato
+CACHE_KEY_VERSION = 2
+
+# Cache semântico (opt-in): reaproveita respostas de prompts quase iguais
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_MODEL = os.environ.get("SEMANTIC_CACHE_MODEL", "nomic-embed-text")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # cosseno
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_TEMPERATURE = float(os.environ.get("SEMANTIC_CACHE_MAX_TEMPERATURE", "0.3"))
+SEMANTIC_CACHE_MAX_CHARS = int(os.environ.get("SEMANTIC_CACHE_MAX_CHARS", "8000"))  # texto embedado
+SEMANTIC_CACHE_TIMEOUT = float(os.environ.get("SEMANTIC_CACHE_TIMEOUT", "5"))
+# Fração dos hits reexecutados em background para medir falsos hits
+SEMANTIC_CACHE_VERIFY_RATE = float(os.environ.get("SEMANTIC_CACHE_VERIFY_RATE", "0.05"))
 
 # Modelos
 MODEL_FAST = "qwen3:4b"
@@ -47,6 +124,86 @@ MODEL_LIGHTER = "qwen3:0.6b"
 STRATEGY_A_MAX = 2000
 STRATEGY_B_MAX = 6000
 
+# Contagem de tokens: tokenizer.json do qwen3 (vazio → heurística 4 chars/token)
+TOKENIZER_PATH = os.environ.get("TOKENIZER_PATH", "")
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", "4096"))
+TRUNCATION_CACHE_SIZE = int(os.environ.get("TRUNCATION_CACHE_SIZE", "256"))
+
+# Planejador de contexto: compacta turnos antigos para caber no caminho rápido (A)
+CONTEXT_PLANNER_ENABLED = os.environ.get("CONTEXT_PLANNER_ENABLED", "1") == "1"
+CONTEXT_KEEP_RECENT = int(os.environ.get("CONTEXT_KEEP_RECENT", "4"))      # mensagens finais intocadas
+CONTEXT_DIGEST_MIN_TOKENS = int(os.environ.get("CONTEXT_DIGEST_MIN_TOKENS", "200"))
+CONTEXT_DIGEST_HEAD_LINES = int(os.environ.get("CONTEXT_DIGEST_HEAD_LINES", "12"))
+CONTEXT_DIGEST_TAIL_LINES = int(os.environ.get("CONTEXT_DIGEST_TAIL_LINES", "6"))
+CONTEXT_DIGEST_LINE_CHARS = int(os.environ.get("CONTEXT_DIGEST_LINE_CHARS", "200"))
+CONTEXT_DIGEST_CACHE_SIZE = int(os.environ.get("CONTEXT_DIGEST_CACHE_SIZE", "1024"))
+
+# Map-Reduce (Strategy C): chunking por conteúdo + cache de resumos
+MAP_CHUNK_MIN = int(os.environ.get("MAP_CHUNK_MIN", "2"))
+MAP_CHUNK_AVG = int(os.environ.get("MAP_CHUNK_AVG", "4"))
+MAP_CHUNK_MAX = int(os.environ.get("MAP_CHUNK_MAX", "6"))
+MAP_SUMMARY_CACHE_SIZE = int(os.environ.get("MAP_SUMMARY_CACHE_SIZE", "1024"))
+MAP_CONCURRENCY = int(os.environ.get("MAP_CONCURRENCY", "4"))            # chunks simultâneos por request
+MAP_CHUNK_TIMEOUT = float(os.environ.get("MAP_CHUNK_TIMEOUT", "120"))     # por tentativa
+MAP_CHUNK_RETRIES = int(os.environ.get("MAP_CHUNK_RETRIES", "1"))
+MAP_DEADLINE = float(os.environ.get("MAP_DEADLINE", "300"))               # MAP inteiro; depois segue com o que tiver
+MAP_REDUCE_FANIN = int(os.environ.get("MAP_REDUCE_FANIN", "8"))           # resumos por nó da árvore (0 = sem árvore)
+MAP_FALLBACK_CHARS = int(os.environ.get("MAP_FALLBACK_CHARS", "800"))     # trecho bruto quando o resumo falha
+
+# Roteamento: "static" (thresholds) ou "adaptive" (tempo esperado de conclusão)
+ROUTING_POLICY = os.environ.get("ROUTING_POLICY", "adaptive")
+ROUTING_WINDOW = int(os.environ.get("ROUTING_WINDOW", "50"))  # amostras por modelo
+ROUTING_MIN_SAMPLES = int(os.environ.get("ROUTING_MIN_SAMPLES", "5"))
+ROUTING_CONTEXT_LIMIT = int(os.environ.get("ROUTING_CONTEXT_LIMIT", "8192"))  # num_ctx
+ROUTING_OLLAMA_PARALLEL = int(os.environ.get("ROUTING_OLLAMA_PARALLEL", "1"))  # OLLAMA_NUM_PARALLEL
+ROUTING_QUALITY_SLACK = float(os.environ.get("ROUTING_QUALITY_SLACK", "0.25"))
+ROUTING_LOG_PATH = os.environ.get("ROUTING_LOG_PATH", "")
+
+# Corrida especulativa (opt-in) na faixa de fronteira entre A e B
+RACE_ENABLED = os.environ.get("RACE_ENABLED", "0") == "1"
+RACE_BAND_MIN = int(os.environ.get("RACE_BAND_MIN", "1500"))    # tokens
+RACE_BAND_MAX = int(os.environ.get("RACE_BAND_MAX", "3000"))
+RACE_BUCKET = int(os.environ.get("RACE_BUCKET", "500"))         # largura das faixas de win-rate
+RACE_BUDGET = float(os.environ.get("RACE_BUDGET", "15"))        # s até o 1º trecho válido do modelo leve
+RACE_VALIDATE_CHARS = int(os.environ.get("RACE_VALIDATE_CHARS", "64"))
+RACE_WINDOW = int(os.environ.get("RACE_WINDOW", "50"))          # corridas por faixa
+RACE_MIN_SAMPLES = int(os.environ.get("RACE_MIN_SAMPLES", "10"))
+RACE_LIGHT_ONLY_RATE = float(os.environ.get("RACE_LIGHT_ONLY_RATE", "0.9"))  # acima: só o leve (B)
+RACE_HEAVY_ONLY_RATE = float(os.environ.get("RACE_HEAVY_ONLY_RATE", "0.5"))  # abaixo: só o pesado (A)
+RACE_EXPLORE = float(os.environ.get("RACE_EXPLORE", "0.1"))     # corridas mantidas em faixas já decididas
+
+# Captura de tráfego (JSONL gzip rotativo; vazio = desligado)
+CAPTURE_PATH = os.environ.get("CAPTURE_PATH", "")
+CAPTURE_MAX_BYTES = int(os.environ.get("CAPTURE_MAX_BYTES", str(64 * 1024 * 1024)))
+CAPTURE_BACKUPS = int(os.environ.get("CAPTURE_BACKUPS", "5"))
+CAPTURE_QUEUE_SIZE = int(os.environ.get("CAPTURE_QUEUE_SIZE", "1000"))
+CAPTURE_RESPONSES = os.environ.get("CAPTURE_RESPONSES", "1") == "1"
+
+# Reparo de tool calls XML do CLINE (tags trocadas/truncadas)
+TOOL_REPAIR_ENABLED = os.environ.get("TOOL_REPAIR_ENABLED", "1") == "1"
+TOOL_REPAIR_MAX_TOKENS = int(os.environ.get("TOOL_REPAIR_MAX_TOKENS", "512"))  # continuação
+TOOL_REPAIR_TIMEOUT = float(os.environ.get("TOOL_REPAIR_TIMEOUT", "120"))
+
+# Controle de admissão (fila com prioridade na frente do Ollama)
+ADMISSION_CONCURRENCY = int(os.environ.get("ADMISSION_CONCURRENCY", str(ROUTING_OLLAMA_PARALLEL)))
+ADMISSION_WAIT_BUDGET = float(os.environ.get("ADMISSION_WAIT_BUDGET", "600"))  # 0 = sem limite
+
+# Multi-worker: N processos no mesmo socket; dedup e admissão via SQLite WAL compartilhado
+LLM_OPTIMIZER_WORKERS = int(os.environ.get("LLM_OPTIMIZER_WORKERS", "1"))
+SHARED_STATE_PATH = os.environ.get(
+    "SHARED_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_optimizer_state.sqlite3"),
+)
+SHARED_POLL_INTERVAL = float(os.environ.get("SHARED_POLL_INTERVAL", "0.05"))
+SHARED_CLAIM_TTL = float(os.environ.get("SHARED_CLAIM_TTL", "7200"))  # claim de dono vivo expira só após isso
+# Precisa estar no ambiente antes do import do prometheus_client (os workers herdam do pai)
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Latência por etapa: requests recentes guardados para /debug/slow
+SLOW_TRACE_WINDOW = int(os.environ.get("SLOW_TRACE_WINDOW", "500"))
+# OpenTelemetry: spans exportados via OTLP quando o endpoint estiver definido
+OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+
 # Configuração de logging
 logging.basicConfig(
     level=logging.INFO,
@@ -55,6 +212,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger("llm-optimizer")
 
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    TOKENIZERS_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+try:
+    from opentelemetry import trace as otel_trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
 # ══════════════════════════════════════════════════════════════════════════
 # Métricas Prometheus
 # ══════════════════════════════════════════════════════════════════════════
@@ -75,17 +256,1202 @@ duration_histogram = Histogram(
     ["strategy"],
 )
 service_up = Gauge("llm_optimizer_up", "Service status")
+ttft_histogram = Histogram(
+    "llm_optimizer_time_to_first_token_seconds",
+    "Tempo até o primeiro token em requisições streaming",
+    ["strategy"],
+)
 
 # In-flight cache (dedup)
 _inflight_cache: Dict[str, asyncio.Event] = {}
 _inflight_results: Dict[str, Any] = {}
 dedup_hits = Counter("llm_optimizer_dedup_hits_total", "Cache hits em in-flight requests")
 
+# Contagem de tokens
+token_count_cache = Counter(
+    "llm_optimizer_token_count_cache_total",
+    "Memo de contagem de tokens por mensagem",
+    ["result"],  # hit / miss
+)
+
+# Roteamento
+routing_decisions = Counter(
+    "llm_optimizer_routing_decisions_total",
+    "Decisões de roteamento por política e estratégia",
+    ["policy", "strategy"],
+)
+tool_repairs = Counter(
+    "llm_optimizer_tool_repairs_total",
+    "Reparos de XML de ferramenta na resposta",
+    ["kind"],  # mismatch / stray_close / continued / closed
+)
+tool_repair_saved = Counter(
+    "llm_optimizer_tool_repair_saved_seconds_total",
+    "Tempo estimado poupado por reparo (rodada completa do CLINE evitada)",
+)
+race_outcomes = Counter(
+    "llm_optimizer_race_outcomes_total",
+    "Corridas especulativas por faixa de tokens e vencedor",
+    ["band", "winner"],  # light / heavy / none
+)
+race_heavy_started = Counter(
+    "llm_optimizer_race_heavy_started_total",
+    "Modelo pesado disparado na corrida",
+    ["band", "reason"],  # timeout / invalid
+)
+race_light_win_rate = Gauge(
+    "llm_optimizer_race_light_win_rate",
+    "Fração de corridas vencidas pelo modelo leve (janela móvel)",
+    ["band"],
+)
+model_inflight = Gauge("llm_optimizer_model_inflight", "Requests em andamento no Ollama por modelo", ["model"])
+model_tokens_per_second = Gauge(
+    "llm_optimizer_model_tokens_per_second",
+    "Throughput observado por modelo (janela móvel)",
+    ["model", "phase"],  # prompt / eval
+)
+
+# Captura
+capture_records = Counter("llm_optimizer_capture_records_total", "Registros de captura", ["result"])  # written / dropped / error
+
+# Admissão
+admission_queue_length = Gauge("llm_optimizer_admission_queue_length", "Chamadas aguardando slot por modelo", ["model"])
+admission_wait_histogram = Histogram(
+    "llm_optimizer_admission_wait_seconds",
+    "Tempo de espera por slot do Ollama",
+    ["model", "priority"],
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+admission_rejected = Counter("llm_optimizer_admission_rejected_total", "Requests recusados com 429", ["model"])
+
+context_planner_requests = Counter(
+    "llm_optimizer_context_planner_requests_total",
+    "Requests acima do orçamento passados pelo planejador de contexto",
+    ["result"],  # fitted / over_budget
+)
+context_digests = Counter(
+    "llm_optimizer_context_digests_total",
+    "Mensagens substituídas por digest, por papel",
+    ["kind"],  # tool / assistant / user
+)
+context_digest_cache = Counter(
+    "llm_optimizer_context_digest_cache_total",
+    "Memo de digests por hash do conteúdo",
+    ["result"],  # hit / miss
+)
+truncation_cache = Counter(
+    "llm_optimizer_truncation_cache_total",
+    "Memo do smart truncation por system prompt",
+    ["result"],  # hit / miss
+)
+
+# Reuso de prefixo (KV cache do Ollama)
+prefix_reuse = Counter("llm_optimizer_prefix_reuse_total", "Chamadas com prefixo já avaliado no Ollama", ["model", "result"])
+prompt_eval_tokens_avoided = Counter(
+    "llm_optimizer_prompt_eval_tokens_avoided_total",
+    "Tokens de prompt reaproveitados do KV cache (estimativa do prompt - prompt_eval_count)",
+    ["model"],
+)
+
+# Pipeline MAP
+map_chunk_results = Counter(
+    "llm_optimizer_map_chunks_total",
+    "Chunks do MAP por resultado",
+    ["result"],  # ok / retry / timeout / error / excerpt
+)
+map_folds = Counter("llm_optimizer_map_folds_total", "Nós da redução em árvore", ["result"])  # ok / fallback
+map_partial_reduce = Counter("llm_optimizer_map_partial_reduce_total", "REDUCE iniciado com resumos faltando")
+
+# Cache de resumos do MAP
+map_summary_cache = Counter(
+    "llm_optimizer_map_summary_cache_total",
+    "Cache de resumos de chunks no Map-Reduce",
+    ["result"],  # hit / miss
+)
+
+# Cache de respostas
+response_cache_requests = Counter(
+    "llm_optimizer_response_cache_requests_total",
+    "Consultas ao cache de respostas",
+    ["result"],  # hit / miss / bypass
+)
+response_cache_evictions = Counter(
+    "llm_optimizer_response_cache_evictions_total",
+    "Entradas removidas do cache de respostas",
+    ["reason"],  # lru / ttl
+)
+response_cache_entries = Gauge("llm_optimizer_response_cache_entries", "Entradas no cache de respostas")
+
+# Cache semântico
+semantic_cache_requests = Counter(
+    "llm_optimizer_semantic_cache_requests_total",
+    "Consultas ao cache semântico",
+    ["result"],  # hit / miss / ineligible / error
+)
+semantic_cache_similarity = Histogram(
+    "llm_optimizer_semantic_cache_similarity",
+    "Similaridade do vizinho mais próximo no cache semântico",
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.98, 0.99, 1.0),
+)
+semantic_cache_verifications = Counter(
+    "llm_optimizer_semantic_cache_verifications_total",
+    "Hits amostrados reexecutados no modelo",
+    ["result"],  # confirmed / false_hit / error
+)
+semantic_cache_entries = Gauge("llm_optimizer_semantic_cache_entries", "Entradas no cache semântico")
+
+# Pool HTTP
+pool_connections = Gauge(
+    "llm_optimizer_pool_connections",
+    "Conexões do pool HTTP por host e estado (in_use/idle/waiting)",
+    ["host", "state"],
+)
+pool_wait_histogram = Histogram(
+    "llm_optimizer_pool_wait_seconds",
+    "Tempo de espera por uma conexão livre no pool HTTP",
+    ["host"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+
+# Latência por etapa
+stage_histogram = Histogram(
+    "llm_optimizer_stage_seconds",
+    "Tempo por etapa do pipeline",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 180.0, 600.0),
+)
+
+# Backends Ollama
+backend_outstanding = Gauge("llm_optimizer_backend_outstanding", "Requests em andamento por backend", ["backend"])
+backend_healthy = Gauge("llm_optimizer_backend_healthy", "Backend ativo (1) ou ejetado (0)", ["backend"])
+backend_requests = Counter("llm_optimizer_backend_requests_total", "Chamadas por backend", ["backend", "result"])
+backend_ejections = Counter("llm_optimizer_backend_ejections_total", "Ejeções por falha", ["backend"])
+
+# ══════════════════════════════════════════════════════════════════════════
+# Latência por etapa (tracing)
+# ══════════════════════════════════════════════════════════════════════════
+
+class RequestTrace:
+    """Tempos acumulados por etapa de um request (inclui sub-chamadas do MAP)."""
+
+    def __init__(self):
+        self.id = f"req-{time.time_ns():x}"
+        self.ts = time.time()
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.strategy: Optional[str] = None
+        self.tokens = 0
+        self.status = 200
+        self.total = 0.0
+        self.span = None
+        self.span_context = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "timestamp": datetime.fromtimestamp(self.ts, timezone.utc).isoformat(),
+            "strategy": self.strategy,
+            "tokens": self.tokens,
+            "status": self.status,
+            "total_s": round(self.total, 4),
+            "stages": {k: round(v, 4) for k, v in sorted(self.stages.items(), key=lambda kv: -kv[1])},
+        }
+
+# Propagado para tasks filhas (MAP) via contextvars
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("llm_optimizer_trace", default=None)
+_recent_traces: deque = deque(maxlen=SLOW_TRACE_WINDOW)
+_tracer = None
+_tracer_provider = None
+
+def setup_tracing():
+    """Liga spans OpenTelemetry (OTLP) se o SDK estiver instalado e o endpoint definido."""
+    global _tracer, _tracer_provider
+    if not (OTEL_AVAILABLE and OTEL_EXPORTER_OTLP_ENDPOINT):
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT definido mas opentelemetry-sdk/exporter não instalados")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": "llm-optimizer"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    _tracer_provider = provider
+    _tracer = otel_trace.get_tracer("llm-optimizer")
+    logger.info(f"OpenTelemetry: spans → {OTEL_EXPORTER_OTLP_ENDPOINT}")
+
+def shutdown_tracing():
+    """Exporta os spans pendentes antes de sair."""
+    global _tracer, _tracer_provider
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+    _tracer = _tracer_provider = None
+
+def begin_trace() -> RequestTrace:
+    trace = RequestTrace()
+    if _tracer is not None:
+        trace.span = _tracer.start_span("chat.completions")
+        trace.span_context = otel_trace.set_span_in_context(trace.span)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: RequestTrace, status: int = 200):
+    """Fecha o trace do request e o disponibiliza em /debug/slow."""
+    trace.status = status
+    trace.total = time.perf_counter() - trace.started
+    stage_histogram.labels(stage="total").observe(trace.total)
+    _recent_traces.append(trace)
+    if trace.span is not None:
+        trace.span.set_attribute("llm.strategy", trace.strategy or "")
+        trace.span.set_attribute("llm.tokens", trace.tokens)
+        trace.span.set_attribute("http.status_code", status)
+        trace.span.end()
+
+def record_stage(stage: str, seconds: float):
+    stage_histogram.labels(stage=stage).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+@contextmanager
+def stage(name: str):
+    """Mede uma etapa: histograma + trace do request + span OTel (se ativo)."""
+    trace = _current_trace.get()
+    span = (_tracer.start_as_current_span(name, context=trace.span_context)
+            if _tracer is not None and trace is not None else nullcontext())
+    start = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            record_stage(name, time.perf_counter() - start)
+
+def record_ollama_timings(data: Dict):
+    """Separa o tempo do Ollama em load / prompt eval / eval (durações em ns)."""
+    for key, name in (("load_duration", "ollama_load"),
+                      ("prompt_eval_duration", "ollama_prompt_eval"),
+                      ("eval_duration", "ollama_eval")):
+        if data.get(key):
+            record_stage(name, data[key] / 1e9)
+
+def slowest_traces(n: int = 10) -> List[Dict]:
+    return [t.as_dict() for t in heapq.nlargest(n, list(_recent_traces), key=lambda t: t.total)]
+
+# ══════════════════════════════════════════════════════════════════════════
+# Cliente HTTP compartilhado (pool + keep-alive)
+# ══════════════════════════════════════════════════════════════════════════
+
+try:
+    import h2  # noqa: F401 — habilita HTTP/2 no httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Um cliente por host → limites de conexão independentes por backend
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+def get_http_client(host: str = OLLAMA_HOST) -> httpx.AsyncClient:
+    """Retorna o cliente pooled do host (criado sob demanda, vive até o shutdown)."""
+    client = _http_clients.get(host)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=TIMEOUT_EACH,
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+            http2=OLLAMA_HTTP2 and HTTP2_AVAILABLE,
+        )
+        _http_clients[host] = client
+    return client
+
+async def close_http_clients():
+    """Fecha todos os clientes pooled (shutdown)."""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+def pool_wait_extensions(host: str) -> Dict[str, Any]:
+    """
+    Extensão `trace` do httpcore que mede a espera por conexão no pool.
+
+    O primeiro evento de trace (connect_tcp ou send_request_headers) só ocorre
+    depois que o pool entregou uma conexão ao request.
+    """
+    start = time.monotonic()
+    observed = False
+
+    async def trace(event: str, info: Dict[str, Any]) -> None:
+        nonlocal observed
+        if not observed:
+            observed = True
+            pool_wait_histogram.labels(host=host).observe(time.monotonic() - start)
+
+    return {"trace": trace}
+
+def update_pool_metrics():
+    """Atualiza gauges do pool lendo o estado interno do httpcore."""
+    for host, client in _http_clients.items():
+        try:
+            pool = client._transport._pool
+            connections = pool.connections
+            idle = sum(1 for c in connections if c.is_idle())
+            waiting = sum(1 for r in pool._requests if r.is_queued())
+        except AttributeError:
+            # Transport customizado (ex.: testes) não expõe o pool
+            continue
+        pool_connections.labels(host=host, state="idle").set(idle)
+        pool_connections.labels(host=host, state="in_use").set(len(connections) - idle)
+        pool_connections.labels(host=host, state="waiting").set(waiting)
+
+# ══════════════════════════════════════════════════════════════════════════
+# Pool de backends Ollama (balanceamento + failover)
+# ══════════════════════════════════════════════════════════════════════════
+
+class OllamaBackend:
+    """Um processo Ollama e os modelos que ele serve (None = todos)."""
+
+    def __init__(self, url: str, models: Optional[set] = None):
+        self.url = url.rstrip("/")
+        self.models = models
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.loaded: set = set()  # modelos quentes (último /api/ps + chamadas bem-sucedidas)
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+def parse_backends(spec: str, default_host: str = OLLAMA_HOST) -> List[OllamaBackend]:
+    """`http://a:11434=qwen3:4b,qwen3:0.6b;http://b:11434` → backends."""
+    backends = []
+    for item in (spec or default_host).split(";"):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, models = item.partition("=")
+        names = {m.strip() for m in models.split(",") if m.strip()}
+        backends.append(OllamaBackend(url.strip(), names or None))
+    return backends
+
+class OllamaPool:
+    """
+    Escolhe o backend de cada chamada.
+
+    Menor número de requests em andamento, com penalidade para backends onde o
+    modelo está frio (afinidade mantém modelos quentes). Falhas consecutivas
+    ejetam o backend; o probe periódico (/api/ps) o readmite e atualiza os
+    modelos carregados.
+    """
+
+    def __init__(self, backends: List[OllamaBackend], eject_failures: int = OLLAMA_EJECT_FAILURES,
+                 affinity_penalty: float = OLLAMA_AFFINITY_PENALTY):
+        self.backends = backends
+        self.eject_failures = eject_failures
+        self.affinity_penalty = affinity_penalty
+        for b in backends:
+            backend_healthy.labels(backend=b.url).set(1)
+            backend_outstanding.labels(backend=b.url).set(0)
+
+    def backends_for(self, model: str) -> List[OllamaBackend]:
+        return [b for b in self.backends if b.serves(model)] or self.backends
+
+    def capacity(self, model: str) -> int:
+        """Backends ativos que servem o modelo (mínimo 1)."""
+        return max(1, sum(1 for b in self.backends_for(model) if b.healthy))
+
+    def pick(self, model: str, exclude=()) -> Optional[OllamaBackend]:
+        candidates = [b for b in self.backends_for(model) if b not in exclude]
+        if not candidates:
+            return None
+        # Todos ejetados: tenta mesmo assim em vez de falhar sem chamar
+        healthy = [b for b in candidates if b.healthy] or candidates
+        return min(healthy, key=lambda b: b.outstanding + (0 if model in b.loaded else self.affinity_penalty))
+
+    def record_success(self, backend: OllamaBackend, model: str):
+        backend.failures = 0
+        backend.loaded.add(model)
+        backend_requests.labels(backend=backend.url, result="ok").inc()
+        if not backend.healthy:
+            self._readmit(backend)
+
+    def record_failure(self, backend: OllamaBackend):
+        backend.failures += 1
+        backend_requests.labels(backend=backend.url, result="error").inc()
+        if backend.healthy and backend.failures >= self.eject_failures:
+            backend.healthy = False
+            backend.loaded.clear()
+            backend_healthy.labels(backend=backend.url).set(0)
+            backend_ejections.labels(backend=backend.url).inc()
+            logger.warning(f"Backend ejetado após {backend.failures} falhas: {backend.url}")
+
+    def _readmit(self, backend: OllamaBackend):
+        backend.healthy = True
+        backend.failures = 0
+        backend_healthy.labels(backend=backend.url).set(1)
+        logger.info(f"Backend readmitido: {backend.url}")
+
+    @asynccontextmanager
+    async def lease(self, backend: OllamaBackend, model: str):
+        """
+        Conta o request no backend e registra sucesso/falha ao sair.
+
+        ReadTimeout (geração longa) e PoolTimeout (pool local cheio) não contam
+        como falha: o backend respondeu à conexão e segue saudável.
+        """
+        backend.outstanding += 1
+        backend_outstanding.labels(backend=backend.url).set(backend.outstanding)
+        try:
+            yield backend
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500:
+                self.record_failure(backend)
+            raise
+        except (httpx.ReadTimeout, httpx.PoolTimeout):
+            raise
+        except httpx.TransportError:
+            self.record_failure(backend)
+            raise
+        else:
+            self.record_success(backend, model)
+        finally:
+            backend.outstanding -= 1
+            backend_outstanding.labels(backend=backend.url).set(backend.outstanding)
+
+    async def open_chat(self, stack: AsyncExitStack, model: str, payload: Dict,
+                        timeout: float) -> "tuple[OllamaBackend, httpx.Response]":
+        """
+        Abre POST /api/chat (resposta em stream) no melhor backend.
+
+        Erro de conexão antes da resposta tenta o próximo backend. O lease e a
+        resposta ficam no `stack` do chamador, que os fecha ao terminar.
+        """
+        # Serializa uma vez (bytes) e reaproveita no failover
+        body = json_dumps_bytes(payload)
+        headers = {"Content-Type": "application/json"}
+        tried: List[OllamaBackend] = []
+        while True:
+            backend = self.pick(model, exclude=tried)
+            attempt = AsyncExitStack()
+            try:
+                await attempt.enter_async_context(self.lease(backend, model))
+                resp = await attempt.enter_async_context(get_http_client(backend.url).stream(
+                    "POST", f"{backend.url}/api/chat", content=body, headers=headers, timeout=timeout,
+                    extensions=pool_wait_extensions(backend.url),
+                ))
+                resp.raise_for_status()
+            except httpx.ConnectError as e:
+                await attempt.__aexit__(type(e), e, e.__traceback__)
+                tried.append(backend)
+                if self.pick(model, exclude=tried) is None:
+                    raise
+                logger.warning(f"Backend {backend.url} indisponível, tentando outro")
+                continue
+            except BaseException as e:
+                await attempt.__aexit__(type(e), e, e.__traceback__)
+                raise
+            stack.push_async_exit(attempt)
+            return backend, resp
+
+    async def probe(self):
+        """Consulta /api/ps de cada backend: saúde + modelos carregados."""
+        for backend in self.backends:
+            try:
+                client = get_http_client(backend.url)
+                resp = await client.get(f"{backend.url}/api/ps", timeout=OLLAMA_PROBE_TIMEOUT)
+                if resp.status_code == 404:
+                    # Ollama antigo sem /api/ps: só checa saúde
+                    resp = await client.get(f"{backend.url}/api/tags", timeout=OLLAMA_PROBE_TIMEOUT)
+                    resp.raise_for_status()
+                else:
+                    resp.raise_for_status()
+                    # Entradas sem nome ficam de fora (/health ordena o set)
+                    backend.loaded = {n for m in resp.json().get("models", []) if (n := m.get("name") or m.get("model"))}
+            except (httpx.HTTPError, ValueError) as e:
+                logger.debug(f"Probe falhou em {backend.url}: {e}")
+                self.record_failure(backend)
+                continue
+            if not backend.healthy:
+                self._readmit(backend)
+
+    async def probe_loop(self, interval: float = OLLAMA_PROBE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.probe()
+            except Exception as e:
+                # Um erro inesperado não pode matar o loop: sem probe, backend ejetado não volta
+                logger.warning(f"Probe dos backends falhou: {e}")
+
+ollama_pool = OllamaPool(parse_backends(OLLAMA_BACKENDS))
+
+# ══════════════════════════════════════════════════════════════════════════
+# Estatísticas por modelo e políticas de roteamento
+# ══════════════════════════════════════════════════════════════════════════
+
+# Tamanho típico (tokens) de um resumo gerado na fase MAP
+SUMMARY_TOKENS = 200
+DEFAULT_OUTPUT_TOKENS = 256
+
+class ModelStats:
+    """
+    Janela móvel de latência/throughput por modelo + requests em andamento.
+
+    Alimentada com `prompt_eval_duration`/`eval_duration` devolvidos pelo
+    Ollama. A profundidade de fila é estimada pelas chamadas em andamento
+    feitas por este proxy (principal cliente do Ollama).
+    """
+
+    def __init__(self, window: int = ROUTING_WINDOW, parallel: int = ROUTING_OLLAMA_PARALLEL):
+        self.parallel = max(1, parallel)
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._inflight: Dict[str, int] = defaultdict(int)
+
+    def begin(self, model: str):
+        self._inflight[model] += 1
+        model_inflight.labels(model=model).set(self._inflight[model])
+
+    def end(self, model: str):
+        self._inflight[model] = max(0, self._inflight[model] - 1)
+        model_inflight.labels(model=model).set(self._inflight[model])
+
+    def observe(self, model: str, prompt_tokens: int, eval_tokens: int,
+                prompt_seconds: float, eval_seconds: float):
+        self._samples[model].append((prompt_tokens, eval_tokens, prompt_seconds, eval_seconds))
+        prompt_rate, eval_rate = self.prompt_rate(model), self.eval_rate(model)
+        if prompt_rate:
+            model_tokens_per_second.labels(model=model, phase="prompt").set(prompt_rate)
+        if eval_rate:
+            model_tokens_per_second.labels(model=model, phase="eval").set(eval_rate)
+
+    def observe_ollama(self, model: str, data: Dict):
+        """Registra uma resposta final do Ollama (durações em nanossegundos)."""
+        if "eval_duration" not in data:
+            return
+        self.observe(
+            model,
+            data.get("prompt_eval_count", 0),
+            data.get("eval_count", 0),
+            data.get("prompt_eval_duration", 0) / 1e9,
+            data.get("eval_duration", 0) / 1e9,
+        )
+        log_routing_event({
+            "type": "ollama",
+            "model": model,
+            "prompt_tokens": data.get("prompt_eval_count", 0),
+            "eval_tokens": data.get("eval_count", 0),
+            "prompt_seconds": data.get("prompt_eval_duration", 0) / 1e9,
+            "eval_seconds": data.get("eval_duration", 0) / 1e9,
+        })
+
+    def samples(self, model: str) -> int:
+        return len(self._samples[model])
+
+    def inflight(self, model: str) -> int:
+        return self._inflight[model]
+
+    def _rate(self, model: str, tokens_idx: int, seconds_idx: int) -> Optional[float]:
+        samples = self._samples[model]
+        tokens = sum(s[tokens_idx] for s in samples)
+        seconds = sum(s[seconds_idx] for s in samples)
+        return tokens / seconds if tokens and seconds else None
+
+    def prompt_rate(self, model: str) -> Optional[float]:
+        """Tokens de prompt avaliados por segundo."""
+        return self._rate(model, 0, 2)
+
+    def eval_rate(self, model: str) -> Optional[float]:
+        """Tokens gerados por segundo."""
+        return self._rate(model, 1, 3)
+
+    def output_tokens(self, model: str) -> float:
+        samples = self._samples[model]
+        return sum(s[1] for s in samples) / len(samples) if samples else DEFAULT_OUTPUT_TOKENS
+
+    def service_seconds(self, model: str) -> float:
+        samples = self._samples[model]
+        return sum(s[2] + s[3] for s in samples) / len(samples) if samples else 0.0
+
+    def expected_wait(self, model: str) -> float:
+        """Espera estimada na fila do Ollama antes de começar a atender."""
+        slots = self.parallel * ollama_pool.capacity(model)
+        return self.inflight(model) / slots * self.service_seconds(model)
+
+def estimate_strategy_seconds(strategy: str, tokens: int, n_messages: int, stats) -> Optional[float]:
+    """
+    Tempo esperado de conclusão (fila + prompt eval + geração) de uma estratégia.
+
+    None quando falta taxa de algum modelo envolvido — ex.: janela só com
+    prompts inteiramente em cache, em que o Ollama omite `prompt_eval_*`.
+    """
+    models = {"A": [MODEL_FAST], "B": [MODEL_LIGHTER]}.get(strategy, [MODEL_LIGHTER, MODEL_FAST])
+    if any(stats.prompt_rate(m) is None or stats.eval_rate(m) is None for m in models):
+        return None
+
+    def call(model: str, prompt_tokens: float, output_tokens: float) -> float:
+        return prompt_tokens / stats.prompt_rate(model) + output_tokens / stats.eval_rate(model)
+
+    if strategy == "A":
+        return stats.expected_wait(MODEL_FAST) + call(MODEL_FAST, tokens, stats.output_tokens(MODEL_FAST))
+    if strategy == "B":
+        return stats.expected_wait(MODEL_LIGHTER) + call(MODEL_LIGHTER, tokens, stats.output_tokens(MODEL_LIGHTER))
+
+    # C: MAP serializado no modelo leve + REDUCE no modelo principal
+    n_chunks = max(1, math.ceil(n_messages / MAP_CHUNK_AVG))
+    map_seconds = stats.expected_wait(MODEL_LIGHTER) + call(MODEL_LIGHTER, tokens, n_chunks * SUMMARY_TOKENS)
+    reduce_seconds = stats.expected_wait(MODEL_FAST) + call(
+        MODEL_FAST, n_chunks * SUMMARY_TOKENS, stats.output_tokens(MODEL_FAST)
+    )
+    return map_seconds + reduce_seconds
+
+class RoutingPolicy:
+    """Interface de política: escolhe a estratégia (A/B/C) de um request."""
+
+    name = "base"
+
+    def choose(self, tokens: int, n_messages: int, stats) -> str:
+        raise NotImplementedError
+
+class StaticThresholdPolicy(RoutingPolicy):
+    """Thresholds fixos (comportamento original)."""
+
+    name = "static"
+
+    def __init__(self, a_max: int = STRATEGY_A_MAX, b_max: int = STRATEGY_B_MAX):
+        self.a_max = a_max
+        self.b_max = b_max
+
+    def choose(self, tokens: int, n_messages: int, stats) -> str:
+        if tokens < self.a_max:
+            return "A"
+        if tokens < self.b_max:
+            return "B"
+        return "C"
+
+class LatencyAwarePolicy(RoutingPolicy):
+    """
+    Minimiza o tempo esperado de conclusão a partir das estatísticas observadas.
+
+    Parte da escolha estática e só considera estratégias de qualidade igual ou
+    superior (B → A; C → A/B) que caibam no contexto do modelo. Entre as
+    candidatas vence a mais rápida, com preferência ao qwen3:4b direto (A) se
+    ele ficar dentro de ROUTING_QUALITY_SLACK do melhor tempo. Sem amostras
+    suficientes dos modelos, usa a política estática.
+    """
+
+    name = "adaptive"
+
+    def __init__(self, static: Optional[StaticThresholdPolicy] = None,
+                 min_samples: int = ROUTING_MIN_SAMPLES, context_limit: int = ROUTING_CONTEXT_LIMIT,
+                 quality_slack: float = ROUTING_QUALITY_SLACK):
+        self.static = static or StaticThresholdPolicy()
+        self.min_samples = min_samples
+        self.context_limit = context_limit
+        self.quality_slack = quality_slack
+
+    def choose(self, tokens: int, n_messages: int, stats) -> str:
+        baseline = self.static.choose(tokens, n_messages, stats)
+        if baseline == "A":
+            return "A"
+        if any(stats.samples(m) < self.min_samples for m in (MODEL_FAST, MODEL_LIGHTER)):
+            return baseline
+
+        candidates = {"B": ["A", "B"], "C": ["A", "B", "C"]}[baseline]
+        fits = lambda s: s == "C" or tokens + stats.output_tokens(MODEL_FAST) <= self.context_limit
+        estimates = {s: estimate_strategy_seconds(s, tokens, n_messages, stats) for s in candidates if fits(s)}
+        estimates = {s: seconds for s, seconds in estimates.items() if seconds is not None}
+        if not estimates:
+            return baseline
+        best = min(estimates, key=estimates.get)
+        if "A" in estimates and estimates["A"] <= estimates[best] * (1 + self.quality_slack):
+            return "A"
+        return best
+
+ROUTING_POLICIES = {"static": StaticThresholdPolicy, "adaptive": LatencyAwarePolicy}
+
+def race_band(tokens: int) -> str:
+    low = tokens // RACE_BUCKET * RACE_BUCKET
+    return f"{low}-{low + RACE_BUCKET}"
+
+class RaceStats:
+    """
+    Win-rate do modelo leve por faixa de tokens (janela móvel).
+
+    Decide o que fazer na faixa: só o leve (B) quando ele quase sempre
+    vence, só o pesado (A) quando costuma perder, corrida (R) no meio e
+    enquanto não houver amostras. Uma fração `explore` das decisões segue
+    correndo para a faixa não congelar.
+    """
+
+    def __init__(self, window: int = RACE_WINDOW, min_samples: int = RACE_MIN_SAMPLES,
+                 light_only_rate: float = RACE_LIGHT_ONLY_RATE, heavy_only_rate: float = RACE_HEAVY_ONLY_RATE,
+                 explore: float = RACE_EXPLORE):
+        self.min_samples = min_samples
+        self.light_only_rate = light_only_rate
+        self.heavy_only_rate = heavy_only_rate
+        self.explore = explore
+        self._outcomes: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, band: str, winner: str):
+        self._outcomes[band].append(winner == "light")
+        race_outcomes.labels(band=band, winner=winner).inc()
+        race_light_win_rate.labels(band=band).set(self.light_win_rate(band))
+
+    def light_win_rate(self, band: str) -> Optional[float]:
+        outcomes = self._outcomes[band]
+        return sum(outcomes) / len(outcomes) if outcomes else None
+
+    def decide(self, band: str) -> str:
+        if len(self._outcomes[band]) < self.min_samples or random.random() < self.explore:
+            return "R"
+        rate = self.light_win_rate(band)
+        if rate >= self.light_only_rate:
+            return "B"
+        if rate < self.heavy_only_rate:
+            return "A"
+        return "R"
+
+class RacingPolicy(RoutingPolicy):
+    """Envolve outra política: na faixa de fronteira A/B troca a escolha pela corrida (R)."""
+
+    def __init__(self, inner: RoutingPolicy, race: Optional[RaceStats] = None,
+                 band_min: int = RACE_BAND_MIN, band_max: int = RACE_BAND_MAX):
+        self.inner = inner
+        self.race = race or RaceStats()
+        self.band_min = band_min
+        self.band_max = band_max
+        self.name = f"{inner.name}+race"
+
+    def choose(self, tokens: int, n_messages: int, stats) -> str:
+        strategy = self.inner.choose(tokens, n_messages, stats)
+        if strategy not in ("A", "B") or not self.band_min <= tokens < self.band_max:
+            return strategy
+        return self.race.decide(race_band(tokens))
+
+model_stats = ModelStats()
+race_stats = RaceStats()
+routing_policy: RoutingPolicy = ROUTING_POLICIES.get(ROUTING_POLICY, LatencyAwarePolicy)()
+if RACE_ENABLED:
+    routing_policy = RacingPolicy(routing_policy, race_stats)
+
+class RoutingLogWriter:
+    """
+    Grava o log de roteamento (JSONL) numa thread dedicada.
+
+    Como na captura de tráfego, o request só enfileira (put_nowait); o arquivo
+    fica aberto na thread e é descarregado quando a fila esvazia. Fila cheia
+    descarta o evento em vez de atrasar o request.
+    """
+
+    def __init__(self, path: str, queue_size: int = CAPTURE_QUEUE_SIZE):
+        self.path = path
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="routing-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, event: Dict) -> bool:
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self, timeout: float = 5.0):
+        """Drena a fila e fecha o arquivo."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Routing log: fila cheia no shutdown, eventos pendentes descartados")
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        f = None
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            try:
+                if f is None:
+                    f = open(self.path, "a", encoding="utf-8")
+                f.write(json.dumps(event) + "\n")
+                if self._queue.empty():
+                    f.flush()
+            except OSError as e:
+                logger.warning(f"Falha ao gravar routing log: {e}")
+        if f is not None:
+            f.close()
+
+routing_log_writer: Optional[RoutingLogWriter] = None
+
+def log_routing_event(event: Dict):
+    """Anexa evento ao log de roteamento (ROUTING_LOG_PATH) para replay offline."""
+    global routing_log_writer
+    if not ROUTING_LOG_PATH:
+        return
+    if routing_log_writer is None:
+        routing_log_writer = RoutingLogWriter(ROUTING_LOG_PATH)
+    routing_log_writer.submit({"ts": time.time(), **event})
+
+def stop_routing_log():
+    global routing_log_writer
+    if routing_log_writer is not None:
+        routing_log_writer.close()
+        routing_log_writer = None
+
+# ══════════════════════════════════════════════════════════════════════════
+# Estado compartilhado entre workers (SQLite WAL)
+# ══════════════════════════════════════════════════════════════════════════
+
+class SharedState:
+    """
+    Dedup in-flight e slots de admissão visíveis a todos os workers.
+
+    Cada worker abre sua própria conexão no mesmo arquivo (WAL: leitores não
+    bloqueiam o escritor). Operações são síncronas e curtas; as que esperam
+    (resultado de outro worker, slot livre) fazem polling a cada
+    `poll_interval`. Linhas de um worker que morreu são removidas pelo
+    processo pai (`reap`); até lá, um claim cujo dono não existe mais é
+    tratado como livre. Um claim de dono vivo só expira após `stale_after`,
+    bem acima da duração de uma estratégia C.
+    """
+
+    def __init__(self, path: str, poll_interval: float = SHARED_POLL_INTERVAL,
+                 stale_after: float = SHARED_CLAIM_TTL, pid: Optional[int] = None):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.pid = pid if pid is not None else os.getpid()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Autocommit: as transações de admissão usam BEGIN IMMEDIATE explícito
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS inflight ("
+                " key TEXT PRIMARY KEY,"
+                " pid INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " result TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " model TEXT NOT NULL,"
+                " priority INTEGER NOT NULL,"
+                " pid INTEGER NOT NULL,"
+                " active INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_slots_model ON slots(model, active)")
+        return self._conn
+
+    # Dedup in-flight
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _abandoned(self, pid: int, created: float) -> bool:
+        return created < time.time() - self.stale_after or not self._pid_alive(pid)
+
+    def claim(self, key: str) -> bool:
+        """Registra este worker como dono da chave; False se outro já está gerando."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT pid, created FROM inflight WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._abandoned(*row):
+                conn.execute("DELETE FROM inflight WHERE key = ? AND pid = ? AND created = ?", (key, *row))
+            cur = conn.execute("INSERT OR IGNORE INTO inflight (key, pid, created) VALUES (?, ?, ?)",
+                               (key, self.pid, time.time()))
+            return cur.rowcount == 1
+
+    def publish(self, key: str, result: Dict):
+        with self._lock:
+            self._connect().execute("UPDATE inflight SET result = ? WHERE key = ?",
+                                    (json.dumps(result, ensure_ascii=False), key))
+
+    def forget(self, key: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM inflight WHERE key = ? AND pid = ?", (key, self.pid))
+
+    def _lookup(self, key: str) -> Tuple[bool, Optional[str]]:
+        with self._lock:
+            row = self._connect().execute("SELECT pid, created, result FROM inflight WHERE key = ?",
+                                          (key,)).fetchone()
+        if row is None or (row[2] is None and self._abandoned(row[0], row[1])):
+            return (False, None)
+        return (True, row[2])
+
+    async def wait_result(self, key: str, timeout: float) -> Optional[Dict]:
+        """Aguarda o resultado publicado pelo dono; None se a chave sumir, o dono morrer ou expirar."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            found, result = await asyncio.to_thread(self._lookup, key)
+            if not found:
+                return None
+            if result is not None:
+                return json.loads(result)
+            await asyncio.sleep(self.poll_interval)
+        return None
+
+    # Slots de admissão
+
+    def enqueue(self, model: str, priority: int) -> int:
+        with self._lock:
+            cur = self._connect().execute("INSERT INTO slots (model, priority, pid) VALUES (?, ?, ?)",
+                                          (model, priority, self.pid))
+            return cur.lastrowid
+
+    def try_activate(self, slot_id: int, model: str, priority: int, capacity: int) -> bool:
+        """Ativa o slot se houver vaga para ele (prioridade, depois FIFO, entre todos os workers)."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                active = conn.execute("SELECT COUNT(*) FROM slots WHERE model = ? AND active = 1",
+                                      (model,)).fetchone()[0]
+                ahead = conn.execute(
+                    "SELECT COUNT(*) FROM slots WHERE model = ? AND active = 0"
+                    " AND (priority < ? OR (priority = ? AND id < ?))",
+                    (model, priority, priority, slot_id),
+                ).fetchone()[0]
+                granted = active + ahead < capacity
+                if granted:
+                    conn.execute("UPDATE slots SET active = 1 WHERE id = ?", (slot_id,))
+            finally:
+                conn.execute("COMMIT")
+            return granted
+
+    def release(self, slot_id: int):
+        with self._lock:
+            self._connect().execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+
+    def counts(self, model: str, priority: Optional[int] = None) -> Tuple[int, int]:
+        """(slots ativos, chamadas esperando com prioridade <= `priority`) do modelo."""
+        with self._lock:
+            conn = self._connect()
+            active = conn.execute("SELECT COUNT(*) FROM slots WHERE model = ? AND active = 1",
+                                  (model,)).fetchone()[0]
+            if priority is None:
+                waiting = conn.execute("SELECT COUNT(*) FROM slots WHERE model = ? AND active = 0",
+                                       (model,)).fetchone()[0]
+            else:
+                waiting = conn.execute(
+                    "SELECT COUNT(*) FROM slots WHERE model = ? AND active = 0 AND priority <= ?",
+                    (model, priority),
+                ).fetchone()[0]
+        return active, waiting
+
+    # Manutenção (processo pai)
+
+    def reap(self, pid: int):
+        """Remove slots e claims pendentes de um worker que terminou."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+            conn.execute("DELETE FROM inflight WHERE pid = ? AND result IS NULL", (pid,))
+
+    def reset(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM slots")
+            conn.execute("DELETE FROM inflight")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+shared_state: Optional[SharedState] = SharedState(SHARED_STATE_PATH) if LLM_OPTIMIZER_WORKERS > 1 else None
+
+# ══════════════════════════════════════════════════════════════════════════
+# Controle de admissão (fila com prioridade)
+# ══════════════════════════════════════════════════════════════════════════
+
+PRIORITY_INTERACTIVE = 0  # requests diretos (A/B) e REDUCE — cliente esperando
+PRIORITY_BULK = 10        # sub-requests MAP do Strategy C
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+class AdmissionRejected(Exception):
+    """Fila além do orçamento de espera; cliente deve tentar de novo depois."""
+
+    def __init__(self, model: str, expected_wait: float):
+        super().__init__(f"Fila do modelo {model} excede o orçamento de espera (~{expected_wait:.0f}s)")
+        self.model = model
+        self.retry_after = max(1, math.ceil(expected_wait))
+
+class AdmissionController:
+    """
+    Limita chamadas simultâneas por modelo e ordena a fila por prioridade.
+
+    Requests interativos passam na frente dos sub-requests MAP; dentro da
+    mesma prioridade a ordem é FIFO. O slot é transferido diretamente ao
+    próximo da fila na liberação. Com `shared` (multi-worker) a fila e os
+    slots vivem no SQLite compartilhado e a capacidade vale para o conjunto
+    dos workers.
+    """
+
+    def __init__(self, concurrency: int = ADMISSION_CONCURRENCY, wait_budget: float = ADMISSION_WAIT_BUDGET,
+                 shared: Optional[SharedState] = None):
+        self.concurrency = max(1, concurrency)
+        self.wait_budget = wait_budget
+        self.shared = shared
+        self._active: Dict[str, int] = defaultdict(int)
+        self._waiters: Dict[str, List] = defaultdict(list)
+        self._seq = itertools.count()
+
+    def capacity(self, model: str) -> int:
+        """Slots do modelo: concorrência por backend × backends ativos."""
+        return self.concurrency * ollama_pool.capacity(model)
+
+    def queue_length(self, model: str) -> int:
+        """Chamadas esperando slot. No modo compartilhado consulta o SQLite (bloqueante: fora do loop)."""
+        if self.shared is not None:
+            return self.shared.counts(model)[1]
+        return sum(1 for _, _, fut in self._waiters[model] if not fut.done())
+
+    def estimate_wait(self, model: str, priority: int = PRIORITY_INTERACTIVE,
+                      counts: Optional[Tuple[int, int]] = None) -> float:
+        """
+        Espera estimada para um novo request com a prioridade dada.
+
+        No modo compartilhado `counts` (ativos, à frente) vem de
+        `SharedState.counts` lido fora do loop; sem ele a consulta é feita aqui.
+        """
+        capacity = self.capacity(model)
+        if self.shared is not None:
+            active, ahead = counts if counts is not None else self.shared.counts(model, priority)
+        else:
+            active = self._active[model]
+            ahead = sum(1 for p, _, fut in self._waiters[model] if p <= priority and not fut.done())
+        backlog = active + ahead - capacity + 1
+        return max(0, backlog) / capacity * model_stats.service_seconds(model)
+
+    async def check(self, model: str, priority: int = PRIORITY_INTERACTIVE):
+        """Levanta AdmissionRejected se a espera estimada exceder o orçamento."""
+        if not self.wait_budget:
+            return
+        counts = None
+        if self.shared is not None:
+            # O lock do SharedState pode estar com um try_activate esperando o SQLite
+            counts = await asyncio.to_thread(self.shared.counts, model, priority)
+        expected = self.estimate_wait(model, priority, counts)
+        if expected > self.wait_budget:
+            admission_rejected.labels(model=model).inc()
+            raise AdmissionRejected(model, expected)
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = PRIORITY_INTERACTIVE):
+        """Ocupa um slot do modelo pelo tempo do bloco."""
+        start = time.monotonic()
+        slot_id = None
+        if self.shared is not None:
+            slot_id = await self._acquire_shared(model, priority)
+        elif self._active[model] < self.capacity(model) and not self.queue_length(model):
+            self._active[model] += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters[model], (priority, next(self._seq), fut))
+            admission_queue_length.labels(model=model).set(self.queue_length(model))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # Slot já tinha sido entregue a nós: devolve
+                if fut.done() and not fut.cancelled():
+                    self._release(model)
+                admission_queue_length.labels(model=model).set(self.queue_length(model))
+                raise
+        waited = time.monotonic() - start
+        admission_wait_histogram.labels(
+            model=model, priority=PRIORITY_NAMES.get(priority, str(priority))
+        ).observe(waited)
+        record_stage("queue_wait", waited)
+        try:
+            yield
+        finally:
+            if slot_id is not None:
+                # Shield: mesmo cancelado de novo, o DELETE termina na thread
+                await asyncio.shield(asyncio.to_thread(self.shared.release, slot_id))
+            else:
+                self._release(model)
+
+    async def _acquire_shared(self, model: str, priority: int) -> int:
+        """Entra na fila compartilhada e espera (polling) até o slot ser ativado."""
+        shared = self.shared
+        slot_id = await asyncio.to_thread(shared.enqueue, model, priority)
+        try:
+            while not await asyncio.to_thread(shared.try_activate, slot_id, model, priority, self.capacity(model)):
+                admission_queue_length.labels(model=model).set(await asyncio.to_thread(self.queue_length, model))
+                await asyncio.sleep(shared.poll_interval)
+        except BaseException:
+            await asyncio.shield(asyncio.to_thread(shared.release, slot_id))
+            raise
+        admission_queue_length.labels(model=model).set(await asyncio.to_thread(self.queue_length, model))
+        return slot_id
+
+    def _release(self, model: str):
+        self._active[model] -= 1
+        # Acorda quantos couberem (a capacidade cresce quando um backend volta)
+        waiters = self._waiters[model]
+        while waiters and self._active[model] < self.capacity(model):
+            _, _, fut = heapq.heappop(waiters)
+            if not fut.done():
+                self._active[model] += 1
+                fut.set_result(None)
+        admission_queue_length.labels(model=model).set(self.queue_length(model))
+
+admission = AdmissionController(shared=shared_state)
+
 # ══════════════════════════════════════════════════════════════════════════
 # FastAPI App
 # ══════════════════════════════════════════════════════════════════════════
 
-app = FastAPI(title="LLM-Optimizer", version="2.3.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Cria o pool HTTP e o probe dos backends no startup; fecha no shutdown."""
+    for backend in ollama_pool.backends:
+        get_http_client(backend.url)
+        logger.info(f"Backend Ollama: {backend.url} modelos={sorted(backend.models) if backend.models else '*'}")
+    logger.info(
+        f"Pool HTTP: max={OLLAMA_MAX_CONNECTIONS} keepalive={OLLAMA_MAX_KEEPALIVE} "
+        f"expiry={OLLAMA_KEEPALIVE_EXPIRY}s http2={OLLAMA_HTTP2 and HTTP2_AVAILABLE}"
+    )
+    probe_task = asyncio.create_task(ollama_pool.probe_loop())
+    start_capture()
+    setup_tracing()
+    yield
+    probe_task.cancel()
+    try:
+        await probe_task
+    except asyncio.CancelledError:
+        pass
+    stop_capture()
+    stop_routing_log()
+    shutdown_tracing()
+    await close_http_clients()
+    response_cache.close()
+    if shared_state is not None:
+        shared_state.close()
+
+app = FastAPI(title="LLM-Optimizer", version="2.3.0", lifespan=lifespan)
 
 # ══════════════════════════════════════════════════════════════════════════
 # Models
@@ -106,19 +1472,231 @@ class ChatCompletionRequest(BaseModel):
     stream: Optional[bool] = False
     tools: Optional[List[Dict[str, Any]]] = None
 
+class ChatRequestView:
+    """
+    Request de chat já validado, com as mensagens como dicts.
+
+    No caminho rápido as mensagens são os próprios dicts do corpo parseado
+    (sem cópia); o pydantic só entra quando a checagem estrutural falha.
+    """
+
+    __slots__ = ("model", "messages", "temperature", "max_tokens", "stream", "tools")
+
+    def __init__(self, model: str, messages: List[Dict], temperature: Optional[float],
+                 max_tokens: Optional[int], stream: Optional[bool], tools: Optional[List[Dict]]):
+        self.model = model
+        self.messages = messages
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.tools = tools
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_dict_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+def _fast_valid(body: Any) -> bool:
+    """Checagem estrutural estrita do corpo; False manda para o pydantic."""
+    if not isinstance(body, dict) or not isinstance(body.get("model"), str):
+        return False
+    messages = body.get("messages")
+    if not isinstance(messages, list):
+        return False
+    for msg in messages:
+        if not isinstance(msg, dict) or not isinstance(msg.get("role"), str) or "content" not in msg:
+            return False
+        for field in ("name", "tool_call_id"):
+            if msg.get(field) is not None and not isinstance(msg[field], str):
+                return False
+        if msg.get("tool_calls") is not None and not _is_dict_list(msg["tool_calls"]):
+            return False
+    temperature = body.get("temperature")
+    max_tokens = body.get("max_tokens")
+    stream = body.get("stream")
+    tools = body.get("tools")
+    return ((temperature is None or _is_number(temperature))
+            and (max_tokens is None or (isinstance(max_tokens, int) and not isinstance(max_tokens, bool)))
+            and (stream is None or isinstance(stream, bool))
+            and (tools is None or _is_dict_list(tools)))
+
+def parse_chat_request(body: Any) -> ChatRequestView:
+    """
+    Valida o corpo de /v1/chat/completions.
+
+    Corpos bem formados passam só pela checagem estrutural; o resto cai no
+    ChatCompletionRequest, que coage tipos ou levanta o erro de validação.
+    """
+    if _fast_valid(body):
+        temperature = body.get("temperature", 0.7)
+        return ChatRequestView(
+            model=body["model"],
+            messages=body["messages"],
+            temperature=float(temperature) if temperature is not None else None,
+            max_tokens=body.get("max_tokens"),
+            stream=body.get("stream", False),
+            tools=body.get("tools"),
+        )
+    req = ChatCompletionRequest(**body)
+    return ChatRequestView(req.model, [msg.dict() for msg in req.messages], req.temperature,
+                           req.max_tokens, req.stream, req.tools)
+
 # ══════════════════════════════════════════════════════════════════════════
 # Helpers
 # ══════════════════════════════════════════════════════════════════════════
 
-def estimate_tokens(text: str) -> int:
+class HeuristicTokenCounter:
     """Estimativa rápida de tokens (4 chars ≈ 1 token)."""
-    return len(text) // 4
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        return len(text) // 4
+
+class TokenizerFileCounter:
+    """
+    Contagem exata com o vocabulário real do modelo (tokenizer.json do qwen3).
+
+    O arquivo só é carregado na primeira contagem. Se o pacote `tokenizers`
+    ou o arquivo não estiverem disponíveis, cai para a heurística.
+    """
+
+    name = "tokenizer"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tokenizer = None
+        self._fallback: Optional[HeuristicTokenCounter] = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._tokenizer is not None or self._fallback is not None:
+                return
+            if not TOKENIZERS_AVAILABLE:
+                logger.warning("Pacote 'tokenizers' não instalado — usando heurística de tokens")
+                self._fallback = HeuristicTokenCounter()
+                return
+            try:
+                self._tokenizer = Tokenizer.from_file(self.path)
+                logger.info(f"Tokenizer carregado: {self.path}")
+            except Exception as e:
+                logger.warning(f"Falha ao carregar tokenizer {self.path}: {e} — usando heurística")
+                self._fallback = HeuristicTokenCounter()
+
+    def count(self, text: str) -> int:
+        if self._tokenizer is None and self._fallback is None:
+            self._load()
+        if self._fallback is not None:
+            return self._fallback.count(text)
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+_token_counter = TokenizerFileCounter(TOKENIZER_PATH) if TOKENIZER_PATH else HeuristicTokenCounter()
+_token_count_memo: "OrderedDict[bytes, int]" = OrderedDict()
+
+def set_token_counter(counter) -> None:
+    """Troca o contador de tokens (qualquer objeto com `name` e `count(text)`)."""
+    global _token_counter
+    _token_counter = counter
+    _token_count_memo.clear()
+    _truncation_memo.clear()
+
+def get_token_counter():
+    return _token_counter
+
+def estimate_tokens(text: str) -> int:
+    """
+    Conta tokens com o contador ativo.
+
+    Resultados são memoizados (LRU) pelo digest do texto, então o histórico
+    repetido a cada turno do CLINE não é re-tokenizado.
+    """
+    if not text:
+        return 0
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    cached = _token_count_memo.get(key)
+    if cached is not None:
+        _token_count_memo.move_to_end(key)
+        token_count_cache.labels(result="hit").inc()
+        return cached
+
+    token_count_cache.labels(result="miss").inc()
+    count = _token_counter.count(text)
+    _token_count_memo[key] = count
+    if len(_token_count_memo) > TOKEN_COUNT_CACHE_SIZE:
+        _token_count_memo.popitem(last=False)
+    return count
+
+def json_loads(data: bytes) -> Any:
+    """Parse de JSON com orjson; cai no json da stdlib no que o orjson recusa (NaN, surrogates)."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    """Serializa direto para bytes UTF-8 (orjson), com fallback para a stdlib."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:  # orjson.JSONEncodeError: surrogates, int > 64 bits
+            pass
+    return json.dumps(obj).encode()
+
+class MessageHasher:
+    """
+    Hash incremental de mensagens sanitizadas (role + conteúdo).
+
+    Alimentado mensagem a mensagem durante a sanitização, sem serializar a
+    lista inteira. Cada campo entra com o tamanho na frente para não haver
+    ambiguidade entre mensagens.
+    """
+
+    def __init__(self):
+        self._h = hashlib.sha256()
+
+    def update(self, role: str, content: str):
+        for field in (role.encode(), content.encode("utf-8", "surrogatepass")):
+            self._h.update(len(field).to_bytes(8, "little"))
+            self._h.update(field)
+
+    def hexdigest(self) -> str:
+        return self._h.hexdigest()[:16]
 
 def hash_messages(messages: List[Dict]) -> str:
     """Gera hash de mensagens para dedup."""
+    if all(isinstance(m, dict) and m.keys() == {"role", "content"}
+           and isinstance(m["role"], str) and isinstance(m["content"], str) for m in messages):
+        hasher = MessageHasher()
+        for m in messages:
+            hasher.update(m["role"], m["content"])
+        return hasher.hexdigest()
     content = json.dumps(messages, sort_keys=True)
     return hashlib.sha256(content.encode()).hexdigest()[:16]
 
+def record_prefix_reuse(model: str, messages: List[Dict], data: Dict) -> int:
+    """
+    Tokens de prompt que o Ollama reaproveitou do KV cache, medidos na resposta.
+
+    O `/api/chat` informa em `prompt_eval_count` só os tokens que avaliou; a
+    diferença para a estimativa do prompt inteiro é o prefixo que veio do cache
+    (o system prompt do CLINE e o histórico já enviado, enquanto o modelo
+    segue carregado). Resposta sem métricas (`eval_count`) não conta.
+    """
+    if "eval_count" not in data:
+        return 0
+    # O Ollama omite prompt_eval_count quando o prompt inteiro veio do cache
+    evaluated = data.get("prompt_eval_count", 0)
+    estimated = sum(estimate_tokens(safe_get_content_text(m.get("content"))) for m in messages)
+    avoided = max(0, estimated - evaluated)
+    prefix_reuse.labels(model=model, result="hit" if avoided else "miss").inc()
+    if avoided:
+        prompt_eval_tokens_avoided.labels(model=model).inc(avoided)
+    return avoided
+
 def safe_get_content_text(content: Any) -> str:
     """
     Extrai texto de content de forma segura.
@@ -150,7 +1728,7 @@ def safe_get_content_text(content: Any) -> str:
     # Fallback para qualquer outro tipo
     return str(content)
 
-def sanitize_messages(messages: List[Dict]) -> List[Dict]:
+def sanitize_messages(messages: List[Dict], hasher: Optional[MessageHasher] = None) -> List[Dict]:
     """
     Sanitiza mensagens para formato Ollama-compatible.
     
@@ -158,6 +1736,9 @@ def sanitize_messages(messages: List[Dict]) -> List[Dict]:
     - Usa safe_get_content_text para evitar erro em .type
     - Normaliza roles inválidos
     - Remove campos extras
+
+    Com `hasher`, cada mensagem mantida já entra no hash de dedup
+    (equivalente a `hash_messages` sobre o resultado).
     """
     sanitized = []
     for msg in messages:
@@ -178,9 +1759,44 @@ def sanitize_messages(messages: List[Dict]) -> List[Dict]:
             "role": role,
             "content": content,
         })
+        if hasher is not None:
+            hasher.update(role, content)
     
     return sanitized
 
+# Blocos de tools do CLINE — uma única regex, varrida uma vez por prompt.
+# A varredura roda sobre o texto em minúsculas: sem IGNORECASE o sre consegue
+# pular direto para os candidatos, o que corta o custo das alternativas.
+_TOOL_BLOCK_REGEX = (
+    r'<tool_name>.*?</tool_name>'
+    r'|## tools.*?(?=##|\Z)'
+    r'|<tools>.*?</tools>'
+    r'|execute_command|read_file|write_to_file|list_files'
+)
+TOOL_BLOCK_PATTERN = re.compile(_TOOL_BLOCK_REGEX, re.DOTALL)
+TOOL_BLOCK_PATTERN_IGNORECASE = re.compile(_TOOL_BLOCK_REGEX, re.DOTALL | re.IGNORECASE)
+
+_truncation_memo: "OrderedDict[tuple, Optional[str]]" = OrderedDict()
+
+def find_tool_spans(content: str) -> List[tuple]:
+    """Spans dos blocos de tools, ordenados e com sobreposições mescladas."""
+    lowered = content.lower()
+    if len(lowered) == len(content):
+        matches = TOOL_BLOCK_PATTERN.finditer(lowered)
+    else:
+        # lower() mudou o tamanho (ex.: "İ"): os offsets não batem mais
+        matches = TOOL_BLOCK_PATTERN_IGNORECASE.finditer(content)
+
+    spans: List[tuple] = []
+    for m in matches:
+        start, end = m.span()
+        if spans and start <= spans[-1][1]:
+            if end > spans[-1][1]:
+                spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
 def smart_truncate_system_prompt(content: str, max_tokens: int = 2000) -> str:
     """
     Truncamento inteligente que preserva tool definitions.
@@ -189,40 +1805,52 @@ def smart_truncate_system_prompt(content: str, max_tokens: int = 2000) -> str:
     1. Preserva início (40% do budget) - identidade
     2. Preserva tool definitions (30% do budget)
     3. Preserva fim (30% do budget) - instruções de saída
+
+    O resultado é memoizado pelo digest do prompt: o CLINE reenvia o mesmo
+    system prompt a cada turno.
     """
+    key = (hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest(), max_tokens)
+    if key in _truncation_memo:
+        truncation_cache.labels(result="hit").inc()
+        _truncation_memo.move_to_end(key)
+        result = _truncation_memo[key]
+        if result is None:
+            return content
+        smart_truncations.inc()
+        return result
+
+    truncation_cache.labels(result="miss").inc()
+    result = _truncate_system_prompt(content, max_tokens)
+    _truncation_memo[key] = None if result is content else result
+    if len(_truncation_memo) > TRUNCATION_CACHE_SIZE:
+        _truncation_memo.popitem(last=False)
+    return result
+
+def _truncate_system_prompt(content: str, max_tokens: int) -> str:
     tokens = estimate_tokens(content)
     if tokens <= max_tokens:
         return content
     
     smart_truncations.inc()
     
-    # Detectar blocos de tools
-    tool_patterns = [
-        r'<tool_name>.*?</tool_name>',
-        r'## Tools.*?(?=##|\Z)',
-        r'<tools>.*?</tools>',
-        r'execute_command|read_file|write_to_file|list_files',
-    ]
-    
-    tool_blocks = []
-    for pattern in tool_patterns:
-        matches = re.finditer(pattern, content, re.DOTALL | re.IGNORECASE)
-        tool_blocks.extend([m.span() for m in matches])
-    
-    # Remove duplicatas e ordena
-    tool_blocks = sorted(set(tool_blocks))
-    
-    # Extrai texto dos blocos
-    tool_text = ""
-    for start, end in tool_blocks:
-        tool_text += content[start:end] + "\n\n"
-    
-    # Budget de caracteres
-    max_chars = max_tokens * 4
+    # Budget de caracteres (proporção chars/token medida no próprio prompt)
+    chars_per_token = len(content) / max(tokens, 1)
+    max_chars = int(max_tokens * chars_per_token)
     budget_start = int(max_chars * 0.4)
     budget_tools = int(max_chars * 0.3)
     budget_end = int(max_chars * 0.3)
     
+    # Extrai texto dos blocos até esgotar o budget de tools
+    tool_blocks = find_tool_spans(content)
+    parts: List[str] = []
+    used = 0
+    for start, end in tool_blocks:
+        if used > budget_tools:
+            break
+        parts.append(content[start:end])
+        used += end - start + 2
+    tool_text = "\n\n".join(parts) + "\n\n" if parts else ""
+    
     # Trunca tool_text se necessário
     if len(tool_text) > budget_tools:
         tool_text = tool_text[:budget_tools] + "\n...[tools truncated]"
@@ -236,6 +1864,90 @@ def smart_truncate_system_prompt(content: str, max_tokens: int = 2000) -> str:
     logger.info(f"Smart truncation: {tokens} tokens → {estimate_tokens(result)} tokens (preservando {len(tool_blocks)} tool blocks)")
     return result
 
+# Resultado de ferramenta do CLINE: "[read_file for 'src/app.py'] Result:"
+TOOL_RESULT_PATTERN = re.compile(r"^\[(\w+)(?: for [^\]]*)?\] Result:")
+
+_digest_memo: "OrderedDict[bytes, str]" = OrderedDict()
+
+def message_kind(message: Dict) -> str:
+    """Papel para o orçamento: tool (saída de ferramenta), assistant, user ou system."""
+    if message["role"] == "user" and TOOL_RESULT_PATTERN.match(message["content"]):
+        return "tool"
+    return message["role"]
+
+def digest_content(content: str) -> str:
+    """
+    Versão compacta de uma saída longa: cabeçalho, primeiras e últimas linhas
+    e a contagem do que foi omitido. Memoizada por hash do conteúdo.
+    """
+    key = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    cached = _digest_memo.get(key)
+    if cached is not None:
+        _digest_memo.move_to_end(key)
+        context_digest_cache.labels(result="hit").inc()
+        return cached
+    context_digest_cache.labels(result="miss").inc()
+
+    lines = content.splitlines()
+    clip = lambda line: line if len(line) <= CONTEXT_DIGEST_LINE_CHARS else line[:CONTEXT_DIGEST_LINE_CHARS] + "…"
+    head, tail = CONTEXT_DIGEST_HEAD_LINES, CONTEXT_DIGEST_TAIL_LINES
+    if len(lines) > head + tail:
+        omitted = len(lines) - head - tail
+        kept = [clip(l) for l in lines[:head]]
+        kept.append(f"[... {omitted} linhas omitidas de {len(lines)} ({len(content)} chars) — saída antiga resumida ...]")
+        kept.extend(clip(l) for l in lines[len(lines) - tail:])
+    else:
+        kept = [clip(l) for l in lines]
+    digest = "\n".join(kept)
+    if len(digest) >= len(content):
+        digest = content
+
+    _digest_memo[key] = digest
+    if len(_digest_memo) > CONTEXT_DIGEST_CACHE_SIZE:
+        _digest_memo.popitem(last=False)
+    return digest
+
+def plan_context(messages: List[Dict], budget: int = STRATEGY_A_MAX,
+                 keep_recent: int = CONTEXT_KEEP_RECENT) -> List[Dict]:
+    """
+    Encaixa o histórico no orçamento de tokens trocando turnos antigos por digests.
+
+    Orçamento por papel e idade: system e as `keep_recent` mensagens finais
+    ficam intactos; das antigas, primeiro as saídas de ferramenta
+    (read_file/execute_command...), da mais velha para a mais nova, depois
+    respostas do assistente e por último textos do usuário. Para assim que o
+    total cabe no orçamento. Sem como caber, devolve o máximo compactado.
+    """
+    counts = [estimate_tokens(m["content"]) for m in messages]
+    total = original = sum(counts)
+    if total <= budget:
+        return messages
+
+    planned = list(messages)
+    stale = range(max(0, len(messages) - keep_recent))
+    for kind in ("tool", "assistant", "user"):
+        for i in stale:
+            if total <= budget:
+                break
+            message = planned[i]
+            if counts[i] < CONTEXT_DIGEST_MIN_TOKENS or message_kind(message) != kind:
+                continue
+            digest = digest_content(message["content"])
+            if len(digest) >= len(message["content"]):
+                continue
+            planned[i] = {"role": message["role"], "content": digest}
+            new_count = estimate_tokens(digest)
+            total -= counts[i] - new_count
+            counts[i] = new_count
+            context_digests.labels(kind=kind).inc()
+
+    saved = original - total
+    if saved:
+        tokens_saved.inc(saved)
+        logger.info(f"Planejador de contexto: ~{saved} tokens poupados (total ~{total}, orçamento {budget})")
+    context_planner_requests.labels(result="fitted" if total <= budget else "over_budget").inc()
+    return planned
+
 def validate_openai_response(data: Dict) -> Dict:
     """
     Valida e normaliza resposta para schema OpenAI Chat Completion.
@@ -312,121 +2024,848 @@ def create_fallback_response(error_message: str) -> Dict:
         "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
     }
 
-async def call_ollama(model: str, messages: List[Dict], timeout: int = TIMEOUT_EACH) -> Dict:
-    """Chama Ollama chat endpoint."""
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": False,
-        "options": {"temperature": 0.7},
-    }
-    
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            resp = await client.post(
-                f"{OLLAMA_HOST}/api/chat",
-                json=payload,
+def is_fallback_response(result: Dict) -> bool:
+    """Indica resposta gerada por create_fallback_response (erro)."""
+    return str(result.get("id", "")).startswith("fallback-")
+
+async def call_ollama(model: str, messages: List[Dict], timeout: int = TIMEOUT_EACH,
+                      temperature: float = 0.7, priority: int = PRIORITY_INTERACTIVE,
+                      max_tokens: Optional[int] = None, deadline: Optional[float] = None) -> Dict:
+    """
+    Chama Ollama chat endpoint.
+
+    `deadline` limita a geração em segundos, contados só depois que o slot de
+    admissão é concedido (a espera na fila não conta); estourado, levanta
+    asyncio.TimeoutError para o chamador decidir o retry.
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "options": {"temperature": temperature},
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+    if max_tokens:
+        payload["options"]["num_predict"] = max_tokens
+    
+    model_stats.begin(model)
+    try:
+        async with admission.slot(model, priority), AsyncExitStack() as stack:
+            async def generate():
+                _, resp = await ollama_pool.open_chat(stack, model, payload, timeout)
+                await resp.aread()
+                return resp
+
+            resp = await (generate() if deadline is None else asyncio.wait_for(generate(), deadline))
+        data = resp.json()
+        model_stats.observe_ollama(model, data)
+        record_ollama_timings(data)
+        record_prefix_reuse(model, messages, data)
+        
+        # Converte formato Ollama → OpenAI
+        if "message" in data:
+            content = data["message"].get("content", "")
+            return {
+                "id": f"ollama-{int(time.time())}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": data.get("prompt_eval_count", 0),
+                    "completion_tokens": data.get("eval_count", 0),
+                    "total_tokens": data.get("prompt_eval_count", 0) + data.get("eval_count", 0),
+                },
+            }
+        else:
+            schema_errors.labels(error_type="ollama_no_message").inc()
+            logger.error(f"Resposta Ollama sem 'message': {data.keys()}")
+            return create_fallback_response("Ollama returned invalid format")
+            
+    except asyncio.TimeoutError:
+        raise
+    except httpx.TimeoutException as e:
+        logger.error(f"Timeout ao chamar Ollama ({timeout}s): {e}")
+        errors_total.inc()
+        return create_fallback_response(f"Timeout after {timeout}s")
+    except httpx.HTTPError as e:
+        logger.error(f"HTTP error Ollama: {e}")
+        errors_total.inc()
+        return create_fallback_response(f"Ollama HTTP error: {e}")
+    except Exception as e:
+        logger.error(f"Erro inesperado Ollama: {e}")
+        errors_total.inc()
+        return create_fallback_response(f"Unexpected error: {e}")
+    finally:
+        model_stats.end(model)
+
+def create_chunk(completion_id: str, model: str, created: int,
+                 delta: Dict, finish_reason: Optional[str] = None) -> Dict:
+    """Cria chunk no formato OpenAI `chat.completion.chunk`."""
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish_reason,
+            }
+        ],
+    }
+
+def is_error_chunk(chunk: Dict) -> bool:
+    """Chunk de erro do stream (timeout, erro HTTP, `error` do Ollama), que pode vir depois de conteúdo parcial."""
+    return (chunk["choices"][0]["delta"].get("content") or "").startswith("[LLM-Optimizer Error]")
+
+async def call_ollama_stream(model: str, messages: List[Dict], timeout: int = TIMEOUT_EACH,
+                             temperature: float = 0.7,
+                             priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[Dict]:
+    """
+    Chama Ollama chat endpoint com `stream: True`.
+
+    Converte cada linha NDJSON do Ollama em um chunk OpenAI assim que chega.
+    Erros viram um chunk de conteúdo `[LLM-Optimizer Error] ...` seguido de
+    `finish_reason=stop`, mantendo o stream válido para o cliente.
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "options": {"temperature": temperature},
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+    completion_id = f"ollama-{int(time.time())}"
+    created = int(time.time())
+
+    # Primeiro chunk sempre carrega o role (como a OpenAI faz)
+    yield create_chunk(completion_id, model, created, {"role": "assistant", "content": ""})
+
+    model_stats.begin(model)
+    try:
+        async with admission.slot(model, priority), AsyncExitStack() as stack:
+            _, resp = await ollama_pool.open_chat(stack, model, payload, timeout)
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    schema_errors.labels(error_type="ollama_bad_chunk").inc()
+                    logger.warning(f"Chunk NDJSON inválido do Ollama: {line[:200]}")
+                    continue
+
+                if "error" in data:
+                    schema_errors.labels(error_type="ollama_stream_error").inc()
+                    logger.error(f"Erro no stream Ollama: {data['error']}")
+                    errors_total.inc()
+                    yield create_chunk(completion_id, model, created,
+                                       {"content": f"[LLM-Optimizer Error] {data['error']}"})
+                    break
+
+                content = (data.get("message") or {}).get("content", "")
+                if content:
+                    yield create_chunk(completion_id, model, created, {"content": content})
+
+                if data.get("done"):
+                    model_stats.observe_ollama(model, data)
+                    record_ollama_timings(data)
+                    record_prefix_reuse(model, messages, data)
+                    break
+    except httpx.TimeoutException as e:
+        logger.error(f"Timeout no stream Ollama ({timeout}s): {e}")
+        errors_total.inc()
+        yield create_chunk(completion_id, model, created,
+                           {"content": f"[LLM-Optimizer Error] Timeout after {timeout}s"})
+    except httpx.HTTPError as e:
+        logger.error(f"HTTP error no stream Ollama: {e}")
+        errors_total.inc()
+        yield create_chunk(completion_id, model, created,
+                           {"content": f"[LLM-Optimizer Error] Ollama HTTP error: {e}"})
+    finally:
+        model_stats.end(model)
+
+    yield create_chunk(completion_id, model, created, {}, finish_reason="stop")
+
+async def timed_stream(strategy: str, chunks: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+    """Repassa chunks medindo time-to-first-token e duração total do stream."""
+    start = time.monotonic()
+    first_token = False
+    with duration_histogram.labels(strategy=strategy).time():
+        async for chunk in chunks:
+            if not first_token and chunk["choices"][0]["delta"].get("content"):
+                first_token = True
+                ttft_histogram.labels(strategy=strategy).observe(time.monotonic() - start)
+            yield chunk
+
+async def tracing_stream(trace: "RequestTrace", chunks: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+    """Mantém o trace do request ativo durante o stream e o fecha no fim."""
+    _current_trace.set(trace)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        finish_trace(trace)
+
+async def sse_stream(chunks: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    """Serializa chunks como Server-Sent Events, finalizando com `[DONE]`."""
+    async for chunk in chunks:
+        yield b"data: " + json_dumps_bytes(chunk) + b"\n\n"
+    yield b"data: [DONE]\n\n"
+
+# ══════════════════════════════════════════════════════════════════════════
+# Validação incremental de tool calls (XML do CLINE)
+# ══════════════════════════════════════════════════════════════════════════
+
+CLINE_TOOL_TAGS = frozenset({
+    "execute_command", "read_file", "write_to_file", "replace_in_file", "search_files", "list_files",
+    "list_code_definition_names", "browser_action", "use_mcp_tool", "access_mcp_resource",
+    "ask_followup_question", "attempt_completion", "new_task", "plan_mode_respond",
+    "load_mcp_documentation",
+})
+_TAG_NAME = re.compile(r"[a-z_][a-z0-9_]*")
+_MAX_TAG_CHARS = 64  # "<...>" maior que isso não é tag de ferramenta
+
+class ToolXmlValidator:
+    """
+    Valida (e corrige) o XML de ferramentas do CLINE conforme o texto chega.
+
+    `feed()` devolve o texto que já pode ser repassado ao cliente; só segura
+    o suficiente para decidir uma tag (`<...` sem `>`). Estrutura esperada:
+    `<ferramenta><parametro>valor</parametro>...</ferramenta>`, e `<thinking>`.
+    Valores de parâmetro são texto livre até o fechamento (código com `<`
+    passa intacto). Correções feitas no caminho:
+
+    - `</ferramenta>` com parâmetro aberto → fecha o parâmetro antes;
+    - fechamento errado dentro da ferramenta (`</read_fil>`) → `</ferramenta>`;
+    - `</ferramenta>` solto fora de bloco → removido.
+
+    `open_tags` no fim indica resposta truncada.
+    """
+
+    def __init__(self):
+        self.stack: List[str] = []
+        self.repairs: List[str] = []
+        self.text = ""  # tudo que já foi liberado (para continuação)
+        self._pending = ""
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.stack)
+
+    def closing_tags(self) -> str:
+        return "".join(f"</{tag}>" for tag in reversed(self.stack))
+
+    def _raw(self) -> bool:
+        """Dentro de valor de parâmetro ou de <thinking>: texto livre."""
+        return bool(self.stack) and (len(self.stack) >= 2 or self.stack[-1] == "thinking")
+
+    def feed(self, text: str) -> str:
+        buf = self._pending + text
+        self._pending = ""
+        out: List[str] = []
+        i = 0
+        while i < len(buf):
+            if self._raw():
+                i = self._scan_raw(buf, i, out)
+            else:
+                i = self._scan_tags(buf, i, out)
+            if i < 0:
+                break
+        emitted = "".join(out)
+        self.text += emitted
+        return emitted
+
+    def finish(self) -> str:
+        """Libera o que sobrou segurado (fim do stream)."""
+        rest, self._pending = self._pending, ""
+        self.text += rest
+        return rest
+
+    def _scan_raw(self, buf: str, i: int, out: List[str]) -> int:
+        top = self.stack[-1]
+        closers = [f"</{top}>"]
+        if len(self.stack) >= 2:
+            closers.append(f"</{self.stack[-2]}>")
+        k = buf.find("</", i)
+        while k != -1:
+            tail = buf[k:]
+            if tail.startswith(closers[0]):
+                out.append(buf[i:k] + closers[0])
+                self.stack.pop()
+                return k + len(closers[0])
+            if len(closers) > 1 and tail.startswith(closers[1]):
+                out.append(buf[i:k] + closers[0] + closers[1])
+                self.stack.pop()
+                self.stack.pop()
+                self.repairs.append("mismatch")
+                return k + len(closers[1])
+            if any(c.startswith(tail) for c in closers):
+                out.append(buf[i:k])
+                self._pending = tail
+                return -1
+            k = buf.find("</", k + 2)
+        # Pode terminar com "<" de um fechamento que ainda vai chegar
+        cut = len(buf) - 1 if buf.endswith("<") else len(buf)
+        out.append(buf[i:cut])
+        self._pending = buf[cut:]
+        return -1
+
+    def _scan_tags(self, buf: str, i: int, out: List[str]) -> int:
+        k = buf.find("<", i)
+        if k == -1:
+            out.append(buf[i:])
+            return -1
+        out.append(buf[i:k])
+        end = buf.find(">", k + 1, k + _MAX_TAG_CHARS)
+        if end == -1:
+            if len(buf) - k < _MAX_TAG_CHARS and "<" not in buf[k + 1:]:
+                self._pending = buf[k:]
+                return -1
+            out.append("<")  # "<" de texto comum
+            return k + 1
+        tag = buf[k + 1:end]
+        closing = tag.startswith("/")
+        name = tag[1:] if closing else tag
+        if not _TAG_NAME.fullmatch(name):
+            out.append(buf[k:end + 1])
+        elif not self.stack:
+            if not closing and (name in CLINE_TOOL_TAGS or name == "thinking"):
+                self.stack.append(name)
+                out.append(buf[k:end + 1])
+            elif closing and name in CLINE_TOOL_TAGS:
+                self.repairs.append("stray_close")
+            else:
+                out.append(buf[k:end + 1])
+        elif not closing:
+            self.stack.append(name)  # parâmetro da ferramenta
+            out.append(buf[k:end + 1])
+        else:
+            if name != self.stack[-1]:
+                self.repairs.append("mismatch")
+            out.append(f"</{self.stack.pop()}>")
+        return end + 1
+
+async def complete_tool_call(validator: ToolXmlValidator, messages: List[Dict], temperature: float,
+                             model: str, started: float, allow_continuation: bool = True) -> str:
+    """
+    Fecha uma resposta com tool call truncada; devolve o texto a acrescentar.
+
+    Tenta uma continuação curta (resposta parcial como prefixo do assistente,
+    até TOOL_REPAIR_MAX_TOKENS); se ainda faltar, fecha as tags abertas.
+    Também contabiliza os reparos feitos durante o stream e o tempo poupado
+    (a rodada completa que o CLINE repetiria).
+    """
+    generation_seconds = time.perf_counter() - started
+    extra = validator.finish()
+    repair_start = time.perf_counter()
+    repaired = bool(validator.repairs)
+    for kind in validator.repairs:
+        tool_repairs.labels(kind=kind).inc()
+
+    if validator.truncated:
+        repaired = True
+        if allow_continuation:
+            logger.info(f"Tool call truncado ({'/'.join(validator.stack)}): pedindo continuação a {model}")
+            result = await call_ollama(
+                model, messages + [{"role": "assistant", "content": validator.text}],
+                timeout=TOOL_REPAIR_TIMEOUT, temperature=temperature, max_tokens=TOOL_REPAIR_MAX_TOKENS,
             )
-            resp.raise_for_status()
-            data = resp.json()
-            
-            # Converte formato Ollama → OpenAI
-            if "message" in data:
-                content = data["message"].get("content", "")
-                return {
-                    "id": f"ollama-{int(time.time())}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": model,
-                    "choices": [
-                        {
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": content,
-                            },
-                            "finish_reason": "stop",
-                        }
-                    ],
-                    "usage": {
-                        "prompt_tokens": data.get("prompt_eval_count", 0),
-                        "completion_tokens": data.get("eval_count", 0),
-                        "total_tokens": data.get("prompt_eval_count", 0) + data.get("eval_count", 0),
-                    },
-                }
-            else:
-                schema_errors.labels(error_type="ollama_no_message").inc()
-                logger.error(f"Resposta Ollama sem 'message': {data.keys()}")
-                return create_fallback_response("Ollama returned invalid format")
-                
-        except httpx.TimeoutException as e:
-            logger.error(f"Timeout ao chamar Ollama ({timeout}s): {e}")
-            errors_total.inc()
-            return create_fallback_response(f"Timeout after {timeout}s")
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP error Ollama: {e}")
-            errors_total.inc()
-            return create_fallback_response(f"Ollama HTTP error: {e}")
-        except Exception as e:
-            logger.error(f"Erro inesperado Ollama: {e}")
-            errors_total.inc()
-            return create_fallback_response(f"Unexpected error: {e}")
+            if not is_fallback_response(result):
+                extra += validator.feed(summary_text(result)) + validator.finish()
+                if not validator.truncated:
+                    tool_repairs.labels(kind="continued").inc()
+        if validator.truncated:
+            logger.warning(f"Tool call truncado: fechando {validator.closing_tags()}")
+            tool_repairs.labels(kind="closed").inc()
+            extra += validator.closing_tags()
+            validator.stack.clear()
+
+    if repaired:
+        repair_seconds = time.perf_counter() - repair_start
+        record_stage("tool_repair", repair_seconds)
+        tool_repair_saved.inc(max(0.0, generation_seconds - repair_seconds))
+    return extra
+
+async def repair_tool_response(result: Dict, messages: List[Dict], temperature: float, started: float,
+                               allow_continuation: bool = True) -> Dict:
+    """Valida/repara o XML de ferramenta de uma resposta completa (modo não-stream)."""
+    if not TOOL_REPAIR_ENABLED or is_fallback_response(result):
+        return result
+    validator = ToolXmlValidator()
+    content = validator.feed(summary_text(result)) + validator.finish()
+    if not validator.repairs and not validator.truncated:
+        return result
+    content += await complete_tool_call(validator, messages, temperature, result.get("model", MODEL_FAST),
+                                        started, allow_continuation)
+    result["choices"][0]["message"]["content"] = content
+    return result
+
+async def tool_repair_stream(chunks: AsyncIterator[Dict], messages: List[Dict], temperature: float,
+                             allow_continuation: bool = True) -> AsyncIterator[Dict]:
+    """
+    Repassa chunks validando o XML de ferramenta; repara antes do chunk final.
+
+    O texto segurado pelo validador (`<...` ainda sem `>`) é liberado antes de
+    um chunk de erro do upstream e quando o stream termina (ou falha) sem o
+    chunk final.
+    """
+    if not TOOL_REPAIR_ENABLED:
+        async for chunk in chunks:
+            yield chunk
+        return
+    started = time.perf_counter()
+    validator = ToolXmlValidator()
+    last: Optional[Dict] = None
+
+    def held(chunk: Dict) -> Optional[Dict]:
+        rest = validator.finish()
+        return create_chunk(chunk["id"], chunk["model"], chunk["created"], {"content": rest}) if rest else None
+
+    try:
+        async for chunk in chunks:
+            last = chunk
+            choice = chunk["choices"][0]
+            content = choice["delta"].get("content")
+            if content:
+                if content.startswith("[LLM-Optimizer Error]"):
+                    rest = held(chunk)
+                    if rest:
+                        yield rest
+                    validator.stack.clear()  # erro do upstream: não há o que continuar
+                    yield chunk
+                    continue
+                content = validator.feed(content)
+                if not content:
+                    continue
+                chunk = {**chunk, "choices": [{**choice, "delta": {**choice["delta"], "content": content}}]}
+            elif choice["finish_reason"]:
+                extra = await complete_tool_call(validator, messages, temperature, chunk.get("model", MODEL_FAST),
+                                                 started, allow_continuation)
+                if extra:
+                    yield create_chunk(chunk["id"], chunk["model"], chunk["created"], {"content": extra})
+            yield chunk
+    except Exception:
+        rest = held(last) if last is not None else None
+        if rest:
+            yield rest
+        raise
+    rest = held(last) if last is not None else None
+    if rest:
+        yield rest
 
 # ══════════════════════════════════════════════════════════════════════════
 # Estratégias
 # ══════════════════════════════════════════════════════════════════════════
 
-async def strategy_a(messages: List[Dict]) -> Dict:
+async def strategy_a(messages: List[Dict], temperature: float = 0.7) -> Dict:
     """Strategy A: < 2K tokens → direto qwen3:4b."""
     requests_total.labels(strategy="A").inc()
     logger.info("Strategy A: direto qwen3:4b")
     
     with duration_histogram.labels(strategy="A").time():
-        result = await call_ollama(MODEL_FAST, messages)
+        result = await call_ollama(MODEL_FAST, messages, temperature=temperature)
     
     return validate_openai_response(result)
 
-async def strategy_b(messages: List[Dict]) -> Dict:
+async def strategy_b(messages: List[Dict], temperature: float = 0.7) -> Dict:
     """Strategy B: 2-6K tokens → qwen3:0.6b (mais rápido)."""
     requests_total.labels(strategy="B").inc()
     logger.info("Strategy B: qwen3:0.6b")
     
     with duration_histogram.labels(strategy="B").time():
-        result = await call_ollama(MODEL_LIGHTER, messages)
+        result = await call_ollama(MODEL_LIGHTER, messages, temperature=temperature)
     
     return validate_openai_response(result)
 
-async def strategy_c(messages: List[Dict]) -> Dict:
-    """Strategy C: > 6K tokens → Map-Reduce paralelo."""
-    requests_total.labels(strategy="C").inc()
-    logger.info("Strategy C: Map-Reduce")
-    
-    # Divide mensagens em chunks (3-5 mensagens por chunk)
-    chunk_size = 4
-    chunks = [messages[i:i+chunk_size] for i in range(0, len(messages), chunk_size)]
+async def strategy_a_stream(messages: List[Dict], temperature: float = 0.7) -> AsyncIterator[Dict]:
+    """Strategy A em modo streaming: repassa chunks do qwen3:4b."""
+    requests_total.labels(strategy="A").inc()
+    logger.info("Strategy A (stream): direto qwen3:4b")
+
+    async for chunk in timed_stream("A", call_ollama_stream(MODEL_FAST, messages, temperature=temperature)):
+        yield chunk
+
+async def strategy_b_stream(messages: List[Dict], temperature: float = 0.7) -> AsyncIterator[Dict]:
+    """Strategy B em modo streaming: repassa chunks do qwen3:0.6b."""
+    requests_total.labels(strategy="B").inc()
+    logger.info("Strategy B (stream): qwen3:0.6b")
+
+    async for chunk in timed_stream("B", call_ollama_stream(MODEL_LIGHTER, messages, temperature=temperature)):
+        yield chunk
+
+# Tags XML do CLINE: "<read_file>", "</path>" (ou o começo de uma no fim do trecho)
+_TAG_PREFIX = re.compile(r"</?[A-Za-z_][\w-]*(?:>|$)")
+
+def tool_prefix_valid(text: str) -> bool:
+    """
+    Primeiro trecho de uma resposta é utilizável: não é erro e não tem tag quebrada.
+
+    Só trechos que começam com tag são checados (prosa com `a < b` é válida);
+    a estrutura passa pelo ToolXmlValidator, e qualquer correção necessária
+    invalida o trecho.
+    """
+    if not text.strip() or text.startswith("[LLM-Optimizer Error]"):
+        return False
+    head = text.lstrip()
+    if not head.startswith("<"):
+        return True
+    if not _TAG_PREFIX.match(head):
+        return False
+    validator = ToolXmlValidator()
+    validator.feed(head)
+    return not validator.repairs
+
+async def _prime(chunks: AsyncIterator[Dict]) -> tuple:
+    """Lê um stream até RACE_VALIDATE_CHARS de conteúdo (ou o fim); devolve (chunks lidos, texto)."""
+    buffered: List[Dict] = []
+    text = ""
+    async for chunk in chunks:
+        buffered.append(chunk)
+        choice = chunk["choices"][0]
+        text += choice["delta"].get("content") or ""
+        if len(text) >= RACE_VALIDATE_CHARS or choice["finish_reason"]:
+            break
+    return buffered, text
+
+async def _close_lane(task: asyncio.Task, chunks: AsyncIterator[Dict]):
+    """Cancela o perdedor: interrompe a leitura e fecha o stream (libera slot e conexão)."""
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    await chunks.aclose()
+
+async def race_stream(messages: List[Dict], temperature: float = 0.7) -> AsyncIterator[Dict]:
+    """
+    Corrida especulativa: qwen3:0.6b imediatamente, qwen3:4b só se preciso.
+
+    O modelo pesado entra quando o leve não entrega um primeiro trecho válido
+    em RACE_BUDGET segundos ou entrega um trecho inválido (erro/tag quebrada).
+    Vence quem primeiro tiver um trecho válido; o outro é cancelado.
+    """
+    band = race_band(sum(estimate_tokens(m["content"]) for m in messages))
+    lanes = {"light": call_ollama_stream(MODEL_LIGHTER, messages, temperature=temperature)}
+    tasks = {"light": asyncio.create_task(_prime(lanes["light"]))}
+
+    def start_heavy(reason: str):
+        logger.info(f"Corrida ({band}): disparando {MODEL_FAST} ({reason})")
+        race_heavy_started.labels(band=band, reason=reason).inc()
+        lanes["heavy"] = call_ollama_stream(MODEL_FAST, messages, temperature=temperature)
+        tasks["heavy"] = asyncio.create_task(_prime(lanes["heavy"]))
+
+    def valid(name: str) -> bool:
+        task = tasks[name]
+        return task.done() and not task.cancelled() and task.exception() is None \
+            and tool_prefix_valid(task.result()[1])
+
+    winner = None
+    try:
+        await asyncio.wait([tasks["light"]], timeout=RACE_BUDGET)
+        while winner is None:
+            winner = next((name for name in tasks if valid(name)), None)
+            if winner:
+                break
+            if "heavy" not in tasks:
+                start_heavy("invalid" if tasks["light"].done() else "timeout")
+            pending = [t for t in tasks.values() if not t.done()]
+            if not pending:
+                break
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        for name in tasks:
+            await _close_lane(tasks[name], lanes[name])
+        raise
+
+    race_stats.record(band, winner or "none")
+    # Sem vencedor válido: devolve o que o modelo pesado (ou o único) produziu
+    chosen = winner or ("heavy" if "heavy" in tasks else "light")
+    for name in tasks:
+        if name != chosen:
+            await _close_lane(tasks[name], lanes[name])
+    logger.info(f"Corrida ({band}): vencedor {winner or 'nenhum'}")
+
+    try:
+        buffered, _ = tasks[chosen].result()
+    except Exception as e:
+        logger.error(f"Corrida ({band}): stream falhou: {e}")
+        errors_total.inc()
+        buffered = [create_chunk(f"race-{int(time.time())}", MODEL_FAST, int(time.time()),
+                                 {"content": f"[LLM-Optimizer Error] {e}"}, finish_reason="stop")]
+    try:
+        for chunk in buffered:
+            yield chunk
+        if buffered and buffered[-1]["choices"][0]["finish_reason"]:
+            return
+        async for chunk in lanes[chosen]:
+            yield chunk
+    finally:
+        await lanes[chosen].aclose()
+
+async def strategy_r_stream(messages: List[Dict], temperature: float = 0.7) -> AsyncIterator[Dict]:
+    """Strategy R em modo streaming: corrida qwen3:0.6b × qwen3:4b."""
+    requests_total.labels(strategy="R").inc()
+    logger.info("Strategy R (stream): corrida qwen3:0.6b × qwen3:4b")
+
+    async for chunk in timed_stream("R", race_stream(messages, temperature)):
+        yield chunk
+
+async def strategy_r(messages: List[Dict], temperature: float = 0.7) -> Dict:
+    """Strategy R: corrida na faixa de fronteira A/B, resposta montada a partir do stream vencedor."""
+    requests_total.labels(strategy="R").inc()
+    logger.info("Strategy R: corrida qwen3:0.6b × qwen3:4b")
+
+    parts: List[str] = []
+    error: Optional[str] = None
+    completion_id, model = None, MODEL_FAST
+    with duration_histogram.labels(strategy="R").time():
+        async for chunk in race_stream(messages, temperature):
+            completion_id = chunk.get("id", completion_id)
+            model = chunk.get("model", model)
+            content = chunk["choices"][0]["delta"].get("content") or ""
+            if is_error_chunk(chunk) and error is None:
+                error = content.removeprefix("[LLM-Optimizer Error]").strip()
+            parts.append(content)
+
+    # Lane que falhou depois de conteúdo válido: resposta cortada, não é sucesso
+    if error is not None:
+        return create_fallback_response(error)
+    content = "".join(parts)
+    return validate_openai_response({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    })
+
+# Resumos de chunks já sumarizados: hash do chunk → resposta do MAP
+_map_summary_cache: "OrderedDict[str, Dict]" = OrderedDict()
+
+def chunk_messages(messages: List[Dict]) -> List[List[Dict]]:
+    """
+    Divide mensagens em chunks com fronteiras definidas pelo conteúdo.
+
+    Um chunk fecha após a mensagem cujo hash é múltiplo de MAP_CHUNK_AVG (com
+    no mínimo MAP_CHUNK_MIN e no máximo MAP_CHUNK_MAX mensagens). Como a
+    fronteira depende só das próprias mensagens, anexar mensagens ao fim da
+    conversa (ou remover uma do meio) não desloca os chunks anteriores.
+    """
+    chunks: List[List[Dict]] = []
+    current: List[Dict] = []
+    for msg in messages:
+        current.append(msg)
+        boundary = int(hash_messages([msg]), 16) % MAP_CHUNK_AVG == 0
+        if len(current) >= MAP_CHUNK_MAX or (boundary and len(current) >= MAP_CHUNK_MIN):
+            chunks.append(current)
+            current = []
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def summarize_chunk(chunk: List[Dict], temperature: float = 0.7,
+                          deadline: Optional[float] = None) -> Dict:
+    """Sumariza um chunk com modelo leve, reaproveitando resumos já calculados."""
+    key = hash_messages(chunk)
+    cached = _map_summary_cache.get(key)
+    if cached is not None:
+        _map_summary_cache.move_to_end(key)
+        map_summary_cache.labels(result="hit").inc()
+        return cached
+
+    map_summary_cache.labels(result="miss").inc()
+    summary_prompt = [
+        {"role": "system", "content": "Summarize this conversation concisely."},
+        *chunk,
+    ]
+    summary = await call_ollama(MODEL_LIGHTER, summary_prompt, temperature=temperature,
+                                priority=PRIORITY_BULK, deadline=deadline)
+    if not is_fallback_response(summary):
+        _map_summary_cache[key] = summary
+        if len(_map_summary_cache) > MAP_SUMMARY_CACHE_SIZE:
+            _map_summary_cache.popitem(last=False)
+    return summary
+
+def summary_text(summary: Dict) -> str:
+    """Conteúdo de uma resposta OpenAI (resumo do MAP)."""
+    choices = summary.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("message") or {}).get("content", "") or ""
+
+def chunk_excerpt(chunk: List[Dict], limit: int = MAP_FALLBACK_CHARS) -> str:
+    """Trecho bruto do chunk (início + fim) para quando o resumo não saiu."""
+    text = "\n".join(f"{m.get('role', 'user')}: {safe_get_content_text(m.get('content', ''))}" for m in chunk)
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n[...]\n{text[-half:]}"
+
+async def summarize_with_retry(chunk: List[Dict], temperature: float,
+                               sem: asyncio.Semaphore) -> Optional[str]:
+    """
+    Resumo do chunk com timeout por tentativa e retries; None se todas falharem.
+
+    O timeout vale para a geração: o tempo na fila de admissão (chunks atrás
+    de requests interativos) não consome a tentativa.
+    """
+    for attempt in range(MAP_CHUNK_RETRIES + 1):
+        if attempt:
+            map_chunk_results.labels(result="retry").inc()
+        async with sem:
+            try:
+                summary = await summarize_chunk(chunk, temperature, deadline=MAP_CHUNK_TIMEOUT)
+            except asyncio.TimeoutError:
+                map_chunk_results.labels(result="timeout").inc()
+                logger.warning(f"MAP: chunk excedeu {MAP_CHUNK_TIMEOUT:.0f}s (tentativa {attempt + 1})")
+                continue
+        if not is_fallback_response(summary):
+            map_chunk_results.labels(result="ok").inc()
+            return summary_text(summary)
+        map_chunk_results.labels(result="error").inc()
+    return None
+
+async def fold_summaries(texts: List[str], temperature: float) -> str:
+    """Nó da redução em árvore: junta resumos consecutivos em um só (memoizado)."""
+    prompt = [
+        {"role": "system", "content": "Combine these partial conversation summaries into one concise summary. "
+                                      "Keep facts, file names, commands and decisions."},
+        *({"role": "user", "content": f"Summary {i + 1}: {t}"} for i, t in enumerate(texts)),
+    ]
+    key = hash_messages(prompt)
+    cached = _map_summary_cache.get(key)
+    if cached is not None:
+        _map_summary_cache.move_to_end(key)
+        map_summary_cache.labels(result="hit").inc()
+        map_folds.labels(result="ok").inc()
+        return summary_text(cached)
+
+    map_summary_cache.labels(result="miss").inc()
+    summary = await call_ollama(MODEL_LIGHTER, prompt, temperature=temperature, priority=PRIORITY_BULK)
+    if is_fallback_response(summary):
+        # Sem o nó, a árvore perde compressão mas não conteúdo
+        map_folds.labels(result="fallback").inc()
+        return "\n".join(texts)
+    map_folds.labels(result="ok").inc()
+    _map_summary_cache[key] = summary
+    if len(_map_summary_cache) > MAP_SUMMARY_CACHE_SIZE:
+        _map_summary_cache.popitem(last=False)
+    return summary_text(summary)
+
+async def map_phase(chunks: List[List[Dict]], temperature: float) -> "tuple[List[str], int]":
+    """
+    Sumariza os chunks com concorrência limitada e prazo global.
+
+    Grupos alinhados de MAP_REDUCE_FANIN resumos são dobrados (fold) assim
+    que o grupo inteiro termina, enquanto o resto do MAP segue rodando. Chunks
+    que não terminam no prazo (ou falham em todas as tentativas) entram como
+    trecho bruto. Retorna os textos para o REDUCE e quantos chunks faltaram.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MAP_DEADLINE
+    sem = asyncio.Semaphore(max(1, MAP_CONCURRENCY))
+    fanin = MAP_REDUCE_FANIN if MAP_REDUCE_FANIN > 1 and len(chunks) > MAP_REDUCE_FANIN else 0
+
+    texts: List[Optional[str]] = [None] * len(chunks)
+    finished = [False] * len(chunks)
+    tasks = {asyncio.create_task(summarize_with_retry(c, temperature, sem)): i for i, c in enumerate(chunks)}
+    folds: Dict[int, asyncio.Task] = {}
+
+    def text_for(i: int) -> str:
+        return texts[i] if texts[i] is not None else chunk_excerpt(chunks[i])
+
+    pending = set(tasks)
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i = tasks[task]
+                texts[i] = task.result()
+                finished[i] = True
+                if fanin:
+                    g = i // fanin
+                    group = range(g * fanin, min((g + 1) * fanin, len(chunks)))
+                    if g not in folds and all(finished[k] for k in group):
+                        folds[g] = asyncio.create_task(fold_summaries([text_for(k) for k in group], temperature))
+    finally:
+        for task in pending:
+            task.cancel()
+
+    missing = sum(1 for t in texts if t is None)
+    if missing:
+        map_chunk_results.labels(result="excerpt").inc(missing)
+        logger.warning(f"MAP: {missing}/{len(chunks)} chunks sem resumo, usando trechos brutos")
+
+    if not fanin:
+        return [text_for(i) for i in range(len(chunks))], missing
+
+    # Nós que ainda não começaram (grupo incompleto no prazo) ficam sem fold
+    level: List[str] = []
+    for g in range(math.ceil(len(chunks) / fanin)):
+        group = range(g * fanin, min((g + 1) * fanin, len(chunks)))
+        task = folds.get(g)
+        remaining = deadline - loop.time()
+        if task is not None and remaining > 0:
+            try:
+                level.append(await asyncio.wait_for(task, remaining))
+                continue
+            except asyncio.TimeoutError:
+                map_folds.labels(result="fallback").inc()
+        elif task is not None:
+            task.cancel()
+        level.extend(text_for(k) for k in group)
+
+    # Níveis superiores da árvore (se ainda couber no prazo)
+    while len(level) > fanin and deadline - loop.time() > 0:
+        groups = [level[k:k + fanin] for k in range(0, len(level), fanin)]
+        try:
+            level = list(await asyncio.wait_for(
+                asyncio.gather(*(fold_summaries(g, temperature) for g in groups)), deadline - loop.time()))
+        except asyncio.TimeoutError:
+            break
+    return level, missing
+
+async def map_reduce_messages(messages: List[Dict], temperature: float = 0.7) -> List[Dict]:
+    """
+    Fase MAP do Strategy C.
+
+    Sumariza chunks da conversa com modelo leve (concorrência limitada,
+    timeout e retry por chunk, redução em árvore) e devolve as mensagens
+    prontas para a fase REDUCE. Em sessões longas só os chunks novos
+    (tipicamente o último) vão ao Ollama; o resto vem do cache.
+    """
+    chunks = chunk_messages(messages)
     
     logger.info(f"Map-Reduce: {len(chunks)} chunks")
     
-    # MAP: sumariza cada chunk em paralelo com modelo leve
+    # MAP: sumariza chunks com modelo leve
     with duration_histogram.labels(strategy="C-MAP").time():
-        map_tasks = []
-        for i, chunk in enumerate(chunks):
-            summary_prompt = [
-                {"role": "system", "content": "Summarize this conversation concisely."},
-                *chunk,
-            ]
-            map_tasks.append(call_ollama(MODEL_LIGHTER, summary_prompt))
-        
-        summaries = await asyncio.gather(*map_tasks)
+        summaries, missing = await map_phase(chunks, temperature)
+    if missing:
+        map_partial_reduce.inc()
     
     # REDUCE: sintetiza com modelo principal
     reduce_messages = [
         {"role": "system", "content": "You are a helpful assistant. Based on the following conversation summaries, provide a final response."},
     ]
     
-    for i, summary in enumerate(summaries):
-        if "choices" in summary and len(summary["choices"]) > 0:
-            content = summary["choices"][0]["message"].get("content", "")
+    for i, content in enumerate(summaries):
+        if content:
             reduce_messages.append({
                 "role": "user",
                 "content": f"Summary {i+1}: {content}",
@@ -440,9 +2879,6 @@ async def strategy_c(messages: List[Dict]) -> Dict:
             "content": f"Current request: {safe_get_content_text(last_msg.get('content', ''))}",
         })
     
-    with duration_histogram.labels(strategy="C-REDUCE").time():
-        result = await call_ollama(MODEL_FAST, reduce_messages)
-    
     # Salva tokens
     original_tokens = sum(estimate_tokens(safe_get_content_text(m.get("content", ""))) for m in messages)
     reduced_tokens = sum(estimate_tokens(m["content"]) for m in reduce_messages)
@@ -450,8 +2886,582 @@ async def strategy_c(messages: List[Dict]) -> Dict:
     tokens_saved.inc(saved)
     logger.info(f"Map-Reduce salvou ~{saved} tokens")
     
+    return reduce_messages
+
+async def strategy_c(messages: List[Dict], temperature: float = 0.7) -> Dict:
+    """Strategy C: > 6K tokens → Map-Reduce paralelo."""
+    requests_total.labels(strategy="C").inc()
+    logger.info("Strategy C: Map-Reduce")
+    
+    reduce_messages = await map_reduce_messages(messages, temperature)
+    
+    with duration_histogram.labels(strategy="C-REDUCE").time():
+        result = await call_ollama(MODEL_FAST, reduce_messages, temperature=temperature)
+    
     return validate_openai_response(result)
 
+async def strategy_c_stream(messages: List[Dict], temperature: float = 0.7) -> AsyncIterator[Dict]:
+    """Strategy C em modo streaming: MAP completo, REDUCE repassado em chunks."""
+    requests_total.labels(strategy="C").inc()
+    logger.info("Strategy C (stream): Map-Reduce")
+    
+    reduce_messages = await map_reduce_messages(messages, temperature)
+    
+    async for chunk in timed_stream("C-REDUCE", call_ollama_stream(MODEL_FAST, reduce_messages,
+                                                                  temperature=temperature)):
+        yield chunk
+
+def choose_strategy(tokens: int, n_messages: int = 1) -> str:
+    """Escolhe estratégia (A/B/C) com a política de roteamento ativa."""
+    strategy = routing_policy.choose(tokens, n_messages, model_stats)
+    routing_decisions.labels(policy=routing_policy.name, strategy=strategy).inc()
+    log_routing_event({"type": "request", "tokens": tokens, "messages": n_messages,
+                       "policy": routing_policy.name, "strategy": strategy})
+    return strategy
+
+STRATEGIES = {"A": strategy_a, "B": strategy_b, "C": strategy_c, "R": strategy_r}
+
+# Primeiro modelo chamado por cada estratégia (alvo do controle de admissão)
+STRATEGY_ENTRY_MODELS = {
+    "A": MODEL_FAST,
+    "B": MODEL_LIGHTER,
+    "C": MODEL_LIGHTER,
+    "R": MODEL_LIGHTER,
+}
+
+STREAM_STRATEGIES = {
+    "A": strategy_a_stream,
+    "B": strategy_b_stream,
+    "C": strategy_c_stream,
+    "R": strategy_r_stream,
+}
+
+# ══════════════════════════════════════════════════════════════════════════
+# Cache de respostas (persistente)
+# ══════════════════════════════════════════════════════════════════════════
+
+class ResponseCache:
+    """
+    Cache de respostas persistido em SQLite, com limite de entradas (LRU) e TTL.
+
+    Sobrevive a restarts do serviço. A conexão é aberta sob demanda e as
+    operações são síncronas — chamar via `asyncio.to_thread` no event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Retorna a resposta cacheada (ou None se ausente/expirada)."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if now - created > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                response_cache_evictions.labels(reason="ttl").inc()
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return json.loads(response)
+
+    def put(self, key: str, response: Dict):
+        """Armazena resposta e remove as entradas menos usadas acima do limite."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response, ensure_ascii=False), now, now),
+            )
+            total = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            excess = total - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                    (excess,),
+                )
+                response_cache_evictions.labels(reason="lru").inc(excess)
+                total -= excess
+            conn.commit()
+        response_cache_entries.set(total)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+response_cache = ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL)
+
+def response_cache_key(messages: List[Dict], model: str, temperature: float,
+                       tools: Optional[List[Dict]]) -> str:
+    """Chave do cache: versão do formato + mensagens normalizadas + modelo + temperature + tools."""
+    base = f"v{CACHE_KEY_VERSION}|{hash_messages(messages)}|{model}|{temperature}|{hash_messages(tools or [])}"
+    return hashlib.sha256(base.encode()).hexdigest()[:32]
+
+def cache_bypass_requested(request: Request) -> bool:
+    """Cliente pode ignorar o cache com `X-LLM-Optimizer-Cache: bypass` ou `Cache-Control: no-cache`."""
+    if request.headers.get("x-llm-optimizer-cache", "").lower() == "bypass":
+        return True
+    cache_control = request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+async def cached_stream(result: Dict) -> AsyncIterator[Dict]:
+    """Reproduz uma resposta cacheada como stream de chunks."""
+    completion_id = result.get("id", f"cache-{int(time.time())}")
+    model = result.get("model", MODEL_FAST)
+    created = int(time.time())
+    content = result["choices"][0]["message"].get("content") or ""
+    yield create_chunk(completion_id, model, created, {"role": "assistant", "content": ""})
+    yield create_chunk(completion_id, model, created, {"content": content})
+    yield create_chunk(completion_id, model, created, {}, finish_reason="stop")
+
+async def caching_stream(chunks: AsyncIterator[Dict],
+                         store: Callable[[Dict], Awaitable[None]]) -> AsyncIterator[Dict]:
+    """
+    Repassa chunks e, ao final, entrega a resposta completa para `store` gravar.
+
+    Só grava streams que terminaram normalmente: um chunk de erro em qualquer
+    posição (resposta cortada no meio) descarta a resposta.
+    """
+    parts: List[str] = []
+    completion_id, model = None, MODEL_FAST
+    failed = False
+    async for chunk in chunks:
+        completion_id = chunk.get("id", completion_id)
+        model = chunk.get("model", model)
+        failed = failed or is_error_chunk(chunk)
+        parts.append(chunk["choices"][0]["delta"].get("content") or "")
+        yield chunk
+
+    content = "".join(parts)
+    if content and not failed:
+        result = validate_openai_response({
+            "id": completion_id,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        })
+        await store(result)
+
+# ══════════════════════════════════════════════════════════════════════════
+# Cache semântico (quase-duplicatas)
+# ══════════════════════════════════════════════════════════════════════════
+
+# Prompts só de leitura: pedem explicação/resumo e não pedem mudança
+READ_ONLY_PATTERN = re.compile(
+    r"\b(explain|explique|explica|describe|descreva|summari[sz]e|resuma|resumo|what does|what is|"
+    r"o que (faz|é)|como funciona|how does|why|por ?que|review|revise|analy[sz]e|analise|"
+    r"list|liste|show|mostre)\b",
+    re.IGNORECASE,
+)
+WRITE_INTENT_PATTERN = re.compile(
+    r"\b(write|edit|fix|create|delete|remove|run|execute|install|apply|refactor|rename|update|implement|"
+    r"escreva|edite|corrija|crie|apague|remova|rode|execute|instale|aplique|refatore|renomeie|"
+    r"atualize|implemente|altere|mude)\b",
+    re.IGNORECASE,
+)
+
+def normalize_vector(values: List[float]) -> array:
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return array("f", (v / norm for v in values))
+
+def cosine(a: array, b: array) -> float:
+    """Produto escalar de vetores já normalizados."""
+    return sum(map(operator.mul, a, b))
+
+class SemanticIndex:
+    """
+    Vizinho mais próximo por cosseno.
+
+    Usa HNSW (hnswlib) quando instalado; senão compara contra todos os
+    vetores (força bruta, suficiente para alguns milhares de entradas).
+    Remoções marcam o slot como apagado e ele é reaproveitado no próximo add.
+    """
+
+    def __init__(self, max_entries: int, use_hnsw: bool = HNSWLIB_AVAILABLE):
+        self.max_entries = max_entries
+        self.use_hnsw = use_hnsw
+        self._vectors: Dict[int, array] = {}
+        self._hnsw = None
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def add(self, label: int, vector: array):
+        self._vectors[label] = vector
+        if not self.use_hnsw:
+            return
+        if self._hnsw is None:
+            self._hnsw = hnswlib.Index(space="cosine", dim=len(vector))
+            self._hnsw.init_index(max_elements=self.max_entries, ef_construction=100, M=16,
+                                  allow_replace_deleted=True)
+            self._hnsw.set_ef(50)
+        self._hnsw.add_items([list(vector)], [label], replace_deleted=True)
+
+    def remove(self, label: int):
+        if self._vectors.pop(label, None) is not None and self._hnsw is not None:
+            self._hnsw.mark_deleted(label)
+
+    def nearest(self, vector: array, allowed: Callable[[int], bool]) -> Optional[Tuple[int, float]]:
+        """(label, similaridade) do vetor mais próximo entre os labels permitidos."""
+        if not self._vectors:
+            return None
+        if self._hnsw is not None:
+            try:
+                labels, distances = self._hnsw.knn_query([list(vector)], k=1, filter=allowed)
+            except RuntimeError:  # nenhum label passou no filtro
+                return None
+            return int(labels[0][0]), 1.0 - float(distances[0][0])
+        best = None
+        for label, candidate in self._vectors.items():
+            if len(candidate) != len(vector) or not allowed(label):
+                continue
+            similarity = cosine(vector, candidate)
+            if best is None or similarity > best[1]:
+                best = (label, similarity)
+        return best
+
+class SemanticQuery:
+    """Texto embedado + partição (modelo, tools, system prompt) de um request."""
+
+    __slots__ = ("partition", "text", "vector")
+
+    def __init__(self, partition: str, text: str, vector: array):
+        self.partition = partition
+        self.text = text
+        self.vector = vector
+
+class SemanticCache:
+    """
+    Cache de respostas por similaridade do último turno do usuário.
+
+    Só compara requests da mesma partição (modelo + tools + digest do system
+    prompt); dentro dela, devolve a resposta do vizinho mais próximo se a
+    similaridade passar do threshold. Em memória, com LRU e TTL.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl: int = SEMANTIC_CACHE_TTL,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, use_hnsw: bool = HNSWLIB_AVAILABLE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.index = SemanticIndex(max_entries, use_hnsw)
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._labels = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def eligible(messages: List[Dict], temperature: float) -> bool:
+        """Só prompts determinísticos cujo último turno do usuário é de leitura."""
+        if temperature > SEMANTIC_CACHE_MAX_TEMPERATURE or messages[-1]["role"] != "user":
+            return False
+        text = messages[-1]["content"]
+        return bool(READ_ONLY_PATTERN.search(text)) and not WRITE_INTENT_PATTERN.search(text)
+
+    @staticmethod
+    def partition(messages: List[Dict], model: str, tools: Optional[List[Dict]]) -> str:
+        system = [m for m in messages if m["role"] == "system"]
+        return f"{model}|{hash_messages(tools or [])}|{hash_messages(system)}"
+
+    async def embed(self, text: str) -> Optional[array]:
+        """Embedding via /api/embeddings do Ollama (None se indisponível)."""
+        backend = ollama_pool.pick(SEMANTIC_CACHE_MODEL)
+        if backend is None:
+            return None
+        try:
+            resp = await get_http_client(backend.url).post(
+                f"{backend.url}/api/embeddings",
+                json={"model": SEMANTIC_CACHE_MODEL, "prompt": text[-SEMANTIC_CACHE_MAX_CHARS:],
+                      "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=SEMANTIC_CACHE_TIMEOUT,
+            )
+            resp.raise_for_status()
+            values = resp.json().get("embedding")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Cache semântico: embedding falhou: {e}")
+            return None
+        if not values:
+            return None
+        return normalize_vector(values)
+
+    async def prepare(self, messages: List[Dict], model: str,
+                      tools: Optional[List[Dict]]) -> Optional[SemanticQuery]:
+        text = messages[-1]["content"]
+        vector = await self.embed(text)
+        if vector is None:
+            semantic_cache_requests.labels(result="error").inc()
+            return None
+        return SemanticQuery(self.partition(messages, model, tools), text, vector)
+
+    def lookup(self, query: SemanticQuery) -> Optional[Tuple[int, Dict, float]]:
+        """(label, resposta, similaridade) do melhor vizinho acima do threshold."""
+        with self._lock:
+            match = self.index.nearest(
+                query.vector, lambda label: self._entries.get(label, {}).get("partition") == query.partition
+            )
+            if match is not None:
+                semantic_cache_similarity.observe(max(0.0, match[1]))
+            if match is not None and time.time() - self._entries[match[0]]["created"] > self.ttl:
+                self._evict(match[0])
+                match = None
+            if match is None or match[1] < self.threshold:
+                semantic_cache_requests.labels(result="miss").inc()
+                return None
+            label, similarity = match
+            self._entries.move_to_end(label)
+            semantic_cache_requests.labels(result="hit").inc()
+            return label, self._entries[label]["response"], similarity
+
+    def store(self, query: SemanticQuery, response: Dict):
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._evict(next(iter(self._entries)))
+            label = next(self._labels)
+            self._entries[label] = {"partition": query.partition, "text": query.text,
+                                    "response": response, "created": time.time()}
+            self.index.add(label, query.vector)
+            semantic_cache_entries.set(len(self._entries))
+
+    def invalidate(self, label: int):
+        with self._lock:
+            self._evict(label)
+
+    def _evict(self, label: int):
+        if self._entries.pop(label, None) is not None:
+            self.index.remove(label)
+            semantic_cache_entries.set(len(self._entries))
+
+semantic_cache = SemanticCache()
+
+# Verificações em andamento (referência forte até terminarem)
+_verify_tasks: set = set()
+
+def schedule_semantic_verification(label: int, messages: List[Dict], temperature: float,
+                                   strategy: str, cached: Dict):
+    task = asyncio.create_task(verify_semantic_hit(label, messages, temperature, strategy, cached))
+    _verify_tasks.add(task)
+    task.add_done_callback(_verify_tasks.discard)
+
+async def verify_semantic_hit(label: int, messages: List[Dict], temperature: float,
+                              strategy: str, cached: Dict):
+    """
+    Reexecuta um hit amostrado e compara as respostas por embedding.
+
+    Resposta nova longe da cacheada conta como falso hit e derruba a
+    entrada (ela atendeu um prompt diferente do que parecia). Chama o modelo
+    final da estratégia direto, com prioridade de MAP, fora das métricas por
+    estratégia e sem o trace do request que teve o hit.
+    """
+    _current_trace.set(None)
+    model = MODEL_FAST if strategy in ("A", "C") else MODEL_LIGHTER
+    try:
+        fresh = await call_ollama(model, messages, temperature=temperature, priority=PRIORITY_BULK)
+        if is_fallback_response(fresh):
+            raise RuntimeError(fresh["choices"][0]["message"]["content"])
+        vectors = [await semantic_cache.embed(summary_text(r)) for r in (cached, fresh)]
+        if None in vectors:
+            raise RuntimeError("embedding indisponível")
+    except Exception as e:
+        logger.warning(f"Cache semântico: verificação falhou: {e}")
+        semantic_cache_verifications.labels(result="error").inc()
+        return
+    if cosine(*vectors) >= semantic_cache.threshold:
+        semantic_cache_verifications.labels(result="confirmed").inc()
+    else:
+        semantic_cache_verifications.labels(result="false_hit").inc()
+        logger.warning(f"Cache semântico: falso hit (entrada {label}), removida")
+        semantic_cache.invalidate(label)
+
+async def store_response(response_key: Optional[str], semantic_query: Optional[SemanticQuery], result: Dict):
+    """Grava uma resposta bem-sucedida nos caches aplicáveis."""
+    if response_key:
+        await asyncio.to_thread(response_cache.put, response_key, result)
+    if semantic_query is not None:
+        await asyncio.to_thread(semantic_cache.store, semantic_query, result)
+
+# ══════════════════════════════════════════════════════════════════════════
+# Captura de tráfego (para replay)
+# ══════════════════════════════════════════════════════════════════════════
+
+class CaptureWriter:
+    """
+    Grava requests/respostas em JSONL gzip rotativo.
+
+    O request só enfileira (put_nowait); compressão e escrita rodam numa
+    thread dedicada. Fila cheia descarta o registro em vez de atrasar o
+    request. Rotação por tamanho: `capture.jsonl.gz` → `.1` → ... → `.N`.
+    """
+
+    def __init__(self, path: str, max_bytes: int = CAPTURE_MAX_BYTES, backups: int = CAPTURE_BACKUPS,
+                 queue_size: int = CAPTURE_QUEUE_SIZE, flush_bytes: int = 1 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_bytes = flush_bytes
+        self._unflushed = 0
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self._raw = None
+        self._gz = None
+        self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict) -> bool:
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            capture_records.labels(result="dropped").inc()
+            return False
+
+    def close(self, timeout: float = 5.0):
+        """Drena a fila e fecha o arquivo."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Captura: fila cheia no shutdown, registros pendentes descartados")
+            return
+        self._thread.join(timeout)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._raw = open(self.path, "ab")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="ab")
+
+    def _close_file(self):
+        self._gz.close()
+        self._raw.close()
+
+    def _rotate(self):
+        self._close_file()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _run(self):
+        self._open()
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                data = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                self._gz.write(data)
+                self._unflushed += len(data)
+                # O zlib só emite bytes comprimidos no flush: o tamanho em disco
+                # (rotação) é checado quando a fila esvazia ou a cada flush_bytes
+                if self._queue.empty() or self._unflushed >= self.flush_bytes:
+                    self._gz.flush()
+                    self._unflushed = 0
+                    if self._raw.tell() >= self.max_bytes:
+                        self._rotate()
+                capture_records.labels(result="written").inc()
+            except Exception as e:
+                capture_records.labels(result="error").inc()
+                logger.error(f"Captura: falha ao gravar registro: {e}")
+        self._close_file()
+
+capture_writer: Optional[CaptureWriter] = None
+
+def worker_capture_path(path: str) -> str:
+    """
+    Arquivo de captura deste processo.
+
+    No modo multi-worker cada worker grava (e rotaciona) o próprio arquivo,
+    `<CAPTURE_PATH>.w<N>`, com N estável entre reinícios do worker; o replay
+    junta todos pelo timestamp.
+    """
+    index = os.environ.get("LLM_OPTIMIZER_WORKER_INDEX")
+    return f"{path}.w{index}" if index is not None else path
+
+def start_capture():
+    global capture_writer
+    if CAPTURE_PATH and capture_writer is None:
+        path = worker_capture_path(CAPTURE_PATH)
+        capture_writer = CaptureWriter(path)
+        logger.info(f"Captura de tráfego: {path} (rotação {CAPTURE_MAX_BYTES // (1024 * 1024)}MB × {CAPTURE_BACKUPS})")
+
+def stop_capture():
+    global capture_writer
+    if capture_writer is not None:
+        capture_writer.close()
+        capture_writer = None
+
+def capture_record(req: ChatRequestView, messages: List[Dict], tokens: int,
+                   strategy: str, temperature: float) -> Optional[Dict]:
+    """Registro base de captura (None com a captura desligada)."""
+    if capture_writer is None:
+        return None
+    return {
+        "ts": time.time(),
+        "model": req.model,
+        "stream": req.stream,
+        "temperature": temperature,
+        "tools": req.tools,
+        "messages": messages,
+        "tokens": tokens,
+        "strategy": strategy,
+    }
+
+def capture_exchange(record: Optional[Dict], started: float, status: int, cache: str,
+                     response: Optional[Dict] = None, ttft: Optional[float] = None):
+    """Completa o registro com o resultado e enfileira para gravação."""
+    if record is None or capture_writer is None:
+        return
+    record.update({
+        "status": status,
+        "cache": cache,
+        "duration_s": round(time.perf_counter() - started, 4),
+        "ttft_s": round(ttft, 4) if ttft is not None else None,
+        "response": response if CAPTURE_RESPONSES else None,
+    })
+    capture_writer.submit(record)
+
+async def capturing_stream(record: Optional[Dict], started: float, cache: str,
+                           chunks: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+    """Repassa chunks e captura conteúdo + TTFT quando o stream termina."""
+    parts: List[str] = []
+    ttft = None
+    try:
+        async for chunk in chunks:
+            content = chunk["choices"][0]["delta"].get("content") or ""
+            if content and ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(content)
+            yield chunk
+    finally:
+        capture_exchange(record, started, 200, cache, {"content": "".join(parts)}, ttft)
+
 # ══════════════════════════════════════════════════════════════════════════
 # Endpoints
 # ══════════════════════════════════════════════════════════════════════════
@@ -464,12 +3474,28 @@ async def health():
         "status": "ok",
         "version": "2.3.0",
         "ollama_host": OLLAMA_HOST,
+        "backends": [
+            {"url": b.url, "healthy": b.healthy, "outstanding": b.outstanding, "loaded": sorted(b.loaded)}
+            for b in ollama_pool.backends
+        ],
+        "routing_policy": routing_policy.name,
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
 
+@app.get("/debug/slow")
+async def debug_slow(n: int = 10):
+    """Os N requests mais lentos da janela recente, com o tempo por etapa."""
+    return {"window": len(_recent_traces), "requests": slowest_traces(max(1, min(n, SLOW_TRACE_WINDOW)))}
+
 @app.get("/metrics")
 async def metrics():
     """Prometheus metrics."""
+    update_pool_metrics()
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Multi-worker: agrega os arquivos de métricas de todos os processos
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type="text/plain")
     return Response(content=generate_latest(), media_type="text/plain")
 
 @app.post("/v1/chat/completions")
@@ -481,12 +3507,17 @@ async def chat_completions(request: Request):
     - Sanitização robusta com guards
     - Validação de schema na saída
     - Fallback para erros
+    - Streaming SSE (`chat.completion.chunk`) quando `stream: true`
     """
+    started = time.perf_counter()
+    trace = begin_trace()
     try:
-        body = await request.json()
-    except json.JSONDecodeError as e:
+        with stage("parse"):
+            body = json_loads(await request.body())
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
         logger.error(f"JSON inválido: {e}")
         errors_total.inc()
+        finish_trace(trace, 400)
         return JSONResponse(
             status_code=400,
             content={"error": "Invalid JSON"},
@@ -494,80 +3525,208 @@ async def chat_completions(request: Request):
     
     # Parse request
     try:
-        req = ChatCompletionRequest(**body)
+        with stage("validate"):
+            req = parse_chat_request(body)
     except Exception as e:
         logger.error(f"Request inválido: {e}")
         errors_total.inc()
+        finish_trace(trace, 400)
         return JSONResponse(
             status_code=400,
             content={"error": f"Invalid request: {e}"},
         )
     
     # Detecta tool calling
-    if req.tools or any("tool" in msg.role for msg in req.messages):
+    if req.tools or any("tool" in msg["role"] for msg in req.messages):
         tool_calls_detected.inc()
     
-    # Converte para dict e sanitiza
-    messages_raw = [msg.dict() for msg in req.messages]
+    messages_raw = req.messages
     
     # Aplica smart truncation no system prompt se necessário
-    for msg in messages_raw:
-        if msg.get("role") == "system":
-            content = safe_get_content_text(msg.get("content", ""))
-            tokens = estimate_tokens(content)
-            if tokens > STRATEGY_A_MAX:
-                msg["content"] = smart_truncate_system_prompt(content)
+    with stage("truncate"):
+        for msg in messages_raw:
+            if msg.get("role") == "system":
+                content = safe_get_content_text(msg.get("content", ""))
+                tokens = estimate_tokens(content)
+                if tokens > STRATEGY_A_MAX:
+                    msg["content"] = smart_truncate_system_prompt(content)
     
     # Sanitiza mensagens
-    messages = sanitize_messages(messages_raw)
+    hasher = MessageHasher()
+    with stage("sanitize"):
+        messages = sanitize_messages(messages_raw, hasher)
+    
+    # Planejador de contexto: saídas de ferramenta antigas viram digests
+    if CONTEXT_PLANNER_ENABLED and messages:
+        with stage("plan"):
+            messages = plan_context(messages)
     
     if not messages:
         logger.error("Todas as mensagens foram filtradas na sanitização")
+        finish_trace(trace, 400)
         return JSONResponse(
             status_code=400,
             content={"error": "No valid messages after sanitization"},
         )
     
-    # Estima tokens
-    total_text = " ".join(safe_get_content_text(m.get("content", "")) for m in messages)
-    tokens = estimate_tokens(total_text)
+    # Estima tokens (por mensagem, aproveitando o memo)
+    with stage("tokens"):
+        tokens = sum(estimate_tokens(m["content"]) for m in messages)
     
     logger.info(f"Request: {len(messages)} msgs, ~{tokens} tokens")
     
+    strategy = choose_strategy(tokens, len(messages))
+    trace.strategy, trace.tokens = strategy, tokens
+    temperature = req.temperature if req.temperature is not None else 0.7
+    capture = capture_record(req, messages, tokens, strategy, temperature)
+    
+    inflight_key = hasher.hexdigest()
+    
+    # Cache persistente — só para requests determinísticos
+    response_key = None
+    cache_status = "off"
+    if RESPONSE_CACHE_ENABLED and temperature <= RESPONSE_CACHE_MAX_TEMPERATURE:
+        if cache_bypass_requested(request):
+            cache_status = "bypass"
+            response_cache_requests.labels(result="bypass").inc()
+        else:
+            with stage("hash"):
+                response_key = response_cache_key(messages, req.model, temperature, req.tools)
+            with stage("cache_lookup"):
+                cached = await asyncio.to_thread(response_cache.get, response_key)
+            if cached is not None:
+                response_cache_requests.labels(result="hit").inc()
+                logger.info(f"Response cache hit: {response_key}")
+                headers = {"X-LLM-Optimizer-Cache": "hit", "X-LLM-Optimizer-Strategy": strategy}
+                if req.stream:
+                    return StreamingResponse(
+                        sse_stream(capturing_stream(capture, started, "hit",
+                                                    tracing_stream(trace, cached_stream(cached)))),
+                        media_type="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+                    )
+                capture_exchange(capture, started, 200, "hit", cached)
+                finish_trace(trace)
+                return JSONResponse(content=cached, headers=headers)
+            cache_status = "miss"
+            response_cache_requests.labels(result="miss").inc()
+    
+    # Cache semântico — quase-duplicatas de prompts só de leitura
+    semantic_query = None
+    if SEMANTIC_CACHE_ENABLED and cache_status != "bypass":
+        if semantic_cache.eligible(messages, temperature):
+            with stage("semantic_lookup"):
+                semantic_query = await semantic_cache.prepare(messages, req.model, req.tools)
+                match = (await asyncio.to_thread(semantic_cache.lookup, semantic_query)
+                         if semantic_query is not None else None)
+            if match is not None:
+                label, cached, similarity = match
+                logger.info(f"Cache semântico hit (similaridade {similarity:.3f})")
+                if random.random() < SEMANTIC_CACHE_VERIFY_RATE:
+                    schedule_semantic_verification(label, messages, temperature, strategy, cached)
+                headers = {"X-LLM-Optimizer-Cache": "semantic", "X-LLM-Optimizer-Strategy": strategy}
+                if req.stream:
+                    return StreamingResponse(
+                        sse_stream(capturing_stream(capture, started, "semantic",
+                                                    tracing_stream(trace, cached_stream(cached)))),
+                        media_type="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+                    )
+                capture_exchange(capture, started, 200, "semantic", cached)
+                finish_trace(trace)
+                return JSONResponse(content=cached, headers=headers)
+        else:
+            semantic_cache_requests.labels(result="ineligible").inc()
+    cache_headers = {"X-LLM-Optimizer-Cache": cache_status, "X-LLM-Optimizer-Strategy": strategy}
+    
+    # Admissão: recusa cedo se a fila do modelo de entrada estourar o orçamento
+    # (requests que vão pegar carona no dedup não ocupam slot)
+    if req.stream or inflight_key not in _inflight_cache:
+        try:
+            await admission.check(STRATEGY_ENTRY_MODELS[strategy])
+        except AdmissionRejected as e:
+            logger.warning(f"Admissão recusada: {e}")
+            capture_exchange(capture, started, 429, cache_status)
+            finish_trace(trace, 429)
+            return JSONResponse(
+                status_code=429,
+                content={"error": str(e)},
+                headers={"Retry-After": str(e.retry_after), **cache_headers},
+            )
+    
+    # Streaming: repassa chunks do Ollama como SSE (sem dedup — cada cliente
+    # precisa do seu próprio stream)
+    if req.stream:
+        # Continuação só faz sentido quando o modelo viu o histórico inteiro (não no MAP-REDUCE)
+        chunks = tool_repair_stream(STREAM_STRATEGIES[strategy](messages, temperature), messages, temperature,
+                                    allow_continuation=strategy != "C")
+        chunks = tracing_stream(trace, chunks)
+        if response_key or semantic_query is not None:
+            chunks = caching_stream(chunks, lambda result: store_response(response_key, semantic_query, result))
+        chunks = capturing_stream(capture, started, cache_status, chunks)
+        return StreamingResponse(
+            sse_stream(chunks),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **cache_headers},
+        )
+    
     # Dedup (in-flight cache)
-    cache_key = hash_messages(messages)
+    cache_key = inflight_key
+    if cache_status == "bypass":
+        # Chave única: bypass não compartilha o slot de dedup com outros requests
+        cache_key = f"{cache_key}:bypass:{id(request)}"
     
+    # Bypass não vai para o estado compartilhado (chave local ao worker)
+    shared = shared_state if cache_status != "bypass" else None
     if cache_key in _inflight_cache:
         logger.info("Dedup: aguardando request em andamento")
         dedup_hits.inc()
         await _inflight_cache[cache_key].wait()
         result = _inflight_results.get(cache_key)
         if result:
-            return JSONResponse(content=result)
+            capture_exchange(capture, started, 200, "dedup", result)
+            finish_trace(trace)
+            return JSONResponse(content=result, headers=cache_headers)
+    elif shared is not None and not await asyncio.to_thread(shared.claim, cache_key):
+        logger.info("Dedup: aguardando request em andamento em outro worker")
+        dedup_hits.inc()
+        result = await shared.wait_result(cache_key, shared.stale_after)
+        if result:
+            capture_exchange(capture, started, 200, "dedup", result)
+            finish_trace(trace)
+            return JSONResponse(content=result, headers=cache_headers)
+        # Dono sumiu sem publicar: gera aqui
+        shared = None
     
     # Registra request em andamento
     _inflight_cache[cache_key] = asyncio.Event()
     
     try:
-        # Escolhe estratégia
-        if tokens < STRATEGY_A_MAX:
-            result = await strategy_a(messages)
-        elif tokens < STRATEGY_B_MAX:
-            result = await strategy_b(messages)
-        else:
-            result = await strategy_c(messages)
+        generation_started = time.perf_counter()
+        result = await STRATEGIES[strategy](messages, temperature)
         
         # Valida resultado
-        result = validate_openai_response(result)
+        with stage("response_validate"):
+            result = validate_openai_response(result)
+        result = await repair_tool_response(result, messages, temperature, generation_started,
+                                            allow_continuation=strategy != "C")
         
         # Armazena em cache
         _inflight_results[cache_key] = result
         _inflight_cache[cache_key].set()
+        if shared is not None:
+            await asyncio.to_thread(shared.publish, cache_key, result)
         
         # Cleanup cache após 60s
-        asyncio.create_task(cleanup_cache(cache_key))
+        asyncio.create_task(cleanup_cache(cache_key, shared))
         
-        return JSONResponse(content=result)
+        # Cache persistente / semântico
+        if not is_fallback_response(result):
+            await store_response(response_key, semantic_query, result)
+        
+        capture_exchange(capture, started, 200, cache_status, result)
+        finish_trace(trace)
+        return JSONResponse(content=result, headers=cache_headers)
         
     except Exception as e:
         logger.error(f"Erro durante processamento: {e}", exc_info=True)
@@ -577,29 +3736,109 @@ async def chat_completions(request: Request):
         fallback = create_fallback_response(f"Processing error: {e}")
         _inflight_results[cache_key] = fallback
         _inflight_cache[cache_key].set()
+        if shared is not None:
+            await asyncio.to_thread(shared.publish, cache_key, fallback)
+            asyncio.create_task(cleanup_cache(cache_key, shared))
         
+        capture_exchange(capture, started, 500, cache_status, fallback)
+        finish_trace(trace, 500)
         return JSONResponse(
             status_code=500,
             content=fallback,
         )
 
-async def cleanup_cache(key: str):
+async def cleanup_cache(key: str, shared: Optional[SharedState] = None):
     """Remove entrada do cache após delay."""
     await asyncio.sleep(60)
     _inflight_cache.pop(key, None)
     _inflight_results.pop(key, None)
+    if shared is not None:
+        await asyncio.to_thread(shared.forget, key)
 
 # ══════════════════════════════════════════════════════════════════════════
 # Main
 # ══════════════════════════════════════════════════════════════════════════
 
+def run_workers(workers: int) -> int:
+    """
+    Processo supervisor do modo multi-worker.
+
+    Abre o socket uma vez e sobe `workers` processos deste script que herdam o
+    descritor (LLM_OPTIMIZER_WORKER_FD) — o kernel distribui os accepts. O
+    diretório de métricas multiprocess é limpo no início, e slots/claims de
+    um worker que morrer são liberados antes de subir o substituto.
+    """
+    prom_dir = PROMETHEUS_MULTIPROC_DIR or os.path.join(tempfile.gettempdir(), f"llm_optimizer_prometheus_{PORT}")
+    os.makedirs(prom_dir, exist_ok=True)
+    for name in os.listdir(prom_dir):
+        if name.endswith(".db"):
+            os.remove(os.path.join(prom_dir, name))
+
+    state = SharedState(SHARED_STATE_PATH)
+    state.reset()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in HOST else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    env = {**os.environ, "LLM_OPTIMIZER_WORKER_FD": str(sock.fileno()), "PROMETHEUS_MULTIPROC_DIR": prom_dir}
+
+    def spawn(index: int) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                env={**env, "LLM_OPTIMIZER_WORKER_INDEX": str(index)}, pass_fds=[sock.fileno()])
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    procs = [spawn(i) for i in range(workers)]
+    logger.info(f"Multi-worker: {workers} processos em {HOST}:{PORT}, estado em {SHARED_STATE_PATH}")
+    while not stopping:
+        time.sleep(1)
+        for i, proc in enumerate(procs):
+            if proc.poll() is None or stopping:
+                continue
+            logger.warning(f"Worker {proc.pid} saiu com código {proc.returncode}; reiniciando")
+            multiprocess.mark_process_dead(proc.pid, prom_dir)
+            state.reap(proc.pid)
+            procs[i] = spawn(i)
+
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        multiprocess.mark_process_dead(proc.pid, prom_dir)
+    state.close()
+    sock.close()
+    return 0
+
 if __name__ == "__main__":
     import uvicorn
     
+    worker_fd = os.environ.get("LLM_OPTIMIZER_WORKER_FD")
+    if LLM_OPTIMIZER_WORKERS > 1 and worker_fd is None:
+        sys.exit(run_workers(LLM_OPTIMIZER_WORKERS))
+    
     logger.info(f"LLM-Optimizer v2.3 iniciando em {HOST}:{PORT}")
     logger.info(f"Ollama: {OLLAMA_HOST}")
     logger.info(f"Timeout por request: {TIMEOUT_EACH}s")
+    logger.info(f"Token counter: {get_token_counter().name}")
+    logger.info(f"Routing policy: {routing_policy.name}")
+    logger.info(f"Ollama keep_alive: {OLLAMA_KEEP_ALIVE}")
+    logger.info(f"Admissão: {admission.concurrency} slot(s)/modelo, orçamento de espera {ADMISSION_WAIT_BUDGET:.0f}s")
     
     service_up.set(1)
     
-    uvicorn.run(app, host=HOST, port=PORT, log_level="info")
+    if worker_fd is not None:
+        uvicorn.run(app, fd=int(worker_fd), log_level="info")
+    else:
+        uvicorn.run(app, host=HOST, port=PORT, log_level="info")
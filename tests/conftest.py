@@ -0,0 +1,26 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+OPTIMIZER_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "scripts", "llm_optimizer_v2.3.py")
+)
+
+
+@pytest.fixture(scope="session")
+def llm_optimizer():
+    """Carrega scripts/llm_optimizer_v2.3.py uma única vez (métricas Prometheus são globais)."""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    pytest.importorskip("prometheus_client")
+
+    if "llm_optimizer" in sys.modules:
+        return sys.modules["llm_optimizer"]
+
+    spec = importlib.util.spec_from_file_location("llm_optimizer", OPTIMIZER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["llm_optimizer"] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("psutil")
+
+import advisor_agent_patch as adv_mod
+
+
+async def _ticks_while(coro, tick=0.02):
+    """Executa `coro` contando quantas vezes o event loop conseguiu rodar um ticker."""
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(tick)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    try:
+        result = await coro
+    finally:
+        task.cancel()
+    return result, ticks
+
+
+def test_command_timeout_kills_process_without_blocking_loop():
+    probes = adv_mod.ProbeRunner(timeout=0.3)
+    timeouts = adv_mod.advisor_probe_errors_total.labels(probe="sleep", reason="timeout")
+    before = timeouts._value.get()
+
+    start = time.monotonic()
+    result, ticks = asyncio.run(_ticks_while(probes.run_command("sleep", ["sleep", "5"])))
+
+    assert result is None
+    assert time.monotonic() - start < 2
+    assert ticks >= 5
+    assert timeouts._value.get() - before == 1
+
+
+def test_missing_binary_is_reported_as_error():
+    probes = adv_mod.ProbeRunner()
+
+    assert asyncio.run(probes.run_command("nada", ["comando-que-nao-existe-xyz"])) is None
+
+
+def test_concurrent_cpu_reads_share_one_window():
+    probes = adv_mod.ProbeRunner(cpu_window=0.3)
+
+    async def scenario():
+        return await asyncio.gather(*(probes.cpu_percent() for _ in range(5)))
+
+    start = time.monotonic()
+    (samples), ticks = asyncio.run(_ticks_while(scenario()))
+
+    assert len(set(samples)) == 1 and 0.0 <= samples[0] <= 100.0
+    assert time.monotonic() - start < 0.6
+    assert ticks >= 5
+
+
+def test_analyze_performance_does_not_block_loop(monkeypatch):
+    advisor = adv_mod.advisor
+    monkeypatch.setattr(advisor, "probes", adv_mod.ProbeRunner(cpu_window=0.2))
+
+    async def fake_llm(prompt, max_tokens=4096):
+        return "ok"
+
+    monkeypatch.setattr(advisor, "call_llm", fake_llm)
+
+    result, ticks = asyncio.run(_ticks_while(advisor.analyze_performance()))
+
+    assert result["recommendations"] == "ok"
+    assert set(result["metrics"]) >= {"cpu_percent", "memory_percent", "disk_percent"}
+    assert ticks >= 5
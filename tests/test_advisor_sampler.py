@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("psutil")
+
+import advisor_agent_patch as adv_mod
+
+
+def test_sampler_ring_buffer_wraps_and_aggregates(monkeypatch):
+    sampler = adv_mod.MetricsSampler(slots=4, interval=1)
+    clock = [1000.0]
+    cpu = iter([10.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+    monkeypatch.setattr(adv_mod.time, "time", lambda: clock[0])
+
+    for _ in range(6):
+        sampler.sample()
+        sampler._series["cpu_percent"][(sampler._next - 1) % sampler.slots] = next(cpu)
+        clock[0] += 60
+
+    stats = sampler.window(3600)
+
+    assert len(sampler) == 4
+    assert stats["samples"]["count"] == 4
+    assert stats["cpu_percent"]["avg"] == 45.0
+    assert stats["cpu_percent"]["p95"] == 50.0
+    assert stats["cpu_percent"]["trend_per_min"] == 10.0
+    assert sampler.window(90)["samples"]["count"] == 1  # só a última amostra (t-60s)
+
+
+def test_health_reads_sampler_snapshot_without_sampling(monkeypatch):
+    sampler = adv_mod.advisor.sampler
+    sampler.sample()
+    monkeypatch.setattr(adv_mod.psutil, "cpu_percent", lambda *a, **k: pytest.fail("amostragem inline"))
+    monkeypatch.setattr(sampler, "sample", lambda: pytest.fail("amostragem inline"))
+
+    body = asyncio.run(adv_mod.health())
+
+    assert body["system"]["cpu_percent"] == sampler.latest()["cpu_percent"]
+    assert "loadavg" in body["system"] and "process" in body["system"]
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("httpx")
+
+import advisor_agent_patch as adv_mod
+
+
+def _alert(i, severity="critical", name="HighCPU", instance="homelab:9100"):
+    return SimpleNamespace(id=f"m{i}", source=f"grafana-{i}", target="monitoring", content="alerta",
+                           metadata={"severity": severity, "alert_name": name, "instance": instance})
+
+
+@pytest.fixture
+def storm(monkeypatch):
+    advisor = adv_mod.advisor
+    analyses = []
+    published = []
+
+    async def fake_analysis(context=None):
+        analyses.append(context)
+        await asyncio.sleep(0.05)
+        return {"metrics": {"cpu_percent": 97}, "recommendations": "matar o processo X"}
+
+    monkeypatch.setattr(advisor, "analyze_performance", fake_analysis)
+    monkeypatch.setattr(advisor, "ipc_ready", True)
+    monkeypatch.setattr(advisor, "_alert_groups", {})
+    monkeypatch.setattr(adv_mod, "publish_request", lambda **kw: published.append(kw) or len(published),
+                        raising=False)
+    return analyses, published
+
+
+def test_alert_storm_runs_one_analysis_per_fingerprint(storm):
+    analyses, published = storm
+    advisor = adv_mod.advisor
+    merged = adv_mod.advisor_alerts_merged_total
+    before = merged._value.get()
+
+    async def scenario():
+        alerts = [_alert(i) for i in range(10)] + [_alert(10, instance="nas:9100")]
+        await asyncio.gather(*(advisor._handle_alert(a) for a in alerts))
+
+    asyncio.run(scenario())
+
+    assert len(analyses) == 2
+    replies = [p for p in published if p["target"].startswith("grafana-")]
+    reports = [p for p in published if p["target"] == "operations"]
+    assert sorted(p["target"] for p in replies) == sorted(f"grafana-{i}" for i in range(11))
+    assert all("matar o processo X" in p["content"] for p in replies)
+    assert len(reports) == 2
+    assert merged._value.get() - before == 9
+
+
+def test_repeat_within_window_is_suppressed_then_expires(storm, monkeypatch):
+    analyses, published = storm
+    advisor = adv_mod.advisor
+    suppressed = adv_mod.advisor_alerts_suppressed_total
+    before = suppressed._value.get()
+
+    async def scenario():
+        await advisor._handle_alert(_alert(0, severity="warning"))
+        await advisor._handle_alert(_alert(1, severity="critical"))
+        monkeypatch.setattr(advisor, "alert_window", 0)
+        await asyncio.sleep(0.01)
+        await advisor._handle_alert(_alert(2, severity="warning"))
+
+    asyncio.run(scenario())
+
+    assert len(analyses) == 2
+    assert suppressed._value.get() - before == 1
+    # critical que entrou num grupo aberto por warning ainda gera o relatório de incidente
+    assert [p["target"] for p in published].count("operations") == 1
+
+
+def test_sustained_storm_reanalyzes_once_result_is_older_than_window(storm, monkeypatch):
+    analyses, _ = storm
+    advisor = adv_mod.advisor
+    monkeypatch.setattr(advisor, "alert_window", 0.1)
+
+    async def scenario():
+        # Um alerta a cada 30ms por ~0.4s: o grupo nunca fica ocioso
+        for i in range(14):
+            asyncio.ensure_future(advisor._handle_alert(_alert(i)))
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    # Análise de 50ms + validade de 100ms: várias reanálises, nunca uma por alerta
+    assert 2 <= len(analyses) < 14
@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import advisor_agent_patch as adv_mod
+
+
+@pytest.fixture
+def fake_ollama(monkeypatch):
+    prompts = []
+
+    async def handler(request):
+        prompt = json.loads(request.content)["prompt"]
+        prompts.append(prompt)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"response": f"resposta para {prompt}"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(adv_mod.advisor._http_clients, "ollama", client)
+    return prompts
+
+
+def test_identical_concurrent_prompts_share_one_call(fake_ollama):
+    advisor = adv_mod.advisor
+    coalesced = adv_mod.advisor_llm_coalesced_total
+    before = coalesced._value.get()
+
+    async def scenario():
+        same = [advisor.call_llm("CPU 97%: o que fazer?", max_tokens=40) for _ in range(5)]
+        other = advisor.call_llm("Disco 90%: o que fazer?", max_tokens=40)
+        return await asyncio.gather(*same, other)
+
+    results = asyncio.run(scenario())
+
+    assert len(fake_ollama) == 2
+    assert len(set(results[:5])) == 1 and results[5] != results[0]
+    assert coalesced._value.get() - before == 4
+    assert advisor._llm_inflight == {}
+
+
+def test_cancelled_caller_does_not_cancel_shared_call(fake_ollama):
+    advisor = adv_mod.advisor
+
+    async def scenario():
+        impatient = asyncio.ensure_future(advisor.call_llm("status?", max_tokens=10))
+        await asyncio.sleep(0)
+        patient = asyncio.ensure_future(advisor.call_llm("status?", max_tokens=10))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(scenario()) == "resposta para status?"
+    assert len(fake_ollama) == 1
+
+
+def test_clients_are_pooled_per_upstream(monkeypatch):
+    advisor = adv_mod.advisor
+    monkeypatch.setattr(advisor, "_http_clients", {})
+
+    api = advisor.http_client("api")
+
+    assert advisor.http_client("api") is api
+    assert advisor.http_client("ollama") is not api
+    asyncio.run(advisor.close_http_clients())
+    assert api.is_closed and advisor._http_clients == {}
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("httpx")
+
+import advisor_agent_patch as adv_mod
+
+
+@pytest.fixture
+def ipc(monkeypatch):
+    advisor = adv_mod.advisor
+    created = time.time() - 2
+    pending = [
+        {"id": 1, "source": "ops", "content": "analyze performance", "created_at": created},
+        {"id": 2, "source": "ops", "content": "performance de novo", "created_at": created},
+        {"id": 3, "source": "dev", "content": "qual a porta do grafana?", "created_at": created},
+    ]
+    answered = {}
+    running = {"performance": 0, "max_performance": 0}
+
+    async def fake_analysis(context=None):
+        running["performance"] += 1
+        running["max_performance"] = max(running["max_performance"], running["performance"])
+        await asyncio.sleep(0.05)
+        running["performance"] -= 1
+        return {"metrics": {}, "recommendations": "ok"}
+
+    async def fake_llm(prompt, max_tokens=4096):
+        await asyncio.sleep(0.05)
+        return "3000"
+
+    monkeypatch.setattr(advisor, "ipc_ready", True)
+    monkeypatch.setattr(advisor, "_ipc_inflight", {})
+    monkeypatch.setattr(advisor, "_ipc_tasks", set())
+    monkeypatch.setattr(advisor, "_ipc_queue", [])
+    monkeypatch.setattr(advisor, "_ipc_wakeup", None)
+    monkeypatch.setattr(advisor, "analyze_performance", fake_analysis)
+    monkeypatch.setattr(advisor, "call_llm", fake_llm)
+    monkeypatch.setattr(adv_mod, "fetch_pending", lambda target, limit: [
+        r for r in pending if r["id"] not in answered][:limit], raising=False)
+    monkeypatch.setattr(adv_mod, "respond", lambda req_id, responder, response_text: answered.update(
+        {req_id: response_text}), raising=False)
+    return answered, running
+
+
+def test_requests_run_concurrently_within_type_caps(ipc):
+    answered, running = ipc
+    advisor = adv_mod.advisor
+    age = adv_mod.advisor_ipc_queue_age_seconds.labels(type="performance")
+    age_before = age._sum.get()
+
+    async def scenario():
+        first = await advisor.process_ipc_requests()
+        assert advisor.ipc_wakeup.is_set() is False
+        await asyncio.gather(*advisor._ipc_tasks)
+        assert advisor.ipc_wakeup.is_set()  # término libera vaga e acorda o worker
+        second = await advisor.process_ipc_requests()
+        await asyncio.gather(*advisor._ipc_tasks)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert (first, second) == (2, 1)  # a 2ª análise de performance espera o limite do tipo
+    assert running["max_performance"] == 1
+    assert set(answered) == {1, 2, 3} and answered[3] == "3000"
+    assert age._sum.get() - age_before >= 4
+    assert advisor._ipc_inflight == {}
+
+
+def test_capped_type_does_not_block_fetch_window(ipc, monkeypatch):
+    answered, _ = ipc
+    advisor = adv_mod.advisor
+    created = time.time()
+    backlog = [{"id": 100 + i, "source": "ops", "content": "performance", "created_at": created}
+               for i in range(5)]
+    backlog.append({"id": 200, "source": "dev", "content": "qual a porta?", "created_at": created})
+    limits = []
+
+    def fetch(target, limit):
+        limits.append(limit)
+        return [r for r in backlog if r["id"] not in answered][:limit]
+
+    monkeypatch.setattr(adv_mod, "fetch_pending", fetch, raising=False)
+    monkeypatch.setattr(advisor, "ipc_fetch_limit", 3)
+
+    async def scenario():
+        first = await advisor.process_ipc_requests()
+        second = await advisor.process_ipc_requests()
+        dispatched = set(advisor._ipc_inflight)
+        await asyncio.gather(*advisor._ipc_tasks)
+        return first, second, dispatched
+
+    first, second, dispatched = asyncio.run(scenario())
+
+    assert first == 1  # só uma análise de performance por vez
+    assert second == 1 and 200 in dispatched  # a busca seguinte passa dos tipos saturados
+    assert limits == [3, 6]
+    assert [req["id"] for req, _ in advisor._ipc_queue] == [101, 102, 103, 104]
+
+
+def test_pool_size_bounds_dispatch(ipc, monkeypatch):
+    advisor = adv_mod.advisor
+    monkeypatch.setattr(advisor, "ipc_pool_size", 1)
+
+    async def scenario():
+        dispatched = await advisor.process_ipc_requests()
+        await asyncio.gather(*advisor._ipc_tasks)
+        return dispatched
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_notify_channel_must_be_identifier():
+    with pytest.raises(ValueError):
+        adv_mod.IpcNotifyListener("postgresql://x", "agent_ipc; DROP TABLE x", asyncio.Event())
+
+
+def test_poll_stays_fast_until_a_notify_arrives():
+    from types import SimpleNamespace
+
+    wakeup = asyncio.Event()
+    listener = adv_mod.IpcNotifyListener("postgresql://x", "agent_ipc", wakeup)
+    listener._conn = SimpleNamespace(poll=lambda: None, notifies=[])
+
+    listener._on_readable()
+    assert listener.poll_interval(5, 30) == 5  # LISTEN ativo, mas ninguém publica
+
+    listener._conn.notifies.append(SimpleNamespace(channel="agent_ipc", payload=""))
+    listener._on_readable()
+    assert wakeup.is_set()
+    assert listener.poll_interval(5, 30) == 30
@@ -0,0 +1,69 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+
+def test_interactive_calls_jump_ahead_of_map_bulk(llm_optimizer):
+    controller = llm_optimizer.AdmissionController(concurrency=1, wait_budget=0)
+    order = []
+
+    async def call(name, priority, hold=0.01):
+        async with controller.slot("m", priority):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario():
+        first = asyncio.create_task(call("first", llm_optimizer.PRIORITY_BULK, hold=0.05))
+        await asyncio.sleep(0)
+        bulk = [asyncio.create_task(call(f"map{i}", llm_optimizer.PRIORITY_BULK)) for i in range(2)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(call("chat", llm_optimizer.PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        assert controller.queue_length("m") == 3
+        await asyncio.gather(first, interactive, *bulk)
+
+    asyncio.run(scenario())
+
+    assert order == ["first", "chat", "map0", "map1"]
+    assert controller.queue_length("m") == 0
+
+
+def test_cancelled_waiter_does_not_leak_slot(llm_optimizer):
+    controller = llm_optimizer.AdmissionController(concurrency=1, wait_budget=0)
+
+    async def scenario():
+        async def hold():
+            async with controller.slot("m"):
+                await asyncio.sleep(0.02)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await holder
+        async with controller.slot("m"):
+            pass
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=2))
+
+
+def test_endpoint_rejects_with_retry_after_when_queue_exceeds_budget(llm_optimizer, monkeypatch):
+    controller = llm_optimizer.AdmissionController(concurrency=1, wait_budget=5)
+    controller._active[llm_optimizer.MODEL_FAST] = 1
+    stats = llm_optimizer.ModelStats()
+    for _ in range(3):
+        stats.observe(llm_optimizer.MODEL_FAST, 1000, 200, 10.0, 20.0)
+    monkeypatch.setattr(llm_optimizer, "admission", controller)
+    monkeypatch.setattr(llm_optimizer, "model_stats", stats)
+    monkeypatch.setattr(llm_optimizer, "routing_policy", llm_optimizer.StaticThresholdPolicy())
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+
+    client = TestClient(llm_optimizer.app)
+    resp = client.post("/v1/chat/completions", json={
+        "model": "qwen3:4b",
+        "messages": [{"role": "user", "content": "oi"}],
+    })
+
+    assert resp.status_code == 429
+    assert int(resp.headers["retry-after"]) >= 5
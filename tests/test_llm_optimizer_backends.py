@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+import pytest
+
+
+def test_backends_spec_declares_models(llm_optimizer):
+    backends = llm_optimizer.parse_backends("http://a:11434=qwen3:4b, qwen3:0.6b ; http://b:11434/")
+
+    assert [b.url for b in backends] == ["http://a:11434", "http://b:11434"]
+    assert backends[0].models == {"qwen3:4b", "qwen3:0.6b"}
+    assert backends[1].models is None
+    assert not backends[0].serves("llama3") and backends[1].serves("llama3")
+
+
+def test_pick_prefers_least_outstanding_then_warm_model(llm_optimizer):
+    a, b = llm_optimizer.parse_backends("http://a:1;http://b:1")
+    pool = llm_optimizer.OllamaPool([a, b], affinity_penalty=1)
+
+    b.loaded.add("m")
+    assert pool.pick("m") is b  # mesma fila, b já tem o modelo quente
+
+    b.outstanding = 2
+    assert pool.pick("m") is a  # fila de b maior que a penalidade de carregar em a
+
+    for _ in range(pool.eject_failures):
+        pool.record_failure(a)
+    assert not a.healthy and pool.capacity("m") == 1
+    assert pool.pick("m") is b
+
+
+@pytest.fixture
+def two_backends(llm_optimizer, monkeypatch):
+    state = {"a_up": False, "calls": []}
+
+    def handler_a(request):
+        if not state["a_up"]:
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.path == "/api/ps":
+            return httpx.Response(200, json={"models": [{"name": "m"}]})
+        state["calls"].append("a")
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "de a"}})
+
+    def handler_b(request):
+        if request.url.path == "/api/ps":
+            return httpx.Response(200, json={"models": []})
+        state["calls"].append("b")
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "de b"}})
+
+    pool = llm_optimizer.OllamaPool(llm_optimizer.parse_backends("http://a:1;http://b:1"), eject_failures=1)
+    monkeypatch.setattr(llm_optimizer, "ollama_pool", pool)
+    monkeypatch.setitem(llm_optimizer._http_clients, "http://a:1",
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler_a)))
+    monkeypatch.setitem(llm_optimizer._http_clients, "http://b:1",
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler_b)))
+    return pool, state
+
+
+def test_connect_error_fails_over_and_probe_readmits(llm_optimizer, two_backends):
+    pool, state = two_backends
+    a, b = pool.backends
+
+    async def scenario():
+        result = await llm_optimizer.call_ollama("m", [{"role": "user", "content": "oi"}])
+        assert result["choices"][0]["message"]["content"] == "de b"
+        assert not a.healthy and a.outstanding == 0
+
+        state["a_up"] = True
+        await pool.probe()
+        assert a.healthy and "m" in a.loaded
+
+    asyncio.run(scenario())
+    assert state["calls"] == ["b"]
+
+
+def test_read_timeout_during_generation_does_not_eject(llm_optimizer, monkeypatch):
+    def handler(request):
+        raise httpx.ReadTimeout("generation took too long", request=request)
+
+    pool = llm_optimizer.OllamaPool(llm_optimizer.parse_backends("http://a:1"), eject_failures=1)
+    monkeypatch.setattr(llm_optimizer, "ollama_pool", pool)
+    monkeypatch.setitem(llm_optimizer._http_clients, "http://a:1",
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    result = asyncio.run(llm_optimizer.call_ollama("m", [{"role": "user", "content": "oi"}]))
+
+    assert llm_optimizer.is_fallback_response(result)
+    (a,) = pool.backends
+    assert a.healthy and a.failures == 0 and a.outstanding == 0
+
+
+def test_probe_loop_survives_unexpected_errors(llm_optimizer, monkeypatch):
+    pool = llm_optimizer.OllamaPool(llm_optimizer.parse_backends("http://a:1"))
+    probes = []
+
+    async def probe():
+        probes.append(1)
+        raise RuntimeError("json inesperado")
+
+    monkeypatch.setattr(pool, "probe", probe)
+
+    async def scenario():
+        task = asyncio.create_task(pool.probe_loop(interval=0.01))
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert len(probes) >= 2
+
+
+def test_probe_ignores_loaded_models_without_a_name(llm_optimizer, monkeypatch):
+    def handler(request):
+        return httpx.Response(200, json={"models": [{"name": "m"}, {"model": "n"}, {"size": 1}]})
+
+    pool = llm_optimizer.OllamaPool(llm_optimizer.parse_backends("http://a:1"))
+    monkeypatch.setattr(llm_optimizer, "ollama_pool", pool)
+    monkeypatch.setitem(llm_optimizer._http_clients, "http://a:1",
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    asyncio.run(pool.probe())
+
+    (a,) = pool.backends
+    assert a.loaded == {"m", "n"}
+    assert sorted(a.loaded) == ["m", "n"]  # o que /health faz
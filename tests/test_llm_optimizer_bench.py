@@ -0,0 +1,54 @@
+import importlib.util
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+BENCH_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "llm_optimizer_bench.py")
+
+
+@pytest.fixture(scope="module")
+def bench():
+    spec = importlib.util.spec_from_file_location("llm_optimizer_bench", BENCH_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_history_is_cline_shaped_and_reaches_target(bench):
+    history = bench.build_history(6000)
+
+    chars = sum(len(json.dumps(m["content"])) for m in history)
+    assert chars >= 6000 * 4
+    assert history[0]["role"] == "system"
+    assert any(m["role"] == "tool" for m in history)
+    assert any(isinstance(m["content"], list) for m in history)
+
+
+def test_fake_ollama_reports_deterministic_timings(bench):
+    app = bench.create_fake_ollama(prompt_rate=1e6, eval_rate=1e6, latency=0, output_tokens=3, parallel=1)
+    client = TestClient(app)
+    body = {"model": "m", "messages": [{"role": "user", "content": "x" * 400}]}
+
+    plain = client.post("/api/chat", json={**body, "stream": False}).json()
+    lines = client.post("/api/chat", json={**body, "stream": True}).text.splitlines()
+
+    assert plain["done"] and plain["prompt_eval_count"] == 100 and plain["eval_count"] == 3
+    chunks = [json.loads(line) for line in lines]
+    assert "".join(c["message"]["content"] for c in chunks) == "tok0 tok1 tok2 "
+    assert chunks[-1]["done"] and chunks[-1]["prompt_eval_duration"] > 0
+
+
+def test_summary_groups_by_strategy(bench):
+    run = {"scenario": "2k", "mode": "stream", "wall_s": 2.0, "results": [
+        {"ok": True, "strategy": "A", "latency": 1.0, "ttft": 0.2},
+        {"ok": True, "strategy": "A", "latency": 2.0, "ttft": 0.4},
+        {"ok": False, "strategy": "B", "latency": 0.1},
+    ]}
+
+    rows = {r["strategy"]: r for r in bench.summarize(run)}
+
+    assert rows["A"]["p99_s"] == 2.0 and rows["A"]["throughput_rps"] == 1.0
+    assert rows["A"]["ttft_p50_s"] == 0.4
+    assert rows["B"]["errors"] == 1
@@ -0,0 +1,75 @@
+import gzip
+import importlib.util
+import json
+import os
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+REPLAY_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "llm_optimizer_capture_replay.py")
+
+
+@pytest.fixture(scope="module")
+def replay():
+    spec = importlib.util.spec_from_file_location("llm_optimizer_capture_replay", REPLAY_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_writer_rotates_and_replay_reads_in_order(llm_optimizer, replay, tmp_path):
+    path = str(tmp_path / "capture.jsonl.gz")
+    writer = llm_optimizer.CaptureWriter(path, max_bytes=1000, backups=10, flush_bytes=1)
+    for i in range(30):
+        writer.submit({"ts": i, "payload": os.urandom(64).hex()})
+    writer.close()
+
+    assert os.path.exists(f"{path}.1")
+    records = replay.read_captures([path])
+    assert [r["ts"] for r in records] == list(range(30))
+
+
+def test_workers_write_own_files_and_replay_merges_them(llm_optimizer, replay, tmp_path, monkeypatch):
+    path = str(tmp_path / "capture.jsonl.gz")
+    assert llm_optimizer.worker_capture_path(path) == path
+    for index in range(2):
+        monkeypatch.setenv("LLM_OPTIMIZER_WORKER_INDEX", str(index))
+        writer = llm_optimizer.CaptureWriter(llm_optimizer.worker_capture_path(path), max_bytes=500, flush_bytes=1)
+        for i in range(index, 20, 2):
+            writer.submit({"ts": i, "payload": os.urandom(64).hex()})
+        writer.close()
+
+    assert os.path.exists(f"{path}.w0") and os.path.exists(f"{path}.w1.1")
+    assert not os.path.exists(path)
+    records = replay.read_captures([path])
+    assert [r["ts"] for r in records] == list(range(20))
+
+
+def test_endpoint_captures_sanitized_request_and_response(llm_optimizer, replay, tmp_path, monkeypatch):
+    def handler(request):
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "capturado"}})
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+    path = str(tmp_path / "capture.jsonl.gz")
+    writer = llm_optimizer.CaptureWriter(path)
+    monkeypatch.setattr(llm_optimizer, "capture_writer", writer)
+
+    client = TestClient(llm_optimizer.app)
+    resp = client.post("/v1/chat/completions", json={
+        "model": "qwen3:4b",
+        "messages": [{"role": "user", "content": [{"type": "text", "text": "captura multimodal"}]}],
+    })
+    writer.close()
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        (record,) = [json.loads(line) for line in f]
+    assert record["messages"] == [{"role": "user", "content": "captura multimodal"}]
+    assert record["strategy"] == resp.headers["x-llm-optimizer-strategy"]
+    assert record["status"] == 200 and record["duration_s"] >= 0
+    assert record["response"]["choices"][0]["message"]["content"] == "capturado"
+
+    report = replay.diff([record], replay.replay_routing(llm_optimizer, [record], "static"), top=5)
+    assert report["strategy_changed"] == 0
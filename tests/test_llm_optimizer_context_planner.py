@@ -0,0 +1,49 @@
+def _tool_result(name, path, lines):
+    body = "\n".join(f"linha {i} de {path}" for i in range(lines))
+    return {"role": "user", "content": f"[{name} for '{path}'] Result:\n{body}"}
+
+
+def _history():
+    return [
+        {"role": "system", "content": "Você é o CLINE."},
+        {"role": "user", "content": "<task>explique o projeto</task>"},
+        {"role": "assistant", "content": "<read_file><path>a.py</path></read_file>"},
+        _tool_result("read_file", "a.py", 300),
+        {"role": "assistant", "content": "<execute_command><command>ls</command></execute_command>"},
+        _tool_result("execute_command", "ls", 300),
+        {"role": "assistant", "content": "<read_file><path>b.py</path></read_file>"},
+        _tool_result("read_file", "b.py", 300),
+    ]
+
+
+def test_stale_tool_outputs_become_digests_within_budget(llm_optimizer):
+    messages = _history()
+    total = sum(llm_optimizer.estimate_tokens(m["content"]) for m in messages)
+
+    planned = llm_optimizer.plan_context(messages, budget=2000, keep_recent=2)
+
+    assert total > 2000
+    assert sum(llm_optimizer.estimate_tokens(m["content"]) for m in planned) <= 2000
+    assert planned[-1] is messages[-1]  # recentes intactas
+    assert planned[0] is messages[0]
+    digest = planned[3]["content"]
+    assert digest.startswith("[read_file for 'a.py'] Result:")
+    assert "linhas omitidas de 301" in digest and digest.endswith("linha 299 de a.py")
+
+
+def test_under_budget_history_is_untouched(llm_optimizer):
+    messages = _history()[:3]
+
+    assert llm_optimizer.plan_context(messages, budget=2000) is messages
+
+
+def test_digest_is_memoized_by_content(llm_optimizer):
+    content = _tool_result("read_file", "memo.py", 100)["content"]
+    hits = llm_optimizer.context_digest_cache.labels(result="hit")
+    before = hits._value.get()
+
+    first = llm_optimizer.digest_content(content)
+    second = llm_optimizer.digest_content(content)
+
+    assert first == second and len(first) < len(content)
+    assert hits._value.get() - before == 1
@@ -0,0 +1,64 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+def test_well_formed_body_skips_pydantic_and_keeps_dicts(llm_optimizer):
+    messages = [{"role": "user", "content": "oi", "extra": 1}]
+
+    req = llm_optimizer.parse_chat_request({"model": "m", "messages": messages, "temperature": 0})
+
+    assert req.messages is messages
+    assert req.temperature == 0.0 and isinstance(req.temperature, float)
+    assert req.stream is False and req.tools is None
+
+
+def test_loose_body_falls_back_to_pydantic(llm_optimizer):
+    req = llm_optimizer.parse_chat_request({
+        "model": "m", "temperature": "0.2", "messages": [{"role": "user", "content": "oi"}],
+    })
+    assert req.temperature == 0.2
+    assert req.messages == [{"role": "user", "content": "oi", "name": None,
+                             "tool_call_id": None, "tool_calls": None}]
+
+    with pytest.raises(Exception):
+        llm_optimizer.parse_chat_request({"messages": []})
+
+
+def test_incremental_hash_matches_hash_messages(llm_optimizer):
+    raw = [
+        {"role": "system", "content": "regras"},
+        {"role": "tool", "content": [{"type": "text", "text": "saída"}]},
+        {"role": "user", "content": "   "},
+    ]
+    hasher = llm_optimizer.MessageHasher()
+
+    messages = llm_optimizer.sanitize_messages(raw, hasher)
+
+    assert hasher.hexdigest() == llm_optimizer.hash_messages(messages)
+    assert llm_optimizer.hash_messages([{"role": "a", "content": "bc"}]) != \
+        llm_optimizer.hash_messages([{"role": "ab", "content": "c"}])
+
+
+def test_endpoint_forwards_serialized_bytes(llm_optimizer, monkeypatch):
+    seen = {}
+
+    def handler(request):
+        seen["content_type"] = request.headers["content-type"]
+        seen["payload"] = json.loads(request.content)
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}})
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+
+    client = TestClient(llm_optimizer.app)
+    body = b'{"model": "qwen3:4b", "messages": [{"role": "user", "content": "bytes \\u00e9 NaN", "x": NaN}]}'
+    resp = client.post("/v1/chat/completions", content=body, headers={"Content-Type": "application/json"})
+
+    assert resp.status_code == 200
+    assert seen["content_type"] == "application/json"
+    assert seen["payload"]["messages"] == [{"role": "user", "content": "bytes é NaN"}]
+    assert client.post("/v1/chat/completions", content=b"{nope").status_code == 400
@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+import pytest
+
+
+def _conversation(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"mensagem {i}"} for i in range(n)]
+
+
+def test_chunk_boundaries_are_stable_when_messages_are_appended(llm_optimizer):
+    before = llm_optimizer.chunk_messages(_conversation(30))
+    after = llm_optimizer.chunk_messages(_conversation(37))
+
+    # Todos os chunks fechados continuam idênticos; só a cauda muda
+    assert after[:len(before) - 1] == before[:-1]
+    assert all(len(c) <= llm_optimizer.MAP_CHUNK_MAX for c in after)
+
+
+@pytest.fixture
+def map_calls(llm_optimizer, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "resumo"}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST, client)
+    monkeypatch.setattr(llm_optimizer, "_map_summary_cache", llm_optimizer.OrderedDict())
+    # Só chamadas de chunk (sem nós da redução em árvore)
+    monkeypatch.setattr(llm_optimizer, "MAP_REDUCE_FANIN", 0)
+    return calls
+
+
+def test_only_new_chunks_are_mapped_on_next_turn(llm_optimizer, map_calls):
+    turn1 = _conversation(30)
+    turn2 = _conversation(34)
+
+    asyncio.run(llm_optimizer.map_reduce_messages(turn1))
+    first_turn_calls = len(map_calls)
+    asyncio.run(llm_optimizer.map_reduce_messages(turn2))
+
+    seen = llm_optimizer.chunk_messages(turn1)
+    new_chunks = [c for c in llm_optimizer.chunk_messages(turn2) if c not in seen]
+    assert first_turn_calls == len(seen)
+    assert 0 < len(new_chunks) < len(seen)
+    assert len(map_calls) - first_turn_calls == len(new_chunks)
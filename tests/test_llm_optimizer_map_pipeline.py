@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+
+def _conversation(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"mensagem {i}"} for i in range(n)]
+
+
+@pytest.fixture
+def slow_ollama(llm_optimizer, monkeypatch):
+    """Ollama simulado: resumos rápidos, exceto chunks com 'mensagem 0' (lentos)."""
+    state = {"chunk_calls": 0, "fold_calls": 0, "max_concurrent": 0, "current": 0, "delay": 0.01}
+
+    async def handler(request):
+        payload = json.loads(request.content)
+        system = payload["messages"][0]["content"]
+        if system.startswith("Combine"):
+            state["fold_calls"] += 1
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "fold"}})
+        state["chunk_calls"] += 1
+        state["current"] += 1
+        state["max_concurrent"] = max(state["max_concurrent"], state["current"])
+        try:
+            slow = any(m["content"] == "mensagem 0" for m in payload["messages"][1:])
+            await asyncio.sleep(5 if slow else state["delay"])
+        finally:
+            state["current"] -= 1
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "resumo"}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST, client)
+    monkeypatch.setattr(llm_optimizer, "_map_summary_cache", llm_optimizer.OrderedDict())
+    monkeypatch.setattr(llm_optimizer, "admission", llm_optimizer.AdmissionController(concurrency=8, wait_budget=0))
+    monkeypatch.setattr(llm_optimizer, "MAP_CONCURRENCY", 2)
+    monkeypatch.setattr(llm_optimizer, "MAP_CHUNK_TIMEOUT", 0.2)
+    monkeypatch.setattr(llm_optimizer, "MAP_CHUNK_RETRIES", 1)
+    return state
+
+
+def test_slow_chunk_times_out_and_falls_back_to_excerpt(llm_optimizer, slow_ollama, monkeypatch):
+    monkeypatch.setattr(llm_optimizer, "MAP_REDUCE_FANIN", 0)
+    chunks = llm_optimizer.chunk_messages(_conversation(20))
+
+    texts, missing = asyncio.run(asyncio.wait_for(llm_optimizer.map_phase(chunks, 0.0), timeout=3))
+
+    assert missing == 1
+    assert "mensagem 0" in texts[0]  # trecho bruto no lugar do resumo
+    assert texts[1:] == ["resumo"] * (len(chunks) - 1)
+    assert slow_ollama["max_concurrent"] <= 2
+
+
+def test_chunk_timeout_excludes_admission_queue_wait(llm_optimizer, slow_ollama, monkeypatch):
+    monkeypatch.setattr(llm_optimizer, "MAP_REDUCE_FANIN", 0)
+    monkeypatch.setattr(llm_optimizer, "admission", llm_optimizer.AdmissionController(concurrency=1, wait_budget=0))
+    slow_ollama["delay"] = 0.15  # cada resumo cabe no prazo de 0.2s, mas o 2º espera o slot do 1º
+    chunks = llm_optimizer.chunk_messages(_conversation(20)[1:])[:2]
+    timeouts = llm_optimizer.map_chunk_results.labels(result="timeout")
+    before = timeouts._value.get()
+
+    texts, missing = asyncio.run(asyncio.wait_for(llm_optimizer.map_phase(chunks, 0.0), timeout=3))
+
+    assert missing == 0 and texts == ["resumo", "resumo"]
+    assert timeouts._value.get() == before
+    assert slow_ollama["chunk_calls"] == 2
+
+
+def test_deadline_starts_reduce_with_partial_results(llm_optimizer, slow_ollama, monkeypatch):
+    monkeypatch.setattr(llm_optimizer, "MAP_REDUCE_FANIN", 0)
+    monkeypatch.setattr(llm_optimizer, "MAP_CHUNK_TIMEOUT", 60)
+    monkeypatch.setattr(llm_optimizer, "MAP_DEADLINE", 0.3)
+
+    messages = asyncio.run(asyncio.wait_for(llm_optimizer.map_reduce_messages(_conversation(20)), timeout=3))
+
+    assert "mensagem 0" in messages[1]["content"]
+    assert messages[-1]["content"].startswith("Current request:")
+
+
+def test_summaries_are_folded_as_a_tree(llm_optimizer, slow_ollama, monkeypatch):
+    monkeypatch.setattr(llm_optimizer, "MAP_REDUCE_FANIN", 2)
+    chunks = llm_optimizer.chunk_messages(_conversation(60)[1:])  # sem o chunk lento
+    folds = llm_optimizer.map_folds.labels(result="ok")
+    before = folds._value.get()
+
+    texts, missing = asyncio.run(llm_optimizer.map_phase(chunks, 0.0))
+
+    assert missing == 0
+    assert texts == ["fold", "fold"]
+    # Um nó por par de chunks + níveis superiores; prompts iguais saem do memo
+    assert folds._value.get() - before >= len(chunks) // 2
+    assert slow_ollama["fold_calls"] < folds._value.get() - before
@@ -0,0 +1,28 @@
+import asyncio
+
+
+def test_http_client_is_shared_and_closed_on_shutdown(llm_optimizer):
+    async def scenario():
+        a = llm_optimizer.get_http_client("http://ollama-a:11434")
+        b = llm_optimizer.get_http_client("http://ollama-a:11434")
+        c = llm_optimizer.get_http_client("http://ollama-b:11434")
+        assert a is b
+        assert a is not c
+        await llm_optimizer.close_http_clients()
+        return a, c
+
+    a, c = asyncio.run(scenario())
+    assert a.is_closed and c.is_closed
+    assert llm_optimizer._http_clients == {}
+
+
+def test_pool_metrics_exported(llm_optimizer):
+    async def scenario():
+        llm_optimizer.get_http_client("http://pool-metrics:11434")
+        llm_optimizer.update_pool_metrics()
+        await llm_optimizer.close_http_clients()
+
+    asyncio.run(scenario())
+    text = llm_optimizer.generate_latest().decode()
+    assert 'llm_optimizer_pool_connections{host="http://pool-metrics:11434",state="idle"} 0.0' in text
+    assert 'llm_optimizer_pool_connections{host="http://pool-metrics:11434",state="in_use"} 0.0' in text
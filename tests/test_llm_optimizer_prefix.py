@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import httpx
+
+
+SYSTEM = {"role": "system", "content": "Você é o CLINE. " + "ferramenta " * 200}
+
+
+def _turns(*contents):
+    return [SYSTEM] + [{"role": "user", "content": c} for c in contents]
+
+
+def test_avoided_tokens_come_from_reported_prompt_eval_count(llm_optimizer):
+    messages = _turns("primeira", "segunda")
+    estimated = sum(llm_optimizer.estimate_tokens(m["content"]) for m in messages)
+    hits = llm_optimizer.prefix_reuse.labels(model="eval-test", result="hit")
+    before = hits._value.get()
+
+    # Só a última mensagem foi avaliada: o resto veio do KV cache
+    warm = {"prompt_eval_count": llm_optimizer.estimate_tokens("segunda"), "eval_count": 5}
+    assert llm_optimizer.record_prefix_reuse("eval-test", messages, warm) == \
+        estimated - llm_optimizer.estimate_tokens("segunda")
+    # Prompt inteiro reavaliado (a contagem real passa da estimativa): nada evitado
+    assert llm_optimizer.record_prefix_reuse("eval-test", messages, {"prompt_eval_count": estimated + 40,
+                                                                     "eval_count": 5}) == 0
+    # Ollama omite prompt_eval_count quando nada foi avaliado
+    assert llm_optimizer.record_prefix_reuse("eval-test", messages, {"eval_count": 5}) == estimated
+    # Sem métricas na resposta: não conta
+    assert llm_optimizer.record_prefix_reuse("eval-test", messages, {}) == 0
+    assert hits._value.get() - before == 2
+
+
+def test_call_ollama_pins_model_and_counts_avoided_tokens(llm_optimizer, monkeypatch):
+    payloads = []
+
+    def handler(request):
+        payloads.append(json.loads(request.content))
+        # 2ª chamada: Ollama só avalia a mensagem nova
+        evaluated = 500 if len(payloads) == 1 else llm_optimizer.estimate_tokens("dois")
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True,
+                                         "prompt_eval_count": evaluated, "eval_count": 1})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST, client)
+    counter = llm_optimizer.prompt_eval_tokens_avoided.labels(model="pin-test")
+    before = counter._value.get()
+
+    async def scenario():
+        await llm_optimizer.call_ollama("pin-test", _turns("um"))
+        await llm_optimizer.call_ollama("pin-test", _turns("um", "dois"))
+
+    asyncio.run(scenario())
+
+    assert all(p["keep_alive"] == llm_optimizer.OLLAMA_KEEP_ALIVE for p in payloads)
+    assert counter._value.get() - before >= llm_optimizer.estimate_tokens(SYSTEM["content"])
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def race_ollama(llm_optimizer, monkeypatch):
+    """Ollama simulado: atraso e texto configuráveis por modelo."""
+    behaviour = {}
+    calls = []
+
+    async def handler(request):
+        model = json.loads(request.content)["model"]
+        calls.append(model)
+        delay, text, *error = behaviour[model]
+
+        async def body():
+            await asyncio.sleep(delay)
+            yield (json.dumps({"message": {"content": text}, "done": False}) + "\n").encode()
+            if error:
+                yield (json.dumps({"error": error[0]}) + "\n").encode()
+                return
+            yield (json.dumps({"message": {"content": ""}, "done": True}) + "\n").encode()
+
+        return httpx.Response(200, content=body())
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RACE_BUDGET", 0.05)
+    monkeypatch.setattr(llm_optimizer, "race_stats", llm_optimizer.RaceStats())
+    return behaviour, calls
+
+
+def _race(llm_optimizer):
+    return asyncio.run(llm_optimizer.strategy_r([{"role": "user", "content": "x" * 8000}], 0.0))
+
+
+def test_fast_valid_light_model_wins_alone(llm_optimizer, race_ollama):
+    behaviour, calls = race_ollama
+    behaviour.update({llm_optimizer.MODEL_LIGHTER: (0, "<read_file><path>a.py</path></read_file>"),
+                      llm_optimizer.MODEL_FAST: (0, "pesado")})
+
+    result = _race(llm_optimizer)
+
+    assert result["choices"][0]["message"]["content"].startswith("<read_file>")
+    assert calls == [llm_optimizer.MODEL_LIGHTER]
+    assert llm_optimizer.race_stats.light_win_rate("2000-2500") == 1.0
+
+
+def test_slow_light_model_loses_and_is_cancelled(llm_optimizer, race_ollama):
+    behaviour, calls = race_ollama
+    behaviour.update({llm_optimizer.MODEL_LIGHTER: (5, "lento"),
+                      llm_optimizer.MODEL_FAST: (0, "<attempt_completion>ok</attempt_completion>")})
+
+    result = _race(llm_optimizer)
+
+    assert result["model"] == llm_optimizer.MODEL_FAST
+    assert result["choices"][0]["message"]["content"].startswith("<attempt_completion>")
+    assert llm_optimizer.model_stats.inflight(llm_optimizer.MODEL_LIGHTER) == 0
+    assert llm_optimizer.race_stats.light_win_rate("2000-2500") == 0.0
+
+
+def test_malformed_tool_call_starts_heavy_model(llm_optimizer, race_ollama):
+    behaviour, _ = race_ollama
+    behaviour.update({llm_optimizer.MODEL_LIGHTER: (0, "< read_file path=a.py"),
+                      llm_optimizer.MODEL_FAST: (0.01, "<read_file><path>a.py</path></read_file>")})
+    invalid = llm_optimizer.race_heavy_started.labels(band="2000-2500", reason="invalid")
+    before = invalid._value.get()
+
+    result = _race(llm_optimizer)
+
+    assert result["model"] == llm_optimizer.MODEL_FAST
+    assert invalid._value.get() - before == 1
+
+
+def test_winning_lane_failing_after_valid_prefix_returns_fallback(llm_optimizer, race_ollama):
+    behaviour, _ = race_ollama
+    behaviour.update({llm_optimizer.MODEL_LIGHTER: (0, "<read_file><path>a.py", "model runner crashed"),
+                      llm_optimizer.MODEL_FAST: (5, "pesado")})
+
+    result = _race(llm_optimizer)
+
+    assert llm_optimizer.is_fallback_response(result)
+    assert result["choices"][0]["message"]["content"] == "[LLM-Optimizer Error] model runner crashed"
+
+
+def test_prefix_validation_only_checks_tool_markup(llm_optimizer):
+    valid = llm_optimizer.tool_prefix_valid
+
+    assert valid("Use `a < b` para comparar; <br> não é ferramenta")
+    assert valid("<read_file><path>a<b>.py</path>")  # valor de parâmetro é texto livre
+    assert valid("<thinking>x < y</thinking>\n<read_fi")
+    assert not valid("< read_file path=a.py")
+    assert not valid("</read_file>sobrou o fechamento")
+    assert not valid("[LLM-Optimizer Error] Timeout")
+
+
+def test_win_rate_feeds_band_decision(llm_optimizer):
+    stats = llm_optimizer.RaceStats(min_samples=4, explore=0.0)
+    policy = llm_optimizer.RacingPolicy(llm_optimizer.StaticThresholdPolicy(), stats,
+                                        band_min=1500, band_max=3000)
+
+    assert policy.choose(1000, 1, None) == "A"   # fora da faixa
+    assert policy.choose(2100, 1, None) == "R"   # sem amostras: corre
+    for _ in range(4):
+        stats.record("2000-2500", "light")
+        stats.record("2500-3000", "heavy")
+    assert policy.choose(2100, 1, None) == "B"
+    assert policy.choose(2600, 1, None) == "A"
+    assert policy.choose(7000, 1, None) == "C"
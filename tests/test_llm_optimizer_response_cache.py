@@ -0,0 +1,113 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def cache(llm_optimizer, tmp_path, monkeypatch):
+    cache = llm_optimizer.ResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2, ttl=3600)
+    monkeypatch.setattr(llm_optimizer, "response_cache", cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def ollama_calls(llm_optimizer, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": f"resposta {len(calls)}"}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST, client)
+    return calls
+
+
+def _post(client, content, temperature=0, headers=None):
+    return client.post("/v1/chat/completions", headers=headers or {}, json={
+        "model": "qwen3:4b",
+        "temperature": temperature,
+        "messages": [{"role": "user", "content": content}],
+    })
+
+
+def test_deterministic_requests_are_served_from_cache(llm_optimizer, cache, ollama_calls):
+    client = TestClient(llm_optimizer.app)
+
+    first = _post(client, "explique o arquivo")
+    second = _post(client, "explique o arquivo")
+
+    assert first.headers["x-llm-optimizer-cache"] == "miss"
+    assert second.headers["x-llm-optimizer-cache"] == "hit"
+    assert second.json()["choices"][0]["message"]["content"] == "resposta 1"
+    assert len(ollama_calls) == 1
+
+
+def test_bypass_header_and_sampled_temperature_skip_cache(llm_optimizer, cache, ollama_calls):
+    client = TestClient(llm_optimizer.app)
+
+    _post(client, "liste os arquivos")
+    bypass = _post(client, "liste os arquivos", headers={"X-LLM-Optimizer-Cache": "bypass"})
+    sampled = _post(client, "liste os diretórios", temperature=0.7)
+
+    assert bypass.headers["x-llm-optimizer-cache"] == "bypass"
+    assert sampled.headers["x-llm-optimizer-cache"] == "off"
+    assert len(ollama_calls) == 3
+
+
+def test_cache_persists_and_evicts_least_recently_used(llm_optimizer, cache, tmp_path):
+    cache.put("a", {"id": "a"})
+    cache.put("b", {"id": "b"})
+    assert cache.get("a") == {"id": "a"}  # "a" passa a ser o mais recente
+    cache.put("c", {"id": "c"})
+
+    reopened = llm_optimizer.ResponseCache(cache.path, max_entries=2, ttl=3600)
+    assert reopened.get("b") is None
+    assert reopened.get("a") == {"id": "a"}
+    assert reopened.get("c") == {"id": "c"}
+    reopened.close()
+
+
+def test_expired_entries_are_dropped(llm_optimizer, tmp_path):
+    cache = llm_optimizer.ResponseCache(str(tmp_path / "ttl.sqlite3"), max_entries=10, ttl=-1)
+    cache.put("k", {"id": "k"})
+    assert cache.get("k") is None
+    cache.close()
+
+
+def test_cache_key_carries_format_version(llm_optimizer, monkeypatch):
+    messages = [{"role": "user", "content": "oi"}]
+    current = llm_optimizer.response_cache_key(messages, "m", 0.0, None)
+    monkeypatch.setattr(llm_optimizer, "CACHE_KEY_VERSION", llm_optimizer.CACHE_KEY_VERSION + 1)
+
+    assert llm_optimizer.response_cache_key(messages, "m", 0.0, None) != current
+
+
+def test_stream_cut_off_by_upstream_error_is_not_cached(llm_optimizer, cache, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if json.loads(request.content)["stream"]:
+            lines = [{"message": {"content": "metade da respo"}, "done": False},
+                     {"error": "model runner crashed"}]
+            return httpx.Response(200, content="\n".join(json.dumps(line) for line in lines))
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "resposta inteira"}})
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    client = TestClient(llm_optimizer.app)
+    body = {"model": "qwen3:4b", "temperature": 0, "stream": True,
+            "messages": [{"role": "user", "content": "stream cortado"}]}
+    with client.stream("POST", "/v1/chat/completions", json=body) as resp:
+        streamed = "".join(resp.iter_text())
+
+    again = _post(client, "stream cortado")
+
+    assert "metade da respo" in streamed and "model runner crashed" in streamed
+    assert again.headers["x-llm-optimizer-cache"] == "miss"
+    assert again.json()["choices"][0]["message"]["content"] == "resposta inteira"
+    assert len(calls) == 2
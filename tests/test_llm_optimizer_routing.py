@@ -0,0 +1,73 @@
+import json
+
+
+def _stats(opt, fast_rate, light_rate, samples=10):
+    stats = opt.ModelStats(window=50)
+    for _ in range(samples):
+        stats.observe(opt.MODEL_FAST, 1000, 100, 1000 / fast_rate, 100 / fast_rate)
+        stats.observe(opt.MODEL_LIGHTER, 1000, 100, 1000 / light_rate, 100 / light_rate)
+    return stats
+
+
+def test_adaptive_policy_uses_static_thresholds_until_warm(llm_optimizer):
+    policy = llm_optimizer.LatencyAwarePolicy(min_samples=5)
+    cold = llm_optimizer.ModelStats()
+
+    assert policy.choose(1000, 2, cold) == "A"
+    assert policy.choose(4000, 2, cold) == "B"
+    assert policy.choose(9000, 20, cold) == "C"
+
+
+def test_adaptive_policy_upgrades_to_heavy_model_when_it_is_idle_and_fast(llm_optimizer):
+    policy = llm_optimizer.LatencyAwarePolicy(min_samples=5, quality_slack=0.25)
+    stats = _stats(llm_optimizer, fast_rate=100.0, light_rate=110.0)
+
+    assert policy.choose(4000, 4, stats) == "A"
+
+
+def test_adaptive_policy_avoids_queued_model(llm_optimizer):
+    policy = llm_optimizer.LatencyAwarePolicy(min_samples=5, quality_slack=0.25)
+    stats = _stats(llm_optimizer, fast_rate=100.0, light_rate=110.0)
+    for _ in range(5):
+        stats.begin(llm_optimizer.MODEL_FAST)
+
+    assert policy.choose(4000, 4, stats) == "B"
+
+
+def test_adaptive_policy_skips_map_reduce_when_direct_call_fits_and_is_faster(llm_optimizer):
+    policy = llm_optimizer.LatencyAwarePolicy(min_samples=5, context_limit=8192, quality_slack=0.0)
+    stats = _stats(llm_optimizer, fast_rate=10.0, light_rate=100.0)
+
+    assert policy.choose(7000, 40, stats) == "B"
+    # Não cabe no contexto → continua no Map-Reduce
+    assert policy.choose(20000, 40, stats) == "C"
+
+
+def test_adaptive_policy_survives_fully_cached_prompts(llm_optimizer):
+    """Prompt inteiro em cache: o Ollama não manda prompt_eval_* → sem taxa de prompt."""
+    policy = llm_optimizer.LatencyAwarePolicy(min_samples=5)
+    stats = llm_optimizer.ModelStats(window=50)
+    for _ in range(10):
+        for model in (llm_optimizer.MODEL_FAST, llm_optimizer.MODEL_LIGHTER):
+            stats.observe_ollama(model, {"eval_count": 100, "eval_duration": 1e9})
+
+    assert stats.prompt_rate(llm_optimizer.MODEL_FAST) is None
+    assert policy.choose(4000, 4, stats) == "B"
+    assert policy.choose(9000, 20, stats) == "C"
+
+
+def test_routing_log_is_written_off_the_event_loop(llm_optimizer, tmp_path, monkeypatch):
+    path = tmp_path / "routing.jsonl"
+    monkeypatch.setattr(llm_optimizer, "ROUTING_LOG_PATH", str(path))
+    monkeypatch.setattr(llm_optimizer, "routing_log_writer", None)
+
+    for i in range(3):
+        llm_optimizer.log_routing_event({"type": "request", "tokens": i})
+    writer = llm_optimizer.routing_log_writer
+    assert writer is not None and writer._thread.is_alive()
+    llm_optimizer.stop_routing_log()
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [e["tokens"] for e in events] == [0, 1, 2]
+    assert all("ts" in e for e in events)
+    assert llm_optimizer.routing_log_writer is None
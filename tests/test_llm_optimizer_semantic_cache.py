@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+def _vector(text):
+    """Embedding de brinquedo: um eixo por assunto, ignora timestamps."""
+    if "util.py" in text:
+        return [1.0, 0.0, 0.0]
+    if "resposta nova" in text:
+        return [0.0, 0.0, 1.0]
+    return [0.0, 1.0, 0.0]
+
+
+@pytest.fixture
+def fake_ollama(llm_optimizer, monkeypatch):
+    state = {"chat": 0, "answer": "util.py define helpers"}
+
+    def handler(request):
+        payload = json.loads(request.content)
+        if request.url.path == "/api/embeddings":
+            return httpx.Response(200, json={"embedding": _vector(payload["prompt"])})
+        state["chat"] += 1
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": state["answer"]},
+                                         "prompt_eval_duration": 1_000_000})
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_optimizer, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm_optimizer, "SEMANTIC_CACHE_VERIFY_RATE", 0.0)
+    monkeypatch.setattr(llm_optimizer, "semantic_cache", llm_optimizer.SemanticCache(max_entries=10, use_hnsw=False))
+    return state
+
+
+def _ask(client, text, system="Você é o CLINE."):
+    return client.post("/v1/chat/completions", json={
+        "model": "qwen3:4b", "temperature": 0,
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": text}],
+    })
+
+
+def test_near_duplicate_read_only_prompt_hits(llm_optimizer, fake_ollama):
+    client = TestClient(llm_optimizer.app)
+
+    first = _ask(client, "Explain util.py (2026-10-17 10:00)")
+    second = _ask(client, "Explain util.py (2026-10-17 10:05)")
+    other_system = _ask(client, "Explain util.py (2026-10-17 10:06)", system="Outro system prompt")
+    write = _ask(client, "Fix util.py (2026-10-17 10:07)")
+
+    assert first.headers["x-llm-optimizer-cache"] == "off"
+    assert second.headers["x-llm-optimizer-cache"] == "semantic"
+    assert second.json()["choices"][0]["message"]["content"] == "util.py define helpers"
+    assert other_system.headers["x-llm-optimizer-cache"] == "off"
+    assert write.headers["x-llm-optimizer-cache"] == "off"
+    assert fake_ollama["chat"] == 3
+
+
+def test_lru_eviction_and_partition_filter(llm_optimizer):
+    cache = llm_optimizer.SemanticCache(max_entries=2, threshold=0.9, use_hnsw=False)
+    vec = llm_optimizer.normalize_vector
+    query = llm_optimizer.SemanticQuery
+
+    cache.store(query("p1", "a", vec([1, 0])), {"id": "a"})
+    cache.store(query("p2", "b", vec([1, 0])), {"id": "b"})
+    cache.store(query("p1", "c", vec([0, 1])), {"id": "c"})
+
+    assert len(cache.index) == 2
+    assert cache.lookup(query("p1", "a'", vec([1, 0.05]))) is None  # "a" foi removida (LRU)
+    _, response, similarity = cache.lookup(query("p2", "b'", vec([1, 0.05])))
+    assert response == {"id": "b"} and similarity > 0.99
+
+
+def test_sampled_false_hit_is_counted_and_evicted(llm_optimizer, fake_ollama):
+    cache = llm_optimizer.semantic_cache
+    false_hits = llm_optimizer.semantic_cache_verifications.labels(result="false_hit")
+    before = false_hits._value.get()
+    messages = [{"role": "user", "content": "Explain util.py"}]
+    cache.store(llm_optimizer.SemanticQuery("p", "Explain util.py", llm_optimizer.normalize_vector([1, 0, 0])),
+                {"choices": [{"message": {"content": "util.py antigo"}}]})
+    fake_ollama["answer"] = "resposta nova"
+
+    strategy_requests = llm_optimizer.requests_total.labels(strategy="A")
+    requests_before = strategy_requests._value.get()
+
+    async def scenario():
+        trace = llm_optimizer.begin_trace()
+        llm_optimizer.schedule_semantic_verification(0, messages, 0.0, "A", cache._entries[0]["response"])
+        assert len(llm_optimizer._verify_tasks) == 1
+        await asyncio.gather(*llm_optimizer._verify_tasks)
+        return trace
+
+    trace = asyncio.run(scenario())
+
+    assert false_hits._value.get() - before == 1
+    assert len(cache.index) == 0
+    assert not llm_optimizer._verify_tasks
+    assert strategy_requests._value.get() == requests_before  # não conta como request da estratégia
+    assert trace.stages == {}  # verificação fora do trace do request
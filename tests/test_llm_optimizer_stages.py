@@ -0,0 +1,64 @@
+import httpx
+from fastapi.testclient import TestClient
+
+
+def _sample_count(histogram, stage):
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") and sample.labels.get("stage") == stage:
+                return sample.value
+    return 0.0
+
+
+def test_request_breakdown_and_debug_slow(llm_optimizer, monkeypatch):
+    def handler(request):
+        return httpx.Response(200, json={
+            "message": {"role": "assistant", "content": "ok"},
+            "prompt_eval_duration": 300_000_000,
+            "eval_duration": 700_000_000,
+        })
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_optimizer, "_recent_traces", llm_optimizer.deque(maxlen=10))
+    before = _sample_count(llm_optimizer.stage_histogram, "ollama_eval")
+
+    client = TestClient(llm_optimizer.app)
+    for text in ("etapas um", "etapas dois"):
+        resp = client.post("/v1/chat/completions", json={
+            "model": "qwen3:4b", "messages": [{"role": "user", "content": text}],
+        })
+        assert resp.status_code == 200
+
+    slow = client.get("/debug/slow", params={"n": 1}).json()
+
+    assert slow["window"] == 2 and len(slow["requests"]) == 1
+    stages = slow["requests"][0]["stages"]
+    assert {"parse", "validate", "sanitize", "queue_wait", "response_validate"} <= set(stages)
+    assert stages["ollama_prompt_eval"] == 0.3 and stages["ollama_eval"] == 0.7
+    assert _sample_count(llm_optimizer.stage_histogram, "ollama_eval") - before == 2
+
+
+def test_stream_trace_closes_at_end_of_stream(llm_optimizer, monkeypatch):
+    def handler(request):
+        lines = [
+            '{"message": {"content": "a"}, "done": false}',
+            '{"message": {"content": "b"}, "done": true, "eval_duration": 500000000}',
+        ]
+        return httpx.Response(200, content="\n".join(lines))
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_optimizer, "_recent_traces", llm_optimizer.deque(maxlen=10))
+
+    client = TestClient(llm_optimizer.app)
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": "qwen3:4b", "stream": True, "messages": [{"role": "user", "content": "stream etapas"}],
+    }) as resp:
+        body = "".join(resp.iter_text())
+
+    assert body.endswith("data: [DONE]\n\n")
+    (trace,) = llm_optimizer._recent_traces
+    assert trace.stages["ollama_eval"] == 0.5 and trace.total > 0
@@ -0,0 +1,72 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+def _ndjson(*objs):
+    return "".join(json.dumps(o) + "\n" for o in objs).encode()
+
+
+@pytest.fixture
+def fake_ollama(llm_optimizer, monkeypatch):
+    """Substitui o Ollama por um MockTransport que responde NDJSON em streaming."""
+    calls = []
+
+    def handler(request):
+        payload = json.loads(request.content)
+        calls.append(payload)
+        if payload["stream"]:
+            body = _ndjson(
+                {"message": {"role": "assistant", "content": "po"}, "done": False},
+                {"message": {"role": "assistant", "content": "ng"}, "done": False},
+                {"message": {"role": "assistant", "content": ""}, "done": True, "eval_count": 2},
+            )
+            return httpx.Response(200, content=body)
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "resumo"}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST, client)
+    return calls
+
+
+def _read_sse(resp):
+    events = [line[len("data: "):] for line in resp.text.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    return [json.loads(e) for e in events[:-1]]
+
+
+def test_stream_relays_ollama_chunks_as_sse(llm_optimizer, fake_ollama):
+    client = TestClient(llm_optimizer.app)
+    resp = client.post("/v1/chat/completions", json={
+        "model": "qwen3:4b",
+        "stream": True,
+        "messages": [{"role": "user", "content": "ping"}],
+    })
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+
+    chunks = _read_sse(resp)
+    assert all(c["object"] == "chat.completion.chunk" for c in chunks)
+    assert chunks[0]["choices"][0]["delta"]["role"] == "assistant"
+    content = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks)
+    assert content == "pong"
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert fake_ollama[-1]["stream"] is True
+
+
+def test_stream_strategy_c_streams_reduce_phase(llm_optimizer, fake_ollama):
+    client = TestClient(llm_optimizer.app)
+    big = "x" * (llm_optimizer.STRATEGY_B_MAX * 4 + 100)
+    resp = client.post("/v1/chat/completions", json={
+        "model": "qwen3:4b",
+        "stream": True,
+        "messages": [{"role": "user", "content": big}, {"role": "user", "content": "agora responda"}],
+    })
+
+    chunks = _read_sse(resp)
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks) == "pong"
+    # MAP sem stream, REDUCE com stream
+    assert [c["stream"] for c in fake_ollama] == [False, True]
@@ -0,0 +1,49 @@
+import pytest
+
+
+@pytest.fixture
+def word_tokenizer(tmp_path):
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+
+    tok = tokenizers.Tokenizer(WordLevel({"[UNK]": 0, "ola": 1, "mundo": 2}, unk_token="[UNK]"))
+    tok.pre_tokenizer = Whitespace()
+    path = tmp_path / "tokenizer.json"
+    tok.save(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def restore_counter(llm_optimizer):
+    original = llm_optimizer.get_token_counter()
+    yield
+    llm_optimizer.set_token_counter(original)
+
+
+def test_tokenizer_counter_uses_real_vocabulary(llm_optimizer, word_tokenizer, restore_counter):
+    counter = llm_optimizer.TokenizerFileCounter(word_tokenizer)
+    assert counter._tokenizer is None  # carregado sob demanda
+    assert counter.count("ola mundo ola <tag>") == 6
+    assert counter._tokenizer is not None
+
+
+def test_missing_tokenizer_falls_back_to_heuristic(llm_optimizer, tmp_path, restore_counter):
+    counter = llm_optimizer.TokenizerFileCounter(str(tmp_path / "nao-existe.json"))
+    assert counter.count("x" * 40) == 10
+
+
+def test_estimate_tokens_memoizes_per_text(llm_optimizer, restore_counter):
+    calls = []
+
+    class CountingCounter:
+        name = "counting"
+
+        def count(self, text):
+            calls.append(text)
+            return len(text.split())
+
+    llm_optimizer.set_token_counter(CountingCounter())
+    assert llm_optimizer.estimate_tokens("um dois tres") == 3
+    assert llm_optimizer.estimate_tokens("um dois tres") == 3
+    assert calls == ["um dois tres"]
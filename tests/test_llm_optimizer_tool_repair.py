@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+def _feed_in_pieces(validator, text, size=3):
+    return "".join(validator.feed(text[i:i + size]) for i in range(0, len(text), size)) + validator.finish()
+
+
+def test_valid_tool_call_passes_unchanged_in_any_split(llm_optimizer):
+    text = ("<thinking>ler a < b</thinking>\n<write_to_file>\n<path>a.html</path>\n"
+            "<content><div>if (a < b) {}</div></content>\n</write_to_file>")
+    for size in (1, 3, 7, 100):
+        validator = llm_optimizer.ToolXmlValidator()
+        assert _feed_in_pieces(validator, text, size) == text
+        assert not validator.repairs and not validator.truncated
+
+
+def test_mismatched_and_stray_tags_are_rewritten(llm_optimizer):
+    validator = llm_optimizer.ToolXmlValidator()
+
+    out = _feed_in_pieces(validator, "</read_file><execute_command><command>ls</execute_command>"
+                                     "<read_file><path>a</path></read_fil>")
+
+    assert out == ("<execute_command><command>ls</command></execute_command>"
+                   "<read_file><path>a</path></read_file>")
+    assert validator.repairs == ["stray_close", "mismatch", "mismatch"]
+
+
+@pytest.fixture
+def continuing_ollama(llm_optimizer, monkeypatch):
+    seen = []
+
+    def handler(request):
+        payload = json.loads(request.content)
+        seen.append(payload)
+        if payload["stream"]:
+            lines = [{"message": {"content": "<execute_command>\n<command>ls -"}, "done": False},
+                     {"message": {"content": ""}, "done": True}]
+            return httpx.Response(200, content="\n".join(json.dumps(l) for l in lines))
+        return httpx.Response(200, json={"message": {"role": "assistant",
+                                                     "content": "la</command>\n</execute_command>"}})
+
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST,
+                        httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+    return seen
+
+
+def test_truncated_stream_gets_short_continuation(llm_optimizer, continuing_ollama):
+    continued = llm_optimizer.tool_repairs.labels(kind="continued")
+    before = continued._value.get()
+
+    client = TestClient(llm_optimizer.app)
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": "qwen3:4b", "stream": True, "messages": [{"role": "user", "content": "liste os arquivos"}],
+    }) as resp:
+        events = [line[6:] for line in resp.iter_lines() if line.startswith("data: ") and line != "data: [DONE]"]
+
+    content = "".join(json.loads(e)["choices"][0]["delta"].get("content") or "" for e in events)
+    assert content == "<execute_command>\n<command>ls -la</command>\n</execute_command>"
+    repair_call = continuing_ollama[-1]
+    assert repair_call["messages"][-1] == {"role": "assistant", "content": "<execute_command>\n<command>ls -"}
+    assert repair_call["options"]["num_predict"] == llm_optimizer.TOOL_REPAIR_MAX_TOKENS
+    assert continued._value.get() - before == 1
+
+
+def test_truncated_response_without_continuation_is_closed(llm_optimizer):
+    result = {"model": "m", "choices": [{"message": {"role": "assistant",
+                                                     "content": "<read_file><path>a.py"}}]}
+
+    repaired = asyncio.run(llm_optimizer.repair_tool_response(result, [], 0.0, 0.0, allow_continuation=False))
+
+    assert repaired["choices"][0]["message"]["content"] == "<read_file><path>a.py</path></read_file>"
+
+
+def test_held_fragment_is_flushed_before_error_and_at_stream_end(llm_optimizer):
+    def chunk(content):
+        return llm_optimizer.create_chunk("c1", "m", 0, {"content": content})
+
+    async def upstream(*contents):
+        for content in contents:
+            yield chunk(content)
+
+    async def collect(stream):
+        return [c["choices"][0]["delta"]["content"]
+                async for c in llm_optimizer.tool_repair_stream(stream, [], 0.0)]
+
+    with_error = asyncio.run(collect(upstream("texto <rea", "[LLM-Optimizer Error] Timeout after 5s")))
+    cut_off = asyncio.run(collect(upstream("resposta termina em <")))
+
+    assert with_error == ["texto ", "<rea", "[LLM-Optimizer Error] Timeout after 5s"]
+    assert "".join(cut_off) == "resposta termina em <"
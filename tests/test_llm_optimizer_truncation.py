@@ -0,0 +1,49 @@
+def _prompt():
+    identity = "Você é o CLINE, um engenheiro de software. " * 200
+    tools = "## Tools\n<tools><tool_name>execute_command</tool_name> roda comandos</tools>\n"
+    rules = "## Regras\nResponda sempre com uma ferramenta. " * 200
+    return identity + tools + rules
+
+
+def test_overlapping_tool_spans_are_merged(llm_optimizer):
+    content = "intro <tools><tool_name>read_file</tool_name></tools> meio read_file fim"
+
+    spans = llm_optimizer.find_tool_spans(content)
+
+    assert [content[a:b] for a, b in spans] == [
+        "<tools><tool_name>read_file</tool_name></tools>",
+        "read_file",
+    ]
+
+
+def test_truncation_keeps_tools_once_and_respects_budget(llm_optimizer):
+    content = _prompt()
+
+    result = llm_optimizer.smart_truncate_system_prompt(content, max_tokens=500)
+
+    assert len(result) < len(content)
+    assert result.count("<tool_name>execute_command</tool_name>") == 1
+    assert result.startswith("Você é o CLINE")
+
+
+def test_truncation_is_memoized_by_prompt(llm_optimizer):
+    content = _prompt() + "variante memo"
+    hits = llm_optimizer.truncation_cache.labels(result="hit")
+    before = hits._value.get()
+
+    first = llm_optimizer.smart_truncate_system_prompt(content, max_tokens=500)
+    second = llm_optimizer.smart_truncate_system_prompt(content, max_tokens=500)
+    short = "prompt curto"
+
+    assert first == second
+    assert hits._value.get() - before == 1
+    assert llm_optimizer.smart_truncate_system_prompt(short) is short
+    assert llm_optimizer.smart_truncate_system_prompt(short) is short
+
+
+def test_spans_keep_offsets_when_lowercase_changes_length(llm_optimizer):
+    content = "İstanbul READ_FILE <TOOLS>x</TOOLS>"
+
+    spans = llm_optimizer.find_tool_spans(content)
+
+    assert [content[a:b] for a, b in spans] == ["READ_FILE", "<TOOLS>x</TOOLS>"]
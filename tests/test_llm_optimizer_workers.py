@@ -0,0 +1,133 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+
+import httpx
+from fastapi.testclient import TestClient
+
+
+def _workers(llm_optimizer, tmp_path, n=2):
+    """Simula n workers: instâncias separadas (conexões próprias) no mesmo arquivo."""
+    path = str(tmp_path / "state.sqlite3")
+    pids = [os.getpid(), os.getppid(), 1]  # processos vivos: claims não são tratados como abandonados
+    return [llm_optimizer.SharedState(path, poll_interval=0.01, pid=pids[i]) for i in range(n)]
+
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_dedup_result_is_shared_between_workers(llm_optimizer, tmp_path):
+    owner, other = _workers(llm_optimizer, tmp_path)
+
+    async def scenario():
+        assert owner.claim("k")
+        assert not other.claim("k")
+        waiter = asyncio.create_task(other.wait_result("k", timeout=2))
+        await asyncio.sleep(0.05)
+        owner.publish("k", {"id": "r1"})
+        return await waiter
+
+    assert asyncio.run(scenario()) == {"id": "r1"}
+
+
+def test_dead_worker_claims_and_slots_are_reaped(llm_optimizer, tmp_path):
+    dead, alive = _workers(llm_optimizer, tmp_path)
+    assert dead.claim("k")
+    slot = dead.enqueue("m", llm_optimizer.PRIORITY_INTERACTIVE)
+    assert dead.try_activate(slot, "m", llm_optimizer.PRIORITY_INTERACTIVE, capacity=1)
+
+    alive.reap(dead.pid)
+
+    assert asyncio.run(alive.wait_result("k", timeout=1)) is None
+    assert alive.claim("k")
+    assert alive.counts("m") == (0, 0)
+
+
+def test_claim_outlives_timeout_each_but_not_its_owner(llm_optimizer, tmp_path, monkeypatch):
+    owner, other = _workers(llm_optimizer, tmp_path)
+    assert owner.claim("longo")
+    real_time = llm_optimizer.time.time
+    monkeypatch.setattr(llm_optimizer.time, "time", lambda: real_time() + llm_optimizer.TIMEOUT_EACH * 2)
+    assert not other.claim("longo")  # estratégia C ainda rodando no dono
+
+    crashed = llm_optimizer.SharedState(owner.path, poll_interval=0.01, pid=_dead_pid())
+    assert crashed.claim("orfao")
+    assert asyncio.run(other.wait_result("orfao", timeout=1)) is None
+    assert other.claim("orfao")
+
+
+def test_admission_capacity_and_priority_span_workers(llm_optimizer, tmp_path):
+    states = _workers(llm_optimizer, tmp_path, n=3)
+    controllers = [llm_optimizer.AdmissionController(concurrency=1, wait_budget=0, shared=s) for s in states]
+    order = []
+
+    async def call(controller, name, priority, hold=0.01):
+        async with controller.slot(llm_optimizer.MODEL_FAST, priority):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario():
+        first = asyncio.create_task(call(controllers[0], "first", llm_optimizer.PRIORITY_BULK, hold=0.1))
+        await asyncio.sleep(0.03)
+        bulk = asyncio.create_task(call(controllers[1], "map", llm_optimizer.PRIORITY_BULK))
+        await asyncio.sleep(0.03)
+        chat = asyncio.create_task(call(controllers[2], "chat", llm_optimizer.PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.03)
+        assert controllers[0].queue_length(llm_optimizer.MODEL_FAST) == 2
+        await asyncio.gather(first, bulk, chat)
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+    assert order == ["first", "chat", "map"]
+    assert states[0].counts(llm_optimizer.MODEL_FAST) == (0, 0)
+
+
+def test_shared_admission_never_blocks_the_event_loop_on_the_state_lock(llm_optimizer, tmp_path):
+    (state,) = _workers(llm_optimizer, tmp_path, n=1)
+    controller = llm_optimizer.AdmissionController(concurrency=1, wait_budget=600, shared=state)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        async with controller.slot(llm_optimizer.MODEL_FAST):
+            # Outra thread (ex.: try_activate esperando o busy timeout) segura o lock
+            state._lock.acquire()
+            threading.Timer(0.2, state._lock.release).start()
+            tick_task = asyncio.create_task(ticker())
+            await controller.check(llm_optimizer.MODEL_FAST)
+            await asyncio.sleep(0)
+        tick_task.cancel()
+        return len(ticks)
+
+    assert asyncio.run(asyncio.wait_for(scenario(), timeout=5)) >= 5
+    assert state.counts(llm_optimizer.MODEL_FAST) == (0, 0)
+
+
+def test_endpoint_reuses_result_generated_by_other_worker(llm_optimizer, tmp_path, monkeypatch):
+    this_worker, other_worker = _workers(llm_optimizer, tmp_path)
+    calls = []
+    monkeypatch.setitem(llm_optimizer._http_clients, llm_optimizer.OLLAMA_HOST, httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: calls.append(request) or httpx.Response(500))))
+    monkeypatch.setattr(llm_optimizer, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_optimizer, "shared_state", this_worker)
+
+    messages = [{"role": "user", "content": "oi de dois workers"}]
+    hasher = llm_optimizer.MessageHasher()
+    llm_optimizer.sanitize_messages(messages, hasher)
+    key = hasher.hexdigest()
+    assert other_worker.claim(key)
+    other_worker.publish(key, {"id": "do-outro-worker", "choices": []})
+
+    resp = TestClient(llm_optimizer.app).post("/v1/chat/completions", json={"model": "qwen3:4b", "messages": messages})
+
+    assert resp.json()["id"] == "do-outro-worker"
+    assert calls == []